@@ -1,10 +1,35 @@
 # The below method extractCsv takes the fileName and newFileName, and we calculate the Data_value column sum upto 10 rows , and also store the value of three columns upto 10 rows into a new csv file. We also create a bar chart using matplotlib for the first 10 rows with x-axis = Period and y-axis = Data_value
+# For big exports use the streaming mode (python index.py stream), which has configurable columns, row filters and row limits and keeps memory flat for any file size
 import os
 import csv
-import matplotlib.pyplot as plt
+import json
+import hashlib
+import mmap
+import time
+import struct
+import shutil
+import tempfile
+from sys import argv
+from array import array
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
 
-# function for plotting the bar chart
-def createBarChart(csvPath):
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the columnar backend
+    np = None
+
+SELECTED_COLUMNS = ['Period', 'Data_value', 'Series_title_2']
+SUM_COLUMN = 'Data_value'
+
+# number of rows buffered before a single writerows call in streaming mode
+BATCH_SIZE = 10000
+
+# above this many bars the chart data is binned by period and then reduced with LTTB
+MAX_BARS = 500
+
+# function for plotting the bar chart, with outPath the chart is rendered headless to a PNG/SVG file instead of a window
+def createBarChart(csvPath, outPath=None):
     try:
         periods = []
         data_values = []
@@ -19,24 +44,104 @@ def createBarChart(csvPath):
                 except ValueError:
                     print(f"Skipping invalid Data_value: {row['Data_value']}")
         
+        drawBarChart(periods, data_values, outPath)
+    except Exception as e:
+        print(f"Error while drawing bar chart: {e}")    
+
+# matplotlib is imported only when a chart is drawn, so extraction-only runs don't pay its import cost.
+# The Agg backend is used when writing to a file or when there is no display (eg:- on a headless server)
+def loadPyplot(headless):
+    import matplotlib
+    if headless or (os.name == 'posix' and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY') and os.uname().sysname != 'Darwin'):
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+# sum the values of each period (in order of first appearance), as several series share the same period
+def binByPeriod(periods, data_values):
+    sums = {}
+    for period, value in zip(periods, data_values):
+        sums[period] = sums.get(period, 0.0) + float(value)
+    return list(sums.keys()), list(sums.values())
+
+# Largest-Triangle-Three-Buckets: indexes of `threshold` points that keep the visual shape of the series
+def largestTriangleThreeBuckets(values, threshold):
+    count = len(values)
+    if threshold >= count or threshold < 3:
+        return list(range(count))
+
+    selected = [0]
+    bucketSize = (count - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucketSize) + 1
+        end = int((bucket + 1) * bucketSize) + 1
+        # average point of the next bucket (the last point for the final bucket)
+        nextStart = end
+        nextEnd = min(int((bucket + 2) * bucketSize) + 1, count)
+        if nextStart >= nextEnd:
+            nextStart, nextEnd = count - 1, count
+        averageX = (nextStart + nextEnd - 1) / 2
+        averageY = sum(values[nextStart:nextEnd]) / (nextEnd - nextStart)
+
+        bestArea = -1.0
+        bestIndex = start
+        for index in range(start, end):
+            area = abs((previous - averageX) * (values[index] - values[previous]) - (previous - index) * (averageY - values[previous]))
+            if area > bestArea:
+                bestArea = area
+                bestIndex = index
+        selected.append(bestIndex)
+        previous = bestIndex
+    selected.append(count - 1)
+    return selected
+
+# bin by period and, if there are still more than maxBars periods, keep the LTTB selection of them
+def reduceChartData(periods, data_values, maxBars=MAX_BARS):
+    if len(periods) <= maxBars:
+        return list(periods), list(data_values), False
+    periods, data_values = binByPeriod(periods, data_values)
+    if len(periods) > maxBars:
+        keep = largestTriangleThreeBuckets(data_values, maxBars)
+        periods = [periods[i] for i in keep]
+        data_values = [data_values[i] for i in keep]
+    return periods, data_values, True
+
+# function for drawing the bar chart from already parsed periods and values (lists or numpy arrays).
+# Large inputs are reduced to at most maxBars bars, with outPath the chart is saved (PNG/SVG by extension) instead of shown
+def drawBarChart(periods, data_values, outPath=None, maxBars=MAX_BARS):
+    try:
+        periods, data_values, reduced = reduceChartData(periods, data_values, maxBars)
+        plt = loadPyplot(headless=outPath is not None)
+
         # Plot the bar chart
         plt.figure(figsize=(10, 6))
         plt.bar(periods, data_values, color='skyblue')
         plt.xlabel("Period", fontsize=12)
-        plt.ylabel("Data Value", fontsize=12)
+        plt.ylabel("Data Value (sum per period)" if reduced else "Data Value", fontsize=12)
         plt.title("Bar Chart of Data Values by Period", fontsize=14)
         plt.xticks(rotation=45)
+        if len(periods) > 50:
+            # keep the tick labels readable, a label on every bar would overlap
+            step = len(periods) // 50 + 1
+            plt.xticks(range(0, len(periods), step), periods[::step], rotation=45)
         plt.tight_layout()
-        plt.show()
+        if outPath:
+            plt.savefig(outPath)
+            print(f"Saved the bar chart to {outPath}")
+        else:
+            plt.show()
+        plt.close()
     except Exception as e:
         print(f"Error while drawing bar chart: {e}")    
 
 # function for extracting the csv to a new csv with less columns and less rows
-def extractCsv(fileName, newFileName):
+# rowLimit=None extracts every row and drawChart=False skips the bar chart (used by the benchmark)
+def extractCsv(fileName, newFileName, rowLimit=10, drawChart=True):
     totalSum=0
     count=0
-    selectedColumns = ['Period', 'Data_value', 'Series_title_2']
-    sumColName = 'Data_value'
+    selectedColumns = SELECTED_COLUMNS
+    sumColName = SUM_COLUMN
 
     try:
         currDir = os.path.dirname(__file__)
@@ -55,7 +160,7 @@ def extractCsv(fileName, newFileName):
                 
                 # Iterate through rows and write only selected columns for first 10 rows
                 for row in reader:
-                    if count >= 10:  # Stop after 10 rows
+                    if rowLimit is not None and count >= rowLimit:  # Stop after 10 rows
                         break
                     try:
                         # Extract required columns and write to new file
@@ -75,13 +180,837 @@ def extractCsv(fileName, newFileName):
             if sumColName not in reader.fieldnames:
                     raise ValueError(f"{sumColName} column not found in the CSV file.")
                  
-        createBarChart(newCsvPath)
+        if drawChart:
+            createBarChart(newCsvPath)
         return totalSum
     except Exception as e:
          return f"Error: {e}"
     
 
-fileName = 'business-data.csv'
-newFileName = "extracted_data.csv"
-totalSum=extractCsv(fileName, newFileName)    
-print("total sum:", totalSum)
\ No newline at end of file
+# resolve the positional index of every requested column once from the header row
+def resolveColumnIndexes(header, columns):
+    indexes = []
+    for col in columns:
+        if col not in header:
+            raise ValueError(f"Column '{col}' not found in the CSV file.")
+        indexes.append(header.index(col))
+    return indexes
+
+
+# function for extracting any number of rows with plain csv.reader rows (lists), so no dict is allocated per row.
+# rowFilters is a dict of column name -> predicate on the raw string value, a row is kept only when every predicate is true.
+# Rows are written in batches of batchSize and the function returns (rowsWritten, totalSum, invalidCount)
+def streamExtractCsv(fileName, newFileName, selectedColumns=SELECTED_COLUMNS, rowFilters=None, rowLimit=None, sumColName=SUM_COLUMN, batchSize=BATCH_SIZE):
+    currDir = os.path.dirname(__file__)
+    filePath = os.path.join(currDir, fileName)
+    newCsvPath = os.path.join(currDir, newFileName)
+
+    totalSum = 0.0
+    rowsWritten = 0
+    invalidCount = 0
+    skippedCount = 0
+
+    with open(filePath, mode='r', newline='') as infile, open(newCsvPath, mode='w', newline='') as outfile:
+        reader = csv.reader(infile)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"The file {fileName} is empty.")
+
+        selectedIndexes = resolveColumnIndexes(header, selectedColumns)
+        sumIndex = resolveColumnIndexes(header, [sumColName])[0] if sumColName else None
+        filters = []
+        for col, predicate in (rowFilters or {}).items():
+            filters.append((resolveColumnIndexes(header, [col])[0], predicate))
+
+        # itemgetter returns a bare value for a single index, so wrap that case in a tuple
+        if len(selectedIndexes) == 1:
+            onlyIndex = selectedIndexes[0]
+            pickColumns = lambda row: (row[onlyIndex],)
+        else:
+            pickColumns = itemgetter(*selectedIndexes)
+        # shortest row that still holds every column we touch
+        minWidth = max(selectedIndexes + [i for i, _ in filters] + ([sumIndex] if sumIndex is not None else [])) + 1
+
+        writer = csv.writer(outfile)
+        writer.writerow(selectedColumns)
+        batch = []
+        for row in reader:
+            if rowLimit is not None and rowsWritten >= rowLimit:
+                break
+            if len(row) < minWidth:
+                skippedCount += 1
+                continue
+            if filters and not all(predicate(row[i]) for i, predicate in filters):
+                continue
+
+            batch.append(pickColumns(row))
+            rowsWritten += 1
+            if sumIndex is not None:
+                try:
+                    totalSum += float(row[sumIndex])
+                except ValueError:
+                    invalidCount += 1
+
+            if len(batch) >= batchSize:
+                writer.writerows(batch)
+                batch.clear()
+        if batch:
+            writer.writerows(batch)
+
+    if skippedCount:
+        print(f"Skipped {skippedCount} rows due to missing column data.")
+    if invalidCount:
+        print(f"Skipped {invalidCount} invalid {sumColName} values in the sum.")
+    return rowsWritten, totalSum, invalidCount
+
+
+# split the data part of the file (after the header) into byte ranges which all start at the beginning of a line.
+# Note: this assumes no quoted field contains a newline, which holds for our business-data exports
+def findChunkOffsets(filePath, numChunks):
+    fileSize = os.path.getsize(filePath)
+    with open(filePath, mode='rb') as file:
+        file.readline()
+        dataStart = file.tell()
+        chunkSize = max(1, (fileSize - dataStart) // numChunks)
+        offsets = [dataStart]
+        for i in range(1, numChunks):
+            file.seek(max(dataStart + i * chunkSize, offsets[-1]))
+            file.readline()  # move forward to the start of the next line
+            position = file.tell()
+            if position >= fileSize:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(fileSize)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+# stats are kept as [sum, count, min, max] lists so merging partials stays cheap
+def newStats():
+    return [0.0, 0, float('inf'), float('-inf')]
+
+
+def mergeStats(stats, other):
+    stats[0] += other[0]
+    stats[1] += other[1]
+    stats[2] = min(stats[2], other[2])
+    stats[3] = max(stats[3], other[3])
+
+
+# yields the decoded lines of the byte range [start, end) without loading the whole range in memory
+def readLinesInRange(file, start, end, encoding):
+    file.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        line = file.readline()
+        if not line:
+            break
+        remaining -= len(line)
+        yield line.decode(encoding)
+
+
+# worker for the process pool, computes the partial sum/count/min/max (and per-key group-bys) for one chunk of the file
+def aggregateChunk(task):
+    filePath, start, end, valueIndex, groupIndexes, encoding = task
+    totals = newStats()
+    groups = [{} for _ in groupIndexes]
+    invalidCount = 0
+    minWidth = max([valueIndex] + list(groupIndexes)) + 1
+
+    with open(filePath, mode='rb') as file:
+        for row in csv.reader(readLinesInRange(file, start, end, encoding)):
+            if len(row) < minWidth:
+                invalidCount += 1
+                continue
+            try:
+                value = float(row[valueIndex])
+            except ValueError:
+                invalidCount += 1
+                continue
+
+            totals[0] += value
+            totals[1] += 1
+            if value < totals[2]:
+                totals[2] = value
+            if value > totals[3]:
+                totals[3] = value
+
+            for groupIndex, groupStats in zip(groupIndexes, groups):
+                key = row[groupIndex]
+                stats = groupStats.get(key)
+                if stats is None:
+                    stats = groupStats[key] = [value, 1, value, value]
+                    continue
+                stats[0] += value
+                stats[1] += 1
+                if value < stats[2]:
+                    stats[2] = value
+                if value > stats[3]:
+                    stats[3] = value
+
+    return totals, groups, invalidCount
+
+
+# this method splits the file at newline-aligned byte offsets, aggregates the chunks on a process pool and merges the partials.
+# It returns a dict with the overall stats, one {key: stats} dict per groupBy column and the number of skipped rows
+def parallelAggregate(fileName, valueColumn=SUM_COLUMN, groupBy=(), workers=None, encoding='utf-8'):
+    filePath = os.path.join(os.path.dirname(__file__), fileName)
+    workers = workers or os.cpu_count() or 1
+
+    with open(filePath, mode='r', newline='', encoding=encoding) as file:
+        header = next(csv.reader(file), None)
+    if header is None:
+        raise ValueError(f"The file {fileName} is empty.")
+    valueIndex = resolveColumnIndexes(header, [valueColumn])[0]
+    groupIndexes = resolveColumnIndexes(header, groupBy)
+
+    # a few chunks per worker so one slow chunk does not leave the other cores idle
+    tasks = [(filePath, start, end, valueIndex, groupIndexes, encoding)
+             for start, end in findChunkOffsets(filePath, workers * 4)]
+
+    totals = newStats()
+    groups = {col: {} for col in groupBy}
+    invalidCount = 0
+    if workers == 1:
+        partials = map(aggregateChunk, tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        partials = pool.map(aggregateChunk, tasks)
+    try:
+        for partialTotals, partialGroups, partialInvalid in partials:
+            mergeStats(totals, partialTotals)
+            invalidCount += partialInvalid
+            for col, partialGroup in zip(groupBy, partialGroups):
+                merged = groups[col]
+                for key, stats in partialGroup.items():
+                    if key in merged:
+                        mergeStats(merged[key], stats)
+                    else:
+                        merged[key] = stats
+    finally:
+        if workers != 1:
+            pool.shutdown()
+
+    return {'totals': totals, 'groups': groups, 'invalid': invalidCount}
+
+
+# print the [sum, count, min, max] stats in a readable form
+def formatStats(stats):
+    if not stats[1]:
+        return "count=0"
+    return f"sum={stats[0]:.3f} count={stats[1]} min={stats[2]} max={stats[3]} mean={stats[0] / stats[1]:.3f}"
+
+
+# Sidecar index (<csv>.idx) layout: a fixed header, then for every row colCount+1 uint32 field boundaries
+# relative to the row start (start of each field, the last one is the end of the last field + 1), then one uint64 row start offset per row.
+# The header stores the csv size and mtime so a changed file invalidates the index
+INDEX_MAGIC = b'CSVIDX01'
+INDEX_HEADER = struct.Struct('<8sQqQQ')  # magic, file size, mtime_ns, row count, column count
+INDEX_FLUSH_ROWS = 65536
+
+
+# end of the record starting at pos (index of its newline, or size). A record continues past a newline while it has an odd number of quotes
+def findRecordEnd(mm, pos, size):
+    end = mm.find(b'\n', pos)
+    if end == -1:
+        end = size
+    while end < size and mm[pos:end].count(b'"') % 2 == 1:
+        end = mm.find(b'\n', end + 1)
+        if end == -1:
+            end = size
+    return end
+
+
+# start of every field in the record, relative to the record start
+def findFieldStarts(record):
+    starts = [0]
+    if b'"' not in record:
+        comma = record.find(b',')
+        while comma != -1:
+            starts.append(comma + 1)
+            comma = record.find(b',', comma + 1)
+        return starts
+
+    inQuotes = False
+    for i, char in enumerate(record):
+        if char == 34:  # '"', an escaped "" toggles twice
+            inQuotes = not inQuotes
+        elif char == 44 and not inQuotes:  # ','
+            starts.append(i + 1)
+    return starts
+
+
+def decodeField(raw, encoding):
+    if raw[:1] == b'"':
+        raw = raw[1:-1].replace(b'""', b'"')
+    return raw.decode(encoding)
+
+
+# this method scans the csv once through mmap and writes the sidecar index of row offsets and column boundaries
+def buildCsvIndex(filePath, indexPath):
+    stat = os.stat(filePath)
+    if not stat.st_size:
+        raise ValueError(f"The file {filePath} is empty.")
+
+    tmpPath = indexPath + '.tmp'
+    with open(filePath, mode='rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = stat.st_size
+        headerEnd = findRecordEnd(mm, 0, size)
+        colCount = len(findFieldStarts(mm[0:headerEnd].rstrip(b'\r')))
+
+        rowCount = 0
+        offsets = array('Q')
+        bounds = array('I')
+        with open(tmpPath, mode='wb') as indexFile, tempfile.TemporaryFile() as offsetsFile:
+            indexFile.write(INDEX_HEADER.pack(INDEX_MAGIC, 0, 0, 0, 0))
+            pos = headerEnd + 1
+            while pos < size:
+                end = findRecordEnd(mm, pos, size)
+                record = mm[pos:end].rstrip(b'\r')
+                if record:
+                    starts = findFieldStarts(record)
+                    # missing trailing fields read as empty strings, extra fields are ignored
+                    rowBounds = starts[:colCount + 1]
+                    rowBounds += [len(record) + 1] * (colCount + 1 - len(rowBounds))
+                    offsets.append(pos)
+                    bounds.extend(rowBounds)
+                    rowCount += 1
+                    if len(offsets) >= INDEX_FLUSH_ROWS:
+                        offsets.tofile(offsetsFile)
+                        bounds.tofile(indexFile)
+                        offsets = array('Q')
+                        bounds = array('I')
+                pos = end + 1
+
+            offsets.tofile(offsetsFile)
+            bounds.tofile(indexFile)
+            offsetsFile.seek(0)
+            shutil.copyfileobj(offsetsFile, indexFile)
+            indexFile.seek(0)
+            indexFile.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, rowCount, colCount))
+    os.replace(tmpPath, indexPath)
+
+
+# Random access to a csv through mmap and its sidecar index, built on first use and rebuilt when the csv size or mtime changes.
+# Row slices and single column scans only touch the requested bytes instead of parsing the whole file
+class CsvIndex:
+    def __init__(self, fileName, encoding='utf-8'):
+        self.filePath = os.path.join(os.path.dirname(__file__), fileName)
+        self.indexPath = self.filePath + '.idx'
+        self.encoding = encoding
+        if not self.isIndexValid():
+            buildCsvIndex(self.filePath, self.indexPath)
+
+        self.file = open(self.filePath, mode='rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.indexFile = open(self.indexPath, mode='rb')
+        self.index = mmap.mmap(self.indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        _, _, _, self.rowCount, self.colCount = INDEX_HEADER.unpack_from(self.index, 0)
+        self.header = [decodeField(self.mm[start:end - 1], encoding) for start, end in zip(*self.rowBounds(-1))]
+        self.rowStruct = struct.Struct(f'<{self.colCount + 1}I')
+        self.offsetsPos = INDEX_HEADER.size + self.rowCount * self.rowStruct.size
+
+    def isIndexValid(self):
+        if not os.path.exists(self.indexPath):
+            return False
+        stat = os.stat(self.filePath)
+        with open(self.indexPath, mode='rb') as indexFile:
+            data = indexFile.read(INDEX_HEADER.size)
+        if len(data) < INDEX_HEADER.size:
+            return False
+        magic, size, mtime, _, _ = INDEX_HEADER.unpack(data)
+        return magic == INDEX_MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns
+
+    # (field starts, field ends) of a row as absolute offsets in the csv, row -1 is the header line
+    def rowBounds(self, row):
+        if row == -1:
+            record = self.mm[0:findRecordEnd(self.mm, 0, len(self.mm))].rstrip(b'\r')
+            starts = findFieldStarts(record) + [len(record) + 1]
+            return starts[:-1], starts[1:]
+        rowStart = struct.unpack_from('<Q', self.index, self.offsetsPos + 8 * row)[0]
+        bounds = [rowStart + b for b in self.rowStruct.unpack_from(self.index, INDEX_HEADER.size + self.rowStruct.size * row)]
+        return bounds[:-1], bounds[1:]
+
+    def row(self, row):
+        if not 0 <= row < self.rowCount:
+            raise IndexError(f"Row {row} is out of range (the file has {self.rowCount} rows).")
+        starts, ends = self.rowBounds(row)
+        return [decodeField(self.mm[start:end - 1], self.encoding) for start, end in zip(starts, ends)]
+
+    # rows [start, stop) where row 0 is the first data row
+    def rows(self, start, stop):
+        for row in range(max(start, 0), min(stop, self.rowCount)):
+            yield self.row(row)
+
+    # values of one column for rows [start, stop), only the bytes of that field are read from each row
+    def column(self, columnName, start=0, stop=None):
+        col = resolveColumnIndexes(self.header, [columnName])[0]
+        stop = self.rowCount if stop is None else min(stop, self.rowCount)
+        pair = struct.Struct('<2I')
+        for row in range(max(start, 0), stop):
+            rowStart = struct.unpack_from('<Q', self.index, self.offsetsPos + 8 * row)[0]
+            fieldStart, fieldEnd = pair.unpack_from(self.index, INDEX_HEADER.size + self.rowStruct.size * row + 4 * col)
+            yield decodeField(self.mm[rowStart + fieldStart:rowStart + fieldEnd - 1], self.encoding)
+
+    def close(self):
+        self.index.close()
+        self.indexFile.close()
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# parse a list of strings into a float64 array in blocks, only a block that fails the fast vectorized conversion
+# is parsed value by value. Returns (values, invalidMask) where invalid values are nan and flagged in the mask
+def parseFloatColumn(strings, blockSize=65536):
+    values = np.empty(len(strings), dtype=np.float64)
+    invalidMask = np.zeros(len(strings), dtype=bool)
+    for start in range(0, len(strings), blockSize):
+        block = strings[start:start + blockSize]
+        try:
+            values[start:start + len(block)] = np.array(block, dtype=np.float64)
+        except ValueError:
+            for offset, text in enumerate(block):
+                try:
+                    values[start + offset] = float(text)
+                except ValueError:
+                    values[start + offset] = np.nan
+                    invalidMask[start + offset] = True
+    return values, invalidMask
+
+
+# read the given columns of the csv into typed numpy arrays in a single pass. Numeric columns become masked float64
+# arrays (invalid values masked), the others string arrays. Rows with missing column data are dropped
+def parseColumns(filePath, columnNames, numericColumns):
+    with open(filePath, mode='r', newline='') as infile:
+        reader = csv.reader(infile)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"The file {filePath} is empty.")
+        indexes = resolveColumnIndexes(header, columnNames)
+        minWidth = max(indexes) + 1
+        rawColumns = [[] for _ in indexes]
+        appenders = [(index, values.append) for index, values in zip(indexes, rawColumns)]
+        for row in reader:
+            if len(row) < minWidth:
+                continue
+            for index, append in appenders:
+                append(row[index])
+
+    columns = {}
+    for col, strings in zip(columnNames, rawColumns):
+        if col in numericColumns:
+            values, invalidMask = parseFloatColumn(strings)
+            columns[col] = np.ma.masked_array(values, mask=invalidMask)
+        else:
+            columns[col] = np.array(strings)
+    return columns
+
+
+# the rows of a loaded column equal to the expected --where text. A numeric column is compared by value (invalid
+# values never match), so Data_value=1116.386 finds the row the csv and streaming paths find
+def whereMask(array, expected, numeric):
+    if not numeric:
+        return array == expected
+    try:
+        expectedValue = float(expected)
+    except ValueError:
+        return np.zeros(len(array), dtype=bool)
+    return np.ma.filled(array == expectedValue, False)
+
+
+# this method loads the selected columns into typed numpy arrays. `where` is a dict of column -> expected value applied
+# as a vectorized filter before rowLimit. With useCache the parsed columns are read from / written to the conversion cache.
+# Returns (columns, invalidCounts) where invalidCounts holds the number of masked values of each numeric column
+def loadColumns(fileName, selectedColumns=SELECTED_COLUMNS, numericColumns=(SUM_COLUMN,), where=None, rowLimit=None, useCache=False):
+    if np is None:
+        raise ImportError("The columnar backend needs numpy, install it with: pip install numpy")
+
+    filePath = os.path.join(os.path.dirname(__file__), fileName)
+    where = where or {}
+    loadedColumns = list(selectedColumns) + [col for col in where if col not in selectedColumns]
+    numericColumns = [col for col in numericColumns if col in loadedColumns]
+
+    columns = readCachedColumns(filePath, loadedColumns, numericColumns) if useCache else None
+    if columns is None:
+        columns = parseColumns(filePath, loadedColumns, numericColumns)
+        if useCache:
+            writeCachedColumns(filePath, columns, numericColumns)
+
+    mask = None
+    for col, expected in where.items():
+        colMask = whereMask(columns[col], expected, col in numericColumns)
+        mask = colMask if mask is None else mask & colMask
+
+    selected = {}
+    invalidCounts = {}
+    for col in selectedColumns:
+        array = columns[col]
+        if mask is not None:
+            array = array[mask]
+        if rowLimit is not None:
+            array = array[:rowLimit]
+        selected[col] = array
+        if col in numericColumns:
+            invalidCounts[col] = int(np.ma.count_masked(array))
+    return selected, invalidCounts
+
+
+# formats in which the columnar data can be written, parquet and arrow need pyarrow
+COLUMNAR_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow', 'npy': '.npy'}
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '.columnar_cache')
+CACHE_MANIFEST = os.path.join(CACHE_DIR, 'manifest.json')
+
+
+def importPyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+        return pyarrow
+    except ImportError:
+        return None
+
+
+# 'auto' picks parquet when pyarrow is installed and falls back to a plain .npy file otherwise
+def resolveColumnarFormat(outputFormat):
+    if outputFormat == 'auto':
+        return 'parquet' if importPyarrow() is not None else 'npy'
+    if outputFormat not in COLUMNAR_EXTENSIONS:
+        raise ValueError(f"Unknown columnar format: {outputFormat}")
+    if outputFormat != 'npy' and importPyarrow() is None:
+        raise ImportError(f"Writing {outputFormat} needs pyarrow, install it with: pip install pyarrow")
+    return outputFormat
+
+
+# this method writes the columns to outPathBase + extension in the given format and returns the written path.
+# The .npy fallback is one structured array, a masked numeric column gets an extra <column>__mask field
+def writeColumnarFile(columns, outPathBase, outputFormat='auto'):
+    outputFormat = resolveColumnarFormat(outputFormat)
+    outPath = outPathBase + COLUMNAR_EXTENSIONS[outputFormat]
+    tmpPath = outPath + '.tmp'
+
+    if outputFormat == 'npy':
+        fields = []
+        for col, array in columns.items():
+            fields.append((col, array.dtype))
+            if np.ma.isMaskedArray(array):
+                fields.append((col + '__mask', bool))
+        length = len(next(iter(columns.values()))) if columns else 0
+        table = np.empty(length, dtype=fields)
+        for col, array in columns.items():
+            if np.ma.isMaskedArray(array):
+                table[col] = array.data
+                table[col + '__mask'] = np.ma.getmaskarray(array)
+            else:
+                table[col] = array
+        with open(tmpPath, mode='wb') as outfile:
+            np.save(outfile, table, allow_pickle=False)
+    else:
+        pyarrow = importPyarrow()
+        table = pyarrow.table({
+            col: pyarrow.array(array.data, mask=np.ma.getmaskarray(array)) if np.ma.isMaskedArray(array) else pyarrow.array(array)
+            for col, array in columns.items()
+        })
+        if outputFormat == 'parquet':
+            pyarrow.parquet.write_table(table, tmpPath)
+        else:
+            with pyarrow.OSFile(tmpPath, 'wb') as sink, pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    os.replace(tmpPath, outPath)
+    return outPath
+
+
+# this method reads a file written by writeColumnarFile back into a dict of (masked) numpy arrays
+def readColumnarFile(path):
+    if path.endswith('.npy'):
+        table = np.load(path, allow_pickle=False)
+        columns = {}
+        for col in table.dtype.names:
+            if col.endswith('__mask'):
+                continue
+            if col + '__mask' in table.dtype.names:
+                columns[col] = np.ma.masked_array(table[col], mask=table[col + '__mask'])
+            else:
+                columns[col] = table[col]
+        return columns
+
+    pyarrow = importPyarrow()
+    if pyarrow is None:
+        raise ImportError(f"Reading {path} needs pyarrow, install it with: pip install pyarrow")
+    if path.endswith('.parquet'):
+        table = pyarrow.parquet.read_table(path)
+    else:
+        with pyarrow.memory_map(path, 'r') as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+    columns = {}
+    for col in table.column_names:
+        chunked = table.column(col)
+        if pyarrow.types.is_floating(chunked.type):
+            mask = chunked.is_null().to_numpy(zero_copy_only=False)
+            columns[col] = np.ma.masked_array(chunked.fill_null(np.nan).to_numpy(), mask=mask)
+        else:
+            columns[col] = np.array(chunked.to_pylist())
+    return columns
+
+
+# sha256 of the file content in 1MB blocks
+def hashFile(filePath):
+    digest = hashlib.sha256()
+    with open(filePath, mode='rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# the content hash of the source file. The manifest remembers it per (path, size, mtime) so an unchanged file is not re-hashed
+def sourceFileHash(filePath):
+    stat = os.stat(filePath)
+    manifest = {}
+    if os.path.exists(CACHE_MANIFEST):
+        with open(CACHE_MANIFEST) as manifestFile:
+            manifest = json.load(manifestFile)
+
+    entry = manifest.get(os.path.abspath(filePath))
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['hash']
+
+    fileHash = hashFile(filePath)
+    manifest[os.path.abspath(filePath)] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': fileHash}
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(CACHE_MANIFEST + '.tmp', mode='w') as manifestFile:
+        json.dump(manifest, manifestFile)
+    os.replace(CACHE_MANIFEST + '.tmp', CACHE_MANIFEST)
+    return fileHash
+
+
+# cache entries are keyed on the source file hash and the requested columns
+def cachePathBase(filePath, columnNames, numericColumns):
+    key = hashlib.sha256(json.dumps([sourceFileHash(filePath), list(columnNames), sorted(numericColumns)]).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, key)
+
+
+def readCachedColumns(filePath, columnNames, numericColumns):
+    pathBase = cachePathBase(filePath, columnNames, numericColumns)
+    for extension in COLUMNAR_EXTENSIONS.values():
+        if os.path.exists(pathBase + extension):
+            try:
+                return readColumnarFile(pathBase + extension)
+            except ImportError:
+                continue
+    return None
+
+
+def writeCachedColumns(filePath, columns, numericColumns):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return writeColumnarFile(columns, cachePathBase(filePath, list(columns), numericColumns))
+
+
+# function for the columnar extraction, the sum, the filtering and the chart data are all array operations.
+# Besides the csv, the extracted columns are written in a binary columnar format (outputFormat=None skips it)
+def columnarExtractCsv(fileName, newFileName, selectedColumns=SELECTED_COLUMNS, where=None, rowLimit=None, sumColName=SUM_COLUMN, drawChart=False, outputFormat='auto', useCache=True, chartPath=None):
+    # the sum column is loaded for the total even when --columns leaves it out of the output
+    loadedColumns = list(selectedColumns) + ([sumColName] if sumColName not in selectedColumns else [])
+    loaded, invalidCounts = loadColumns(fileName, loadedColumns, (sumColName,), where, rowLimit, useCache)
+    columns = {col: loaded[col] for col in selectedColumns}
+    newCsvPath = os.path.join(os.path.dirname(__file__), newFileName)
+
+    with open(newCsvPath, mode='w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(selectedColumns)
+        # masked numeric values are written as empty cells
+        writer.writerows(zip(*(columns[col].astype(object).filled('') if np.ma.isMaskedArray(columns[col]) else columns[col] for col in selectedColumns)))
+    if outputFormat:
+        writeColumnarFile(columns, os.path.splitext(newCsvPath)[0], outputFormat)
+
+    values = loaded[sumColName]
+    totalSum = float(values.sum()) if values.count() else 0.0
+    if drawChart and 'Period' in loaded:
+        valid = ~np.ma.getmaskarray(values)
+        drawBarChart(loaded['Period'][valid], values.data[valid], chartPath)
+    return len(values), totalSum, invalidCounts.get(sumColName, 0)
+
+
+# function for plotting the bar chart from a binary columnar file, so the data is not re-parsed from text
+def createBarChartFromColumnar(path, outPath=None):
+    try:
+        columns = readColumnarFile(path)
+        missing = [col for col in ('Period', 'Data_value') if col not in columns]
+        if missing:
+            print(f"Error while drawing bar chart: {path} has no {', '.join(missing)} column")
+            return
+        values = np.ma.asarray(columns['Data_value'])
+        valid = ~np.ma.getmaskarray(values)
+        drawBarChart(columns['Period'][valid], values.data[valid], outPath)
+    except Exception as e:
+        print(f"Error while drawing bar chart: {e}")
+
+
+# parse the command line options of the form --key=value (eg:- --columns=Period,Data_value --limit=100 --where=Series_title_2=Forestry and Logging)
+def parseOptions(args):
+    options = {'columns': SELECTED_COLUMNS, 'limit': None, 'filters': {}, 'where': {}, 'output': 'extracted_data.csv', 'groupby': [], 'workers': None, 'chart': False, 'format': 'auto', 'save': None}
+    for arg in args:
+        key, _, value = arg.lstrip('-').partition('=')
+        if key == 'columns':
+            options['columns'] = [col.strip() for col in value.split(',') if col.strip()]
+        elif key == 'limit':
+            options['limit'] = int(value)
+        elif key == 'where':
+            col, _, expected = value.partition('=')
+            options['where'][col] = expected
+            options['filters'][col] = lambda cell, expected=expected: cell == expected
+        elif key == 'output':
+            options['output'] = value
+        elif key == 'groupby':
+            options['groupby'] = [col.strip() for col in value.split(',') if col.strip()]
+        elif key == 'workers':
+            options['workers'] = int(value)
+        elif key == 'chart':
+            options['chart'] = True
+        elif key == 'save':
+            options['save'] = value
+        elif key == 'format':
+            options['format'] = None if value == 'csv' else value
+        else:
+            raise ValueError(f"Unknown option: {arg}")
+    return options
+
+
+# write a synthetic file of the given number of rows by repeating the data rows of the sample csv
+def createBenchmarkFile(sourceName, rows):
+    sourcePath = os.path.join(os.path.dirname(__file__), sourceName)
+    with open(sourcePath, mode='r', newline='') as infile:
+        header = infile.readline()
+        dataLines = infile.readlines()
+
+    benchFile = tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, newline='')
+    with benchFile:
+        benchFile.write(header)
+        fullCopies, remainder = divmod(rows, len(dataLines))
+        for _ in range(fullCopies):
+            benchFile.writelines(dataLines)
+        benchFile.writelines(dataLines[:remainder])
+    return benchFile.name
+
+
+# this method compares rows/sec of the current DictReader path against the streaming path on the same synthetic input
+def benchmarkExtraction(sourceName, rows=500000):
+    benchPath = createBenchmarkFile(sourceName, rows)
+    outPath = benchPath + '.out.csv'
+    try:
+        start = time.perf_counter()
+        extractCsv(benchPath, outPath, rowLimit=None, drawChart=False)
+        dictSeconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        streamExtractCsv(benchPath, outPath)
+        streamSeconds = time.perf_counter() - start
+
+        print(f"rows: {rows}")
+        print(f"DictReader path: {rows / dictSeconds:,.0f} rows/sec ({dictSeconds:.2f}s)")
+        print(f"streaming path:  {rows / streamSeconds:,.0f} rows/sec ({streamSeconds:.2f}s)")
+        print(f"speedup: {dictSeconds / streamSeconds:.2f}x")
+
+        if np is not None:
+            start = time.perf_counter()
+            columnarExtractCsv(benchPath, outPath, outputFormat=None, useCache=False)
+            columnarSeconds = time.perf_counter() - start
+            print(f"columnar path:   {rows / columnarSeconds:,.0f} rows/sec ({columnarSeconds:.2f}s)")
+
+            # the first run fills the conversion cache, the second one reads the typed binary file
+            columnarExtractCsv(benchPath, outPath, outputFormat=None)
+            start = time.perf_counter()
+            columnarExtractCsv(benchPath, outPath, outputFormat=None)
+            cachedSeconds = time.perf_counter() - start
+            print(f"columnar cached: {rows / cachedSeconds:,.0f} rows/sec ({cachedSeconds:.2f}s)")
+
+        # aggregation on one core against every core of the machine
+        workers = os.cpu_count() or 1
+        start = time.perf_counter()
+        parallelAggregate(benchPath, groupBy=['Period'], workers=1)
+        singleSeconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallelAggregate(benchPath, groupBy=['Period'], workers=workers)
+        parallelSeconds = time.perf_counter() - start
+
+        print(f"aggregate on 1 core:   {rows / singleSeconds:,.0f} rows/sec ({singleSeconds:.2f}s)")
+        print(f"aggregate on {workers} cores: {rows / parallelSeconds:,.0f} rows/sec ({parallelSeconds:.2f}s)")
+    finally:
+        for path in (benchPath, outPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+    fileName = 'business-data.csv'
+    newFileName = "extracted_data.csv"
+
+    methodToCall = argv[1] if len(argv) > 1 else 'extract'
+    if methodToCall == 'extract':
+        # the original behaviour, first 10 rows and a bar chart
+        totalSum=extractCsv(fileName, newFileName)
+        print("total sum:", totalSum)
+    elif methodToCall == 'stream':
+        # streaming extraction, eg:- python index.py stream --limit=1000 --where=Series_title_2=Forestry and Logging
+        options = parseOptions(argv[2:])
+        rowsWritten, totalSum, _ = streamExtractCsv(fileName, options['output'], options['columns'], options['filters'], options['limit'])
+        print("rows written:", rowsWritten)
+        print("total sum:", totalSum)
+    elif methodToCall == 'columnar':
+        # numpy backend, eg:- python index.py columnar --limit=1000 --where=Series_title_2=Forestry and Logging --format=parquet --save=chart.png
+        options = parseOptions(argv[2:])
+        rowsWritten, totalSum, invalidCount = columnarExtractCsv(fileName, options['output'], options['columns'], options['where'], options['limit'], drawChart=options['chart'] or options['save'] is not None, outputFormat=options['format'], chartPath=options['save'])
+        print("rows written:", rowsWritten)
+        print("total sum:", totalSum)
+        if invalidCount:
+            print(f"invalid {SUM_COLUMN} values masked: {invalidCount}")
+    elif methodToCall == 'chart':
+        # bar chart of an extracted file, eg:- python index.py chart extracted_data.npy --save=chart.svg
+        positional = [arg for arg in argv[2:] if not arg.startswith('--')]
+        options = parseOptions([arg for arg in argv[2:] if arg.startswith('--')])
+        chartFile = os.path.join(os.path.dirname(__file__), positional[0] if positional else newFileName)
+        if chartFile.endswith('.csv'):
+            createBarChart(chartFile, options['save'])
+        else:
+            createBarChartFromColumnar(chartFile, options['save'])
+    elif methodToCall == 'aggregate':
+        # parallel aggregation, eg:- python index.py aggregate --groupby=Period,Series_title_2 --workers=32
+        options = parseOptions(argv[2:])
+        result = parallelAggregate(fileName, groupBy=options['groupby'], workers=options['workers'])
+        print(f"{SUM_COLUMN}: {formatStats(result['totals'])}")
+        for col, groupStats in result['groups'].items():
+            print(f"\nGrouped by {col}:")
+            for key in sorted(groupStats):
+                print(f"  {key}: {formatStats(groupStats[key])}")
+        if result['invalid']:
+            print(f"\nSkipped {result['invalid']} rows with invalid or missing {SUM_COLUMN}.")
+    elif methodToCall == 'rows':
+        # row slicing through the sidecar index, eg:- python index.py rows 1000000 1000010
+        with CsvIndex(fileName) as csvIndex:
+            print(','.join(csvIndex.header))
+            for row in csvIndex.rows(int(argv[2]), int(argv[3])):
+                print(','.join(row))
+    elif methodToCall == 'column':
+        # single column scan through the sidecar index, eg:- python index.py column Data_value 0 100
+        with CsvIndex(fileName) as csvIndex:
+            start = int(argv[3]) if len(argv) > 3 else 0
+            stop = int(argv[4]) if len(argv) > 4 else None
+            for value in csvIndex.column(argv[2], start, stop):
+                print(value)
+    elif methodToCall == 'bench':
+        # eg:- python index.py bench 1000000
+        rows = int(argv[2]) if len(argv) > 2 else 500000
+        benchmarkExtraction(fileName, rows)
+
+
+# the guard keeps the script importable (and safe for process pools which re-import the main module)
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 import os
+import errno
 import shutil
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import time
@@ -12,60 +17,454 @@ FILE_TYPES = {
     "Docs": [".pdf", ".docx", ".doc", ".txt", ".xlsx", ".pptx"],
 }
 
-def organizeFiles(dirPath):
+# a file is moved only after its size and mtime did not change for this many seconds (it is still being written otherwise)
+SETTLE_SECONDS = 2.0
+# how often the pending files are checked
+POLL_SECONDS = 0.5
+# number of threads doing the moves, and the max number of moves submitted but not finished yet
+MOVE_WORKERS = 4
+MAX_IN_FLIGHT_MOVES = 16
+# number of threads scanning directories in parallel during a recursive sweep
+SWEEP_WORKERS = 16
+
+# duplicates found in content mode are moved here instead of into their category folder
+DUPLICATES_FOLDER = "Duplicates"
+# folders at the top of a root which are never organized themselves
+RESERVED_FOLDERS = set(FILE_TYPES) | {DUPLICATES_FOLDER}
+
+# Magic bytes used in content mode as (offset, signature, category), only the first SNIFF_BYTES of a file are read
+MAGIC_SIGNATURES = [
+    (0, b'\xff\xd8\xff', "Images"),             # jpeg
+    (0, b'\x89PNG\r\n\x1a\n', "Images"),
+    (0, b'GIF87a', "Images"),
+    (0, b'GIF89a', "Images"),
+    (0, b'\x1a\x45\xdf\xa3', "Videos"),         # matroska / webm
+    (0, b'ID3', "Audio"),                       # mp3 with an id3 tag
+    (0, b'fLaC', "Audio"),
+    (0, b'%PDF', "Docs"),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', "Docs"),  # legacy office (doc, xls, ppt)
+]
+SNIFF_BYTES = 64
+# a partial hash covers the first PARTIAL_HASH_BYTES of a file, it rules out most same-size files without a full read
+PARTIAL_HASH_BYTES = 64 * 1024
+# persistent (path, size, mtime) -> hash cache, so a file is hashed at most once across restarts
+HASH_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.folder_cleaner_hashes.sqlite3')
+
+# O(1) extension -> category lookup table built once from FILE_TYPES
+EXTENSION_TO_CATEGORY = {
+    extension: folder
+    for folder, extensions in FILE_TYPES.items()
+    for extension in extensions
+}
+
+# reserve the first free name in the target folder, eg:- photo.jpg -> photo (1).jpg, so a file is never overwritten.
+# The name is claimed by creating an empty placeholder with O_EXCL, which is atomic even with many movers in parallel
+def reserveTargetPath(targetFolder, file):
+    name, extension = os.path.splitext(file)
+    counter = 0
+    while True:
+        targetPath = os.path.join(targetFolder, file if counter == 0 else f'{name} ({counter}){extension}')
+        try:
+            os.close(os.open(targetPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return targetPath
+        except FileExistsError:
+            counter += 1
+
+# os.replace is a metadata-only move on the same device (it replaces our placeholder), only a move across devices
+# copies the data and unlinks the source
+def fastMove(sourcePath, targetPath):
     try:
-        # return if given directory path doesn't exist
-        if not os.path.exists(dirPath):
-            print(f'The given directory: {dirPath} does not exist')
-            return False
-        
-        # Create subfolders for categories if they don't exist
-        for folder in FILE_TYPES.keys():
-            folder_path = os.path.join(dirPath, folder)
-            os.makedirs(folder_path, exist_ok=True)
+        os.replace(sourcePath, targetPath)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            os.unlink(targetPath)
+            raise
+        shutil.copy2(sourcePath, targetPath)
+        os.unlink(sourcePath)
+
+# category of a file from its first bytes, None when no signature matches (eg:- plain text)
+def sniffCategory(filePath):
+    with open(filePath, mode='rb') as file:
+        head = file.read(SNIFF_BYTES)
+    for offset, signature, category in MAGIC_SIGNATURES:
+        if head.startswith(signature, offset):
+            return category
+    # containers which need a second look at the header
+    if head[4:8] == b'ftyp':
+        return "Audio" if head[8:12] in (b'M4A ', b'M4B ') else "Videos"
+    if head[0:4] == b'RIFF':
+        return {b'AVI ': "Videos", b'WAVE': "Audio"}.get(head[8:12])
+    if head[0:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):  # mp3 frame without a tag
+        return "Audio"
+    if head[0:2] in (b'\xff\xf1', b'\xff\xf9'):  # aac adts frame
+        return "Audio"
+    if head[0:4] == b'PK\x03\x04' and head[30:49] == b'[Content_Types].xml':  # docx, xlsx, pptx
+        return "Docs"
+    return None
+
+
+# Persistent hash cache in sqlite keyed on path and checked against (size, mtime), the partial and the full hash
+# of a file are computed lazily and at most once. Moves update the stored path, mtime is kept by the move
+class HashCache:
+    def __init__(self, path=HASH_CACHE_PATH):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, partial TEXT, full TEXT)')
+        self.lock = threading.Lock()
+        self.pendingWrites = 0
+
+    def getHash(self, filePath, kind):
+        stat = os.stat(filePath)
+        with self.lock:
+            row = self.connection.execute('SELECT size, mtime, partial, full FROM hashes WHERE path = ?', (filePath,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            row = (stat.st_size, stat.st_mtime_ns, None, None)
+        cached = row[2] if kind == 'partial' else row[3]
+        if cached is not None:
+            return cached
 
-        # Traverse files from root directory and move to specific folders based on extension
-        for file in os.listdir(dirPath):
-            filePath = os.path.join(dirPath, file)
-            if os.path.isdir(filePath) or file in FILE_TYPES.keys():
+        digest = hashFile(filePath, PARTIAL_HASH_BYTES if kind == 'partial' else None)
+        # a file no bigger than the partial window has its full hash for free
+        partial = digest if kind == 'partial' else row[2]
+        full = digest if kind == 'full' or stat.st_size <= PARTIAL_HASH_BYTES else row[3]
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)', (filePath, stat.st_size, stat.st_mtime_ns, partial, full))
+            self.commitEvery(100)
+        return digest
+
+    def moved(self, oldPath, newPath):
+        with self.lock:
+            self.connection.execute('DELETE FROM hashes WHERE path = ?', (newPath,))
+            self.connection.execute('UPDATE hashes SET path = ? WHERE path = ?', (newPath, oldPath))
+            self.commitEvery(100)
+
+    def commitEvery(self, writes):
+        self.pendingWrites += 1
+        if self.pendingWrites >= writes:
+            self.connection.commit()
+            self.pendingWrites = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def hashFile(filePath, limit=None):
+    digest = hashlib.blake2b(digest_size=20)
+    remaining = limit
+    with open(filePath, mode='rb') as file:
+        while remaining is None or remaining > 0:
+            block = file.read(1 << 20 if remaining is None else min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+# Content mode state of one root: every file already in its category folders indexed by size, so a new file is
+# compared by size first, then by partial hash and only then by full hash
+class ContentIndex:
+    def __init__(self, root, hashCache):
+        self.root = root
+        self.hashCache = hashCache
+        self.sizes = {}  # size -> paths of the organized files with that size
+        self.lock = threading.Lock()
+        self.sizeLocks = {}
+        for folder in FILE_TYPES:
+            folderPath = os.path.join(root, folder)
+            if not os.path.isdir(folderPath):
                 continue
+            with os.scandir(folderPath) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        self.sizes.setdefault(entry.stat().st_size, []).append(entry.path)
+
+    # files of the same size are handled one at a time, so two copies arriving together are still caught
+    def sizeLock(self, size):
+        with self.lock:
+            return self.sizeLocks.setdefault(size, threading.Lock())
+
+    def findDuplicate(self, filePath, size):
+        with self.lock:
+            candidates = list(self.sizes.get(size, ()))
+        if not candidates:
+            return None
+        partial = self.hashCache.getHash(filePath, 'partial')
+        for candidate in candidates:
+            try:
+                if self.hashCache.getHash(candidate, 'partial') != partial:
+                    continue
+                if self.hashCache.getHash(candidate, 'full') == self.hashCache.getHash(filePath, 'full'):
+                    return candidate
+            except FileNotFoundError:
+                # removed by the user meanwhile
+                with self.lock:
+                    self.sizes[size].remove(candidate)
+        return None
+
+    # move the file into its category folder, or into the Duplicates folder when its content is already there.
+    # Returns (target path, path of the original or None)
+    def moveFile(self, filePath, folder):
+        size = os.stat(filePath).st_size
+        with self.sizeLock(size):
+            duplicateOf = self.findDuplicate(filePath, size)
+            targetFolder = os.path.join(self.root, DUPLICATES_FOLDER if duplicateOf else folder)
+            os.makedirs(targetFolder, exist_ok=True)
+            targetPath = reserveTargetPath(targetFolder, os.path.basename(filePath))
+            fastMove(filePath, targetPath)
+            self.hashCache.moved(filePath, targetPath)
+            if duplicateOf is None:
+                with self.lock:
+                    self.sizes.setdefault(size, []).append(targetPath)
+        return targetPath, duplicateOf
+
+
+# root -> ContentIndex for the roots organized in content mode
+contentIndexes = {}
 
-            # check file extension an move to respective folder
-            fileExtension = os.path.splitext(file)[1].lower()
-            for folder, extensions in FILE_TYPES.items():
-                if fileExtension in extensions:
-                    targetPath = os.path.join(dirPath, folder, file)
-                    shutil.move(filePath, targetPath)
-                    print(f'Moved the file {file} to {folder} folder')
-                    break
+# move a single file to the category folder (of the root dirPath) matching its extension, returns True if the file was moved.
+# In content mode the magic bytes decide the category when they are recognized, and duplicates go to the Duplicates folder
+def organizeFile(dirPath, filePath, verbose=True):
+    file = os.path.basename(filePath)
+    fileExtension = os.path.splitext(file)[1].lower()
+    folder = EXTENSION_TO_CATEGORY.get(fileExtension)
+    contentIndex = contentIndexes.get(dirPath)
+    if contentIndex is not None:
+        folder = sniffCategory(filePath) or folder
+    if folder is None:
+        if verbose:
+            print(f'File {file} does not match any category and hence not moved')
+        return False
+
+    if contentIndex is not None:
+        _, duplicateOf = contentIndex.moveFile(filePath, folder)
+        if verbose:
+            if duplicateOf:
+                print(f'Moved the file {file} to {DUPLICATES_FOLDER} folder, it is a copy of {duplicateOf}')
             else:
-                print(f'File {file} does not match any category and hence not moved')
-        return True        
+                print(f'Moved the file {file} to {folder} folder')
+        return True
+
+    # the category folder is created at startup, this only re-creates it if it was removed meanwhile
+    targetFolder = os.path.join(dirPath, folder)
+    os.makedirs(targetFolder, exist_ok=True)
+    fastMove(filePath, reserveTargetPath(targetFolder, file))
+    if verbose:
+        print(f'Moved the file {file} to {folder} folder')
+    return True
+
+
+# scan one directory of a sweep and organize its files, returns (sub directories to scan, files seen, files moved).
+# The category folders at the top of the root are skipped, and symlinked directories are not followed
+def sweepDirectory(rootPath, dirPath, recursive, verbose):
+    subDirs = []
+    seen = 0
+    moved = 0
+    try:
+        with os.scandir(dirPath) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not (dirPath == rootPath and entry.name in RESERVED_FOLDERS):
+                            subDirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    seen += 1
+                    if organizeFile(rootPath, entry.path, verbose):
+                        moved += 1
+                except OSError as e:
+                    print(f'Could not organize {entry.path}: {e}')
+    except OSError as e:
+        print(f'Could not scan {dirPath}: {e}')
+    return subDirs, seen, moved
+
+# this method sweeps several roots at once, directories are scanned in parallel with os.scandir and every file is
+# moved to the category folders of its own root. Prints the throughput (files/sec) at the end of the sweep
+# With contentMode, categories come from the magic bytes and duplicates (by content hash) are moved aside
+def organizeTrees(roots, recursive=True, workers=SWEEP_WORKERS, contentMode=False, hashCache=None):
+    validRoots = []
+    for root in roots:
+        if not os.path.isdir(root):
+            print(f'The given directory: {root} does not exist')
+            continue
+        root = os.path.realpath(root)
+        for folder in FILE_TYPES.keys():
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+        if contentMode:
+            contentIndexes[root] = ContentIndex(root, hashCache or HashCache())
+        validRoots.append(root)
+    if not validRoots:
+        return []
+
+    # printing every move of a large tree costs more than the move itself, so only the summary is printed then
+    verbose = not recursive
+    start = time.perf_counter()
+    totalSeen = 0
+    totalMoved = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sweeper') as executor:
+        running = {executor.submit(sweepDirectory, root, root, recursive, verbose): root for root in validRoots}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                root = running.pop(future)
+                subDirs, seen, moved = future.result()
+                totalSeen += seen
+                totalMoved += moved
+                for subDir in subDirs:
+                    running[executor.submit(sweepDirectory, root, subDir, recursive, verbose)] = root
+
+    elapsed = time.perf_counter() - start
+    rate = totalSeen / elapsed if elapsed > 0 else 0.0
+    print(f'Swept {totalSeen} files ({totalMoved} moved) in {elapsed:.2f}s, {rate:,.0f} files/sec')
+    return validRoots
+
+
+# Coalescing queue between the watchdog observer thread and a pool of move workers.
+# Events for the same path are collapsed into one pending entry, an entry is handed to the pool once the file
+# looks complete (same size and mtime for SETTLE_SECONDS), and at most MAX_IN_FLIGHT_MOVES moves are outstanding
+class MoveQueue:
+    def __init__(self, settleSeconds=SETTLE_SECONDS, workers=MOVE_WORKERS, maxInFlight=MAX_IN_FLIGHT_MOVES):
+        self.settleSeconds = settleSeconds
+        # path -> (root folder holding its category folders, last seen (size, mtime), time it was first seen with that value)
+        self.pending = {}
+        # settled paths from the moment they leave pending (waiting for a slot or being moved) until the move is done
+        self.inFlight = set()
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.slots = threading.BoundedSemaphore(maxInFlight)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mover')
+        self.scheduler = threading.Thread(target=self.run, name='move-scheduler', daemon=True)
+
+    def start(self):
+        self.scheduler.start()
 
-    except Exception as e:
-        print(f'Some error occurred: {e}');
-        return False  
+    # called from the observer thread, it only records the path so event delivery never waits on a move.
+    # A path that settled already is left to its move
+    def add(self, root, path):
+        with self.lock:
+            if path not in self.inFlight:
+                self.pending[path] = (root, None, time.monotonic())
+
+    def run(self):
+        while not self.stopEvent.wait(POLL_SECONDS):
+            try:
+                for root, path in self.settledPaths():
+                    # blocks while MAX_IN_FLIGHT_MOVES moves are running, new events keep coalescing meanwhile
+                    self.slots.acquire()
+                    self.executor.submit(self.move, root, path)
+            except Exception as e:
+                # the scheduler keeps going, a path that failed here is picked up again by its next event
+                print(f'Some error occurred while scheduling moves: {e}')
+
+    # (root, path) of the paths whose size and mtime have not changed for settleSeconds. They move from pending to
+    # inFlight in one step, so an event arriving before their move starts doesn't queue them a second time
+    def settledPaths(self):
+        now = time.monotonic()
+        with self.lock:
+            entries = list(self.pending.items())
+
+        settled = []
+        for path, entry in entries:
+            root, lastSignature, since = entry
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                with self.lock:
+                    if self.pending.get(path) == entry:
+                        del self.pending[path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            with self.lock:
+                # skip if a newer event reset the entry while we were checking
+                if self.pending.get(path) != entry:
+                    continue
+                if signature != lastSignature:
+                    self.pending[path] = (root, signature, now)
+                elif now - since >= self.settleSeconds:
+                    del self.pending[path]
+                    self.inFlight.add(path)
+                    settled.append((root, path))
+        return settled
+
+    def move(self, root, path):
+        try:
+            if os.path.isfile(path):
+                organizeFile(root, path)
+        except Exception as e:
+            print(f'Some error occurred: {e}')
+        finally:
+            with self.lock:
+                self.inFlight.discard(path)
+            self.slots.release()
+
+    # stop scheduling and wait for the running moves, files still settling are picked up by the next startup sweep
+    def stop(self):
+        self.stopEvent.set()
+        self.scheduler.join()
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            if self.pending:
+                print(f'{len(self.pending)} files were still being written and are left for the next run')
 
 
 class DirectoryHandler(FileSystemEventHandler):
-    def __init__(self, directory):
-        self.directory = directory
+    def __init__(self, directory, moveQueue=None, recursive=False):
+        self.directory = os.path.realpath(directory)
+        self.moveQueue = moveQueue
+        self.recursive = recursive
 
     def on_modified(self, event):
         if not event.is_directory:
-            organizeFiles(self.directory)
+            self.handlePath(event.src_path)
 
     def on_created(self, event):
         if not event.is_directory:
-            organizeFiles(self.directory)
+            self.handlePath(event.src_path)
+
+    def on_moved(self, event):
+        # eg:- a browser renaming its .part file to the final name once the download completes
+        if not event.is_directory:
+            self.handlePath(event.dest_path)
+
+    # organize only the file carried by the event instead of re-listing the whole directory
+    def handlePath(self, path):
+        path = os.path.realpath(path)
+        if not self.isOrganizable(path):
+            return
+        # the file can already be gone, eg:- the on_modified that follows the on_created of a moved file
+        if not os.path.isfile(path):
+            return
+        if self.moveQueue is not None:
+            self.moveQueue.add(self.directory, path)
+            return
+        try:
+            organizeFile(self.directory, path)
+        except Exception as e:
+            print(f'Some error occurred: {e}')
+
+    # files directly in the directory, or in recursive mode anywhere below it except inside its category folders
+    def isOrganizable(self, path):
+        parent = os.path.dirname(path)
+        if parent == self.directory:
+            return True
+        if not self.recursive or not parent.startswith(self.directory + os.sep):
+            return False
+        topFolder = os.path.relpath(parent, self.directory).split(os.sep)[0]
+        return topFolder not in RESERVED_FOLDERS
 
-# this method will be running till you will press Ctrl+C on keyboard
-def watchDirectory(path):
-    event_handler = DirectoryHandler(path)
+# this method will be running till you will press Ctrl+C on keyboard. Every path is watched by the same observer and
+# all of them share one move queue
+def watchDirectories(paths, recursive=False):
+    moveQueue = MoveQueue()
+    moveQueue.start()
     observer = Observer()
-    observer.schedule(event_handler, path, recursive=False)
+    for path in paths:
+        observer.schedule(DirectoryHandler(path, moveQueue, recursive), path, recursive=recursive)
+        print(f"Watching directory: {path}")
     observer.start()
-    print(f"Watching directory: {path}")
     try:
         while True:
             time.sleep(10)  # Keep the script running
@@ -73,8 +472,16 @@ def watchDirectory(path):
         observer.stop()
         print("\nStopped watching directory.")
     observer.join()    # waits for the observer thread to finish before ending the script
+    moveQueue.stop()   # then lets the moves already handed to the workers finish
 
 
-dirPath = input('Enter the directory path you want to organize: ') # eg:- /Users/xyzuser/Downloads
-if organizeFiles(dirPath):
-    watchDirectory(dirPath)
+if __name__ == "__main__":
+    dirPaths = input('Enter the directory paths you want to organize (comma separated): ') # eg:- /Users/xyzuser/Downloads,/Users/xyzuser/Desktop
+    recursive = input('Organize the sub folders too? (y/n): ').strip().lower() == 'y'
+    contentMode = input('Detect file types by content and move duplicates aside? (y/n): ').strip().lower() == 'y'
+    hashCache = HashCache() if contentMode else None
+    roots = organizeTrees([path.strip() for path in dirPaths.split(',') if path.strip()], recursive, contentMode=contentMode, hashCache=hashCache)
+    if roots:
+        watchDirectories(roots, recursive)
+    if hashCache is not None:
+        hashCache.close()
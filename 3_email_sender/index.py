@@ -1,32 +1,528 @@
 from dotenv import load_dotenv
 import os
+import csv
+import json
+import time
+import uuid
+import random
+import socket
+import sqlite3
+import hashlib
+import threading
 import requests
+from sys import argv
+from string import Formatter
+from urllib.parse import urlencode
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Load environment variables from .env file
 load_dotenv()
 
-def sendEmail(receiverEmail, title, body):
-	# a dictionary with email data
-    emailData = {
-        'from' : os.getenv('SENDER_EMAIL'),
-        'to': receiverEmail,
-        'subject': title,
-        'text': body
+# read once at startup instead of on every send
+SENDER_EMAIL = os.getenv('SENDER_EMAIL')
+MAILGUN_EMAIL_API_ENDPOINT = os.getenv('MAILGUN_EMAIL_API_ENDPOINT')
+MAILGUN_EMAIL_API_KEY = os.getenv('MAILGUN_EMAIL_API_KEY')
+
+# max number of emails being sent at the same time in bulk mode (also the size of the connection pool)
+MAX_IN_FLIGHT = 16
+REQUEST_TIMEOUT_SECONDS = 30
+
+# the outbox every queued email goes through, it survives crashes and restarts
+OUTBOX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outbox.sqlite3')
+# sustained sends per second and burst size of the token bucket, match them to the provider's rate limits
+SEND_RATE_PER_SECOND = 10.0
+SEND_BURST = 20
+# retries of 429/5xx/network errors use exponential backoff with full jitter, or the Retry-After of the response
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 300.0
+# a run holds the messages it claimed for this long and renews the lease while it is alive, a message whose lease
+# ran out (the run crashed) is taken back by the next run. A run on the same host whose process is gone is taken back
+# at once, a run that crashed on another host holds its messages until the lease runs out
+LEASE_SECONDS = 600.0
+# an email that was sent (or failed) is only deduplicated for this long, queueing the same key later sends it again,
+# so a recurring email or a re-run of the same file the next day is not dropped
+DEDUP_SECONDS = 24 * 60 * 60.0
+
+# Mailgun accepts up to 1000 recipients per call in batch mode, and a batch is also split before its form data
+# (recipients, recipient-variables and the templates) grows past MAX_BATCH_PAYLOAD_BYTES
+MAILGUN_BATCH_LIMIT = 1000
+MAX_BATCH_PAYLOAD_BYTES = 5 * 1024 * 1024
+
+# one session shared by all the sends, so the TLS connections are pooled and reused instead of opened per email
+def createSession(poolSize=MAX_IN_FLIGHT):
+    session = requests.Session()
+    session.auth = ("api", MAILGUN_EMAIL_API_KEY)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# this method reads the recipients from a .csv (with a header row) or a .jsonl file (one json object per line).
+# Every record needs an 'email' and can have its own 'title' and 'body' templates, the other fields fill the
+# {placeholders} of the templates, eg:- title "Hi {name}" with a name column
+def loadRecipients(path):
+    with open(path, mode='r', newline='') as file:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in file if line.strip()]
+        return list(csv.DictReader(file))
+
+
+# build the mailgun form data of one record, the record's templates win over the default ones
+def buildEmailData(record, defaultTitle='', defaultBody=''):
+    title = record.get('title') or defaultTitle
+    body = record.get('body') or defaultBody
+    return {
+        'from': SENDER_EMAIL,
+        'to': record['email'],
+        'subject': title.format_map(record),
+        'text': body.format_map(record)
     }
 
-    response = requests.post(
-  		os.getenv('MAILGUN_EMAIL_API_ENDPOINT'),
-  		auth=("api", os.getenv('MAILGUN_EMAIL_API_KEY')),
-  		data=emailData)
-    
+
+# sends one email through the outbox, so a rate limited or failed send is retried instead of lost
+def sendEmail(receiverEmail, title, body, outbox=None):
+    ownOutbox = outbox is None
+    outbox = outbox or Outbox()
+    try:
+        outbox.enqueue({'from': SENDER_EMAIL, 'to': receiverEmail, 'subject': title, 'text': body}, key=str(uuid.uuid4()))
+        deliverOutbox(outbox)
+    finally:
+        if ownOutbox:
+            outbox.close()
+
+
+# this method sends an email to every record of the recipients file through the outbox (retried, and resumable after
+# a crash) with at most maxInFlight requests at a time, paced at ratePerSecond with bursts of up to burst sends.
+# Raise the rate to what the provider allows for large runs. Returns the status of each queued email
+def sendBulkEmails(path, defaultTitle='', defaultBody='', maxInFlight=MAX_IN_FLIGHT, ratePerSecond=SEND_RATE_PER_SECOND, burst=SEND_BURST, outbox=None):
+    ownOutbox = outbox is None
+    outbox = outbox or Outbox()
+    try:
+        keys = queueBulkEmails(outbox, path, defaultTitle, defaultBody)
+        deliverOutbox(outbox, ratePerSecond, burst, maxInFlight)
+        return recipientStatuses(outbox, keys)
+    finally:
+        if ownOutbox:
+            outbox.close()
+
+
+# outbox key of an email without an id of its own, the same email data always gets the same key
+def outboxKey(emailData):
+    return hashlib.sha256(json.dumps(emailData, sort_keys=True).encode()).hexdigest()
+
+
+# True when the owner of a lease is a run on this host whose process is no longer running. Owners from another host
+# (or from before owners named their process) can't be checked and are left to their lease
+def isDeadLocalOwner(owner):
+    parts = owner.split(':')
+    if len(parts) != 3 or parts[0] != socket.gethostname() or not parts[1].isdigit():
+        return False
+    try:
+        os.kill(int(parts[1]), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # the process exists but belongs to another user
+        return False
+    return False
+
+
+# Durable outbox in sqlite. A message is 'pending' until it is claimed ('sending') and ends up 'sent' or 'failed'.
+# The unique key makes enqueueing idempotent, so re-running the same file within dedupSeconds does not queue the same
+# email twice. Every Outbox is one run: a message it claims is leased to it (owner, lease_until) and the lease is
+# renewed while the run is alive, so another run sending from the same file only takes back messages whose lease ran
+# out or whose run is no longer running. The owner is "host:pid:run id" so that a dead run can be told apart
+class Outbox:
+    def __init__(self, path=OUTBOX_PATH, leaseSeconds=LEASE_SECONDS, dedupSeconds=DEDUP_SECONDS):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.leaseSeconds = leaseSeconds
+        self.dedupSeconds = dedupSeconds
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # with WAL a commit no longer waits for an fsync, a power loss can only lose the last few status updates
+        # and those messages are sent again (at-least-once, see recover)
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            key TEXT UNIQUE,
+            data TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt REAL DEFAULT 0,
+            last_status INTEGER,
+            last_error TEXT,
+            provider_id TEXT,
+            owner TEXT,
+            lease_until REAL,
+            queued_at REAL)''')
+        # outboxes created before leases and key expiry existed get the columns added
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(messages)')}
+        for column, columnType in (('owner', 'TEXT'), ('lease_until', 'REAL'), ('queued_at', 'REAL')):
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE messages ADD COLUMN {column} {columnType}')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS due_messages ON messages (status, next_attempt)')
+
+    # returns False when a message with the same key is already in the outbox. A key that was sent or failed more
+    # than dedupSeconds ago is queued again as a new message
+    def enqueue(self, emailData, key=None):
+        key = key or outboxKey(emailData)
+        now = time.time()
+        cursor = self.connection.execute('''INSERT INTO messages (key, data, queued_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET data = excluded.data, status = 'pending', attempts = 0, next_attempt = 0,
+                last_status = NULL, last_error = NULL, provider_id = NULL, owner = NULL, lease_until = NULL,
+                queued_at = excluded.queued_at
+            WHERE status IN ('sent', 'failed') AND (queued_at IS NULL OR queued_at < ?)''',
+            (key, json.dumps(emailData), now, now - self.dedupSeconds))
+        return cursor.rowcount == 1
+
+    def enqueueMany(self, emails):
+        with self.connection:
+            self.connection.execute('BEGIN')
+            return sum(1 for key, emailData in emails if self.enqueue(emailData, key))
+
+    # messages left 'sending' by a run that crashed (its lease ran out, or its process on this host is gone) are sent
+    # again, the ones a live run is sending are left to it. Mailgun has no idempotency key, so a message whose request
+    # reached Mailgun right before the crash can go out twice (at-least-once), the v:outbox-key variable identifies it
+    def recover(self):
+        deadOwners = [owner for (owner,) in self.connection.execute(
+            "SELECT DISTINCT owner FROM messages WHERE status = 'sending' AND owner IS NOT NULL") if isDeadLocalOwner(owner)]
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            cursor = self.connection.execute(
+                "UPDATE messages SET status = 'pending', owner = NULL WHERE status = 'sending' AND (lease_until IS NULL OR lease_until < ?)",
+                (time.time(),))
+            recovered = cursor.rowcount
+            for owner in deadOwners:
+                cursor = self.connection.execute(
+                    "UPDATE messages SET status = 'pending', owner = NULL WHERE status = 'sending' AND owner = ?", (owner,))
+                recovered += cursor.rowcount
+        return recovered
+
+    def claimDue(self, limit):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            rows = self.connection.execute(
+                "SELECT id, key, data, attempts FROM messages WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt, id LIMIT ?",
+                (time.time(), limit)).fetchall()
+            self.connection.executemany(
+                "UPDATE messages SET status = 'sending', owner = ?, lease_until = ? WHERE id = ?",
+                [(self.owner, time.time() + self.leaseSeconds, row[0]) for row in rows])
+        return rows
+
+    # extends the lease of every message this run is sending
+    def renewLeases(self):
+        self.connection.execute("UPDATE messages SET lease_until = ? WHERE status = 'sending' AND owner = ?",
+                                (time.time() + self.leaseSeconds, self.owner))
+
+    def nextAttemptTime(self):
+        return self.connection.execute("SELECT MIN(next_attempt) FROM messages WHERE status = 'pending'").fetchone()[0]
+
+    def markSent(self, messageId, statusCode, providerId):
+        self.connection.execute("UPDATE messages SET status = 'sent', attempts = attempts + 1, last_status = ?, last_error = NULL, provider_id = ? WHERE id = ?", (statusCode, providerId, messageId))
+
+    def markRetry(self, messageId, statusCode, error, delay):
+        self.connection.execute("UPDATE messages SET status = 'pending', attempts = attempts + 1, last_status = ?, last_error = ?, next_attempt = ? WHERE id = ?", (statusCode, error, time.time() + delay, messageId))
+
+    def markFailed(self, messageId, statusCode, error):
+        self.connection.execute("UPDATE messages SET status = 'failed', attempts = attempts + 1, last_status = ?, last_error = ? WHERE id = ?", (statusCode, error, messageId))
+
+    def counts(self):
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM messages GROUP BY status').fetchall())
+
+    def close(self):
+        self.connection.close()
+
+
+# Token bucket shared by all sends: `rate` tokens per second up to `capacity`. pause() empties the bucket until the
+# given time has passed, which is how a Retry-After from the provider slows down every send and not just one message
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.updated:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+                else:
+                    delay = self.updated - now
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.tokens = 0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+# Retry-After is either a number of seconds or an http date
+def parseRetryAfter(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoffDelay(attempts, retryAfter=None):
+    if retryAfter is not None:
+        return retryAfter
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempts))
+
+
+# 'to' is a list of addresses for a mailgun batch
+def describeRecipients(to):
+    if isinstance(to, list):
+        return f"{len(to)} recipients ({to[0]}, ...)" if len(to) > 1 else to[0]
+    return to
+
+
+# one attempt, returns (status code, Retry-After header, provider message id, error text).
+# The status code is None for a network error (retried) and 0 for a request that can never succeed (not retried)
+def postEmail(session, emailData):
+    try:
+        response = session.post(MAILGUN_EMAIL_API_ENDPOINT, data=emailData, timeout=REQUEST_TIMEOUT_SECONDS)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        return None, None, None, str(e)
+    except requests.RequestException as e:
+        # eg:- a missing or invalid MAILGUN_EMAIL_API_ENDPOINT, retrying can't help
+        return 0, None, None, str(e)
     if response.status_code == 200:
-        print('Successfully sent email')
-    else:
-        print("Some error occurred while sending email")
+        try:
+            providerId = response.json().get('id')
+        except ValueError:
+            providerId = None
+        return 200, None, providerId, None
+    return response.status_code, response.headers.get('Retry-After'), None, response.text[:200]
+
+
+# this method delivers every due message of the outbox: sends are paced by the token bucket, at most maxInFlight are
+# running, 429/5xx/network errors are retried with backoff (honoring Retry-After) and other errors fail the message.
+# It returns once nothing is pending anymore, printing the status of each message and the messages/sec
+def deliverOutbox(outbox, ratePerSecond=SEND_RATE_PER_SECOND, burst=SEND_BURST, maxInFlight=MAX_IN_FLIGHT, maxAttempts=MAX_ATTEMPTS):
+    recovered = outbox.recover()
+    if recovered:
+        print(f"Resuming {recovered} emails that were being sent when the last run stopped")
+
+    bucket = TokenBucket(ratePerSecond, burst)
+    inFlight = {}
+    sent = 0
+    failed = 0
+    start = time.perf_counter()
+    leaseRenewed = time.monotonic()
+    with createSession(maxInFlight) as session, ThreadPoolExecutor(max_workers=maxInFlight) as executor:
+        while True:
+            if time.monotonic() - leaseRenewed > outbox.leaseSeconds / 3:
+                outbox.renewLeases()
+                leaseRenewed = time.monotonic()
+            for row in outbox.claimDue(maxInFlight - len(inFlight)):
+                messageId, key, data, attempts = row
+                emailData = json.loads(data)
+                emailData['v:outbox-key'] = key
+                bucket.acquire()
+                inFlight[executor.submit(postEmail, session, emailData)] = (messageId, emailData['to'], attempts)
+
+            if not inFlight:
+                nextAttempt = outbox.nextAttemptTime()
+                if nextAttempt is None:
+                    break
+                time.sleep(min(max(0.0, nextAttempt - time.time()), 1.0))
+                continue
 
+            done, _ = wait(inFlight, timeout=1.0, return_when=FIRST_COMPLETED)
+            # the results of one wait are written in a single transaction, a commit per message caps the send rate
+            with outbox.connection:
+                outbox.connection.execute('BEGIN')
+                for future in done:
+                    messageId, receiverEmail, attempts = inFlight.pop(future)
+                    statusCode, retryAfterHeader, providerId, error = future.result()
+                    if statusCode == 200:
+                        outbox.markSent(messageId, statusCode, providerId)
+                        sent += 1
+                        print(f"Sent email to {describeRecipients(receiverEmail)}")
+                    elif (statusCode is None or statusCode == 429 or statusCode >= 500) and attempts + 1 < maxAttempts:
+                        retryAfter = parseRetryAfter(retryAfterHeader)
+                        if retryAfter is not None:
+                            bucket.pause(retryAfter)
+                        delay = backoffDelay(attempts, retryAfter)
+                        outbox.markRetry(messageId, statusCode, error, delay)
+                        print(f"Retrying email to {describeRecipients(receiverEmail)} in {delay:.1f}s ({statusCode or error})")
+                    else:
+                        outbox.markFailed(messageId, statusCode, error)
+                        failed += 1
+                        print(f"Failed to send email to {describeRecipients(receiverEmail)}: {statusCode} {error}")
 
-receiverEmail = input('Enter the email of receiver: ')
-title = input('Enter the title of email: ')
-body = input('Enter the body of the email: ')
+    elapsed = time.perf_counter() - start
+    print(f"Sent {sent} emails, {failed} failed in {elapsed:.2f}s ({sent / elapsed if elapsed > 0 else 0:,.1f} messages/sec)")
+    return sent, failed
 
-sendEmail(receiverEmail, title, body)
\ No newline at end of file
+
+# turn a {placeholder} template into Mailgun's %recipient.placeholder% syntax, returns (template, placeholder names).
+# Raises ValueError for a template with a lone "{", a positional "{0}" or a "{name[0]}" / "{name.attr}" lookup,
+# which mailgun can't fill per recipient
+def toMailgunTemplate(template):
+    converted = []
+    fields = []
+    for literal, field, _, _ in Formatter().parse(template):
+        converted.append(literal)
+        if field is not None:
+            if not field or field.isdigit() or '[' in field or '.' in field:
+                raise ValueError(f"unsupported field {{{field}}} in the template")
+            converted.append(f'%recipient.{field}%')
+            fields.append(field)
+    return ''.join(converted), fields
+
+
+# this method groups the records sharing the same title and body templates into batches of at most batchLimit
+# recipients and maxPayloadBytes of form data. Each batch is the mailgun form data of one call, the per-recipient
+# values go into recipient-variables. Returns (batches, skipped records with the reason)
+def buildBatches(records, defaultTitle='', defaultBody='', batchLimit=MAILGUN_BATCH_LIMIT, maxPayloadBytes=MAX_BATCH_PAYLOAD_BYTES):
+    groups = {}
+    skipped = []
+    for record in records:
+        if not record.get('email'):
+            skipped.append((record, 'missing field email'))
+            continue
+        templates = (record.get('title') or defaultTitle, record.get('body') or defaultBody)
+        groups.setdefault(templates, []).append(record)
+
+    batches = []
+    for (title, body), groupRecords in groups.items():
+        try:
+            subject, subjectFields = toMailgunTemplate(title)
+            text, textFields = toMailgunTemplate(body)
+        except ValueError as e:
+            # eg:- a lone "{", every record using these templates is skipped
+            skipped += [(record, f'invalid template: {e}') for record in groupRecords]
+            continue
+        fields = sorted(set(subjectFields + textFields))
+        basePayload = len(urlencode({'from': SENDER_EMAIL or '', 'subject': subject, 'text': text, 'recipient-variables': '{}'}))
+
+        recipients = {}
+        payloadSize = basePayload
+        def closeBatch():
+            batches.append({
+                'from': SENDER_EMAIL,
+                'to': list(recipients),
+                'subject': subject,
+                'text': text,
+                'recipient-variables': json.dumps(recipients)
+            })
+
+        for record in groupRecords:
+            missing = [field for field in fields if field not in record]
+            if missing:
+                skipped.append((record, f'missing field {missing[0]}'))
+                continue
+            variables = {field: str(record[field]) for field in fields}
+            # size of the extra "to" parameter plus its entry in recipient-variables
+            recipientSize = len(urlencode({'to': record['email']})) + len(urlencode({'': json.dumps({record['email']: variables})}))
+            # a duplicate address would overwrite its recipient-variables entry, so it goes to the next batch
+            if recipients and (len(recipients) >= batchLimit or payloadSize + recipientSize > maxPayloadBytes or record['email'] in recipients):
+                closeBatch()
+                recipients = {}
+                payloadSize = basePayload
+            recipients[record['email']] = variables
+            payloadSize += recipientSize
+        if recipients:
+            closeBatch()
+    return batches, skipped
+
+
+# this method queues the recipients file in the outbox as mailgun batches, so N emails cost about N/1000 requests.
+# Returns the outbox keys of the batches
+def queueBatchEmails(outbox, path, defaultTitle='', defaultBody=''):
+    batches, skipped = buildBatches(loadRecipients(path), defaultTitle, defaultBody)
+    for record, reason in skipped:
+        print(f"Skipping record {record}: {reason}")
+    keys = [outboxKey(batch) for batch in batches]
+    queued = outbox.enqueueMany(zip(keys, batches))
+    recipients = sum(len(batch['to']) for batch in batches)
+    print(f"Queued {queued} new batches for {recipients} recipients ({len(batches) - queued} batches were already in the outbox)")
+    return keys
+
+
+# map the result of each queued email or batch back to its recipients, one status dict per recipient
+def recipientStatuses(outbox, keys):
+    statuses = []
+    for key in keys:
+        row = outbox.connection.execute('SELECT data, status, last_status, last_error, provider_id FROM messages WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            continue
+        data, status, lastStatus, lastError, providerId = row
+        to = json.loads(data)['to']
+        for receiverEmail in (to if isinstance(to, list) else [to]):
+            statuses.append({'email': receiverEmail, 'status': lastStatus, 'ok': status == 'sent', 'error': lastError, 'id': providerId})
+    return statuses
+
+
+# this method queues every record of the recipients file in the outbox, a record's 'id' field (if any) is its
+# idempotency key. Returns the outbox keys of the emails
+def queueBulkEmails(outbox, path, defaultTitle='', defaultBody=''):
+    emails = []
+    for record in loadRecipients(path):
+        try:
+            emailData = buildEmailData(record, defaultTitle, defaultBody)
+            emails.append((record.get('id') or outboxKey(emailData), emailData))
+        except KeyError as e:
+            print(f"Skipping record {record}: missing field {e}")
+        except (ValueError, IndexError) as e:
+            # eg:- a lone "{" or a positional "{0}" in the title or body
+            print(f"Skipping record {record}: invalid template: {e}")
+    queued = outbox.enqueueMany(emails)
+    print(f"Queued {queued} new emails ({len(emails) - queued} were already in the outbox)")
+    return [key for key, _ in emails]
+
+
+if __name__ == "__main__":
+    if len(argv) > 1 and argv[1] in ('bulk', 'queue'):
+        # durable bulk send through the outbox (queue is its older name), with the number of sends at a time, the
+        # sends per second and the burst size, eg:- python index.py bulk recipients.csv 64 500 1000
+        maxInFlight = int(argv[3]) if len(argv) > 3 else MAX_IN_FLIGHT
+        ratePerSecond = float(argv[4]) if len(argv) > 4 else SEND_RATE_PER_SECOND
+        burst = int(argv[5]) if len(argv) > 5 else SEND_BURST
+        defaultTitle = input('Enter the default title of the emails (used when a record has none): ')
+        defaultBody = input('Enter the default body of the emails (used when a record has none): ')
+        statuses = sendBulkEmails(argv[2], defaultTitle, defaultBody, maxInFlight, ratePerSecond, burst)
+        print(f"{sum(1 for status in statuses if status['ok'])} of {len(statuses)} emails accepted by mailgun")
+    elif len(argv) > 1 and argv[1] == 'batch':
+        # mailgun batch sending through the outbox, eg:- python index.py batch newsletter.csv 10
+        ratePerSecond = float(argv[3]) if len(argv) > 3 else SEND_RATE_PER_SECOND
+        defaultTitle = input('Enter the default title of the emails (used when a record has none): ')
+        defaultBody = input('Enter the default body of the emails (used when a record has none): ')
+        outbox = Outbox()
+        keys = queueBatchEmails(outbox, argv[2], defaultTitle, defaultBody)
+        deliverOutbox(outbox, ratePerSecond)
+        statuses = recipientStatuses(outbox, keys)
+        print(f"{sum(1 for status in statuses if status['ok'])} of {len(statuses)} recipients accepted by mailgun")
+        outbox.close()
+    elif len(argv) > 1 and argv[1] == 'resume':
+        # deliver whatever is still pending after a crash or a stopped run. Messages of a run that crashed on this host
+        # are taken back at once, the ones of a run on another host only after LEASE_SECONDS
+        outbox = Outbox()
+        deliverOutbox(outbox)
+        print(outbox.counts())
+        outbox.close()
+    else:
+        receiverEmail = input('Enter the email of receiver: ')
+        title = input('Enter the title of email: ')
+        body = input('Enter the body of the email: ')
+        sendEmail(receiverEmail, title, body)
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from email.parser import BytesParser
+from time import perf_counter, sleep
+from sys import argv
+
+import httplib2
+
+import index
+from google_services import buildService
+
+# benchmarks of the calendar script against a mock transport, so they need no credentials and never touch a real
+# calendar. The script itself always talks to the real calendar, only this module wires in the mock:
+#   python bench.py bulk [events] [ms per call]                 one insert per event against batched inserts
+#   python bench.py latency [runs] [--mock=ms per call] [command...]    cold CLI against the warm daemon
+#   python bench.py mock MS COMMAND...                           a command of index.py (or serve) against the mock
+
+
+# stand-in for httplib2.Http answering calendar inserts, single and batched, and event lists (every inserted event,
+# as one page) after a fixed latency per HTTP call. Every failEvery-th event gets a 429 on its first try so the
+# retry path is exercised too. Calls from several threads overlap their latency like real connections would
+class MockCalendarHttp:
+    def __init__(self, latencySeconds=0.05, failEvery=0):
+        self.latencySeconds = latencySeconds
+        self.failEvery = failEvery
+        self.calls = 0
+        self.inserted = {}
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def insertResult(self, event):
+        with self.lock:
+            # a single add lets the API pick the id
+            event.setdefault("id", hashlib.sha1(json.dumps(event, sort_keys=True).encode()).hexdigest())
+            number = len(self.seen)
+            if event["id"] not in self.seen:
+                self.seen.add(event["id"])
+                if self.failEvery and number % self.failEvery == self.failEvery - 1:
+                    return 429, {"error": {"code": 429, "message": "Rate Limit Exceeded"}}
+            if event["id"] in self.inserted:
+                return 409, {"error": {"code": 409, "message": "The requested identifier already exists."}}
+            self.inserted[event["id"]] = dict(event, status="confirmed")
+            return 200, self.inserted[event["id"]]
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=1, connection_type=None):
+        with self.lock:
+            self.calls += 1
+        sleep(self.latencySeconds)
+        if method == "GET":
+            with self.lock:
+                content = {"items": list(self.inserted.values()), "nextSyncToken": "mock"}
+            return httplib2.Response({"status": 200, "content-type": "application/json"}), json.dumps(content).encode()
+        if "/batch/" not in uri:
+            status, content = self.insertResult(json.loads(body))
+            return httplib2.Response({"status": status, "content-type": "application/json"}), json.dumps(content).encode()
+
+        message = BytesParser().parsebytes(f"content-type: {headers['content-type']}\r\n\r\n".encode() + body.encode())
+        parts = []
+        for part in message.get_payload():
+            # each part is a serialized HTTP request, the event is its body
+            event = json.loads(part.get_payload().replace("\r\n", "\n").split("\n\n", 1)[1])
+            status, content = self.insertResult(event)
+            contentId = part["Content-ID"].replace("<", "<response-", 1)
+            parts.append(
+                f"--batch_mock\r\nContent-Type: application/http\r\nContent-ID: {contentId}\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(content)}\r\n"
+            )
+        content = "".join(parts) + "--batch_mock--"
+        return httplib2.Response({"status": 200, "content-type": "multipart/mixed; boundary=batch_mock"}), content.encode()
+
+
+# this compares one insert call per event with batched inserts against the mock transport,
+# e.g. python bench.py bulk 500 50 (events, milliseconds per HTTP call)
+def benchmarkBulkAdd(eventCount=500, latencyMs=50):
+    start = datetime(2024, 1, 1, 9, tzinfo=index.LOCAL_TIMEZONE)
+    events = [
+        {
+            "summary": f"Imported entry {number}",
+            "start": {"dateTime": (start + timedelta(hours=number)).isoformat()},
+            "end": {"dateTime": (start + timedelta(hours=number, minutes=30)).isoformat()},
+        }
+        for number in range(eventCount)
+    ]
+
+    http = MockCalendarHttp(latencyMs / 1000)
+    service = buildService("calendar", "v3", http=http)
+    eventsResource = service.events()
+    began = perf_counter()
+    for event in events:
+        eventsResource.insert(calendarId="bench", body=dict(event, id=index.importEventId("bench", event))).execute()
+    sequentialSeconds = perf_counter() - began
+    print(f"one call per event: {sequentialSeconds:.2f}s, {http.calls} HTTP calls, {eventCount / sequentialSeconds:.0f} events/s")
+
+    http = MockCalendarHttp(latencyMs / 1000, failEvery=20)
+    service = buildService("calendar", "v3", http=http)
+    began = perf_counter()
+    created, alreadyThere, failures = index.bulkAddEvents(service, events, "bench", backoffSeconds=latencyMs / 1000)
+    batchSeconds = perf_counter() - began
+    print(f"batched:            {batchSeconds:.2f}s, {http.calls} HTTP calls, {eventCount / batchSeconds:.0f} events/s "
+          f"(created {created}, already there {alreadyThere}, failed {len(failures)}, 1 in 20 rate limited once)")
+
+    # a second import of the same events only finds them already there
+    created, alreadyThere, failures = index.bulkAddEvents(service, events, "bench", backoffSeconds=latencyMs / 1000)
+    print(f"re-import:          created {created}, already there {alreadyThere}, failed {len(failures)}")
+
+
+# runs a command of index.py, or the daemon with serve, against the mock transport. It keeps its own event store in
+# the temp dir, so the real copy of the calendar is left alone
+def runMockCommand(latencyMs, args):
+    index.EVENT_STORE_PATH = os.path.join(tempfile.gettempdir(), f"calendar_mock_events_{os.getuid()}.sqlite3")
+    index.codingCalendarId = index.codingCalendarId or "mock"
+    service = buildService("calendar", "v3", http=MockCalendarHttp(latencyMs / 1000))
+    if args[0] == 'serve':
+        index.serveCommands(lambda: service)
+    else:
+        index.runCommand(service, args)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# this times a command run as a fresh `python index.py ...` against the same command through the daemon, both as a
+# fresh `python client.py ...` process and as a bare socket round trip, e.g. python bench.py latency 10 get10.
+# A daemon is started for the run when none is listening. With mockLatencyMs (latency 10 --mock=100 get10) the CLI
+# and the daemon run through `bench.py mock` with their own socket and store, so no credentials or real daemon are
+# involved
+def benchmarkLatency(runs=10, commandArgs=None, mockLatencyMs=None):
+    from client import DAEMON_SOCKET_PATH, sendCommand
+
+    commandArgs = commandArgs or ['get10']
+    projectDir = os.path.dirname(os.path.abspath(__file__))
+    socketPath = DAEMON_SOCKET_PATH
+    environment = dict(os.environ)
+    script = ["index.py"]
+    if mockLatencyMs is not None:
+        socketPath = os.path.join(tempfile.gettempdir(), f"calendar_mock_{os.getuid()}.sock")
+        environment.update(CALENDAR_SOCKET=socketPath)
+        script = ["bench.py", "mock", str(mockLatencyMs)]
+
+    def timeProcess(command):
+        samples = []
+        for _ in range(runs):
+            began = perf_counter()
+            subprocess.run([sys.executable, *command], cwd=projectDir, env=environment, stdout=subprocess.DEVNULL, check=True)
+            samples.append(perf_counter() - began)
+        return samples
+
+    # the floor for any command started as a new process
+    results = {"interpreter start only": timeProcess(["-c", "pass"])}
+    results["cold CLI (index.py)"] = timeProcess([*script, *commandArgs])
+
+    daemon = None
+    if not os.path.exists(socketPath):
+        daemon = subprocess.Popen([sys.executable, *script, "serve"], cwd=projectDir, env=environment, stdout=subprocess.DEVNULL)
+        while not os.path.exists(socketPath):
+            if daemon.poll() is not None:
+                print("The daemon did not start")
+                return
+            sleep(0.05)
+    try:
+        results["warm daemon (client.py)"] = timeProcess(["client.py", *commandArgs])
+        samples = []
+        for _ in range(runs):
+            began = perf_counter()
+            sendCommand(commandArgs, socketPath)
+            samples.append(perf_counter() - began)
+        results["warm daemon (socket only)"] = samples
+    finally:
+        if daemon:
+            daemon.terminate()
+            daemon.wait()
+
+    for name, samples in results.items():
+        print(f"{name:28} median {percentile(samples, 0.5) * 1000:8.1f} ms   p95 {percentile(samples, 0.95) * 1000:8.1f} ms")
+
+
+def main():
+    if argv[1] == 'bulk':
+        benchmarkBulkAdd(*(int(value) for value in argv[2:4]))
+    elif argv[1] == 'latency':
+        options = [arg for arg in argv[3:] if arg.startswith('--mock=')]
+        commandArgs = [arg for arg in argv[3:] if not arg.startswith('--mock=')]
+        mockLatencyMs = float(options[-1].partition('=')[2]) if options else None
+        benchmarkLatency(int(argv[2]) if len(argv) > 2 else 10, commandArgs, mockLatencyMs)
+    elif argv[1] == 'mock':
+        runMockCommand(float(argv[2]), argv[3:])
+    else:
+        print(f"Unknown benchmark: {argv[1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import socket
+import tempfile
+
+# thin client for the calendar daemon (python index.py serve). It only uses the standard library so that a cron job
+# or a hotkey pays for the interpreter start and one socket round trip, not for the google client imports, login and
+# discovery, e.g. python client.py get10, python client.py add "Code review" 1.5
+# When no daemon is running the command runs through index.py as before
+
+# override with CALENDAR_SOCKET, the daemon reads the same variable
+DAEMON_SOCKET_PATH = os.getenv(
+    "CALENDAR_SOCKET", os.path.join(tempfile.gettempdir(), f"calendar_automation_{os.getuid()}.sock")
+)
+# a command that takes longer than this (a big import, a full resync) is reported as failed
+RESPONSE_TIMEOUT_SECONDS = 300
+
+
+# sends one command to the daemon and returns its reply, {"output": printed text, "error": message or None}
+def sendCommand(args, socketPath=DAEMON_SOCKET_PATH):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(RESPONSE_TIMEOUT_SECONDS)
+        connection.connect(socketPath)
+        connection.sendall(json.dumps({"args": args}).encode("utf-8") + b"\n")
+        connection.shutdown(socket.SHUT_WR)
+        reply = b""
+        while chunk := connection.recv(65536):
+            reply += chunk
+    return json.loads(reply)
+
+
+def main():
+    args = sys.argv[1:]
+    # the daemon has its own working directory, so a file to import is passed with its full path
+    if len(args) == 2 and args[0] == "add":
+        args[1] = os.path.abspath(args[1])
+
+    try:
+        reply = sendCommand(args)
+    except (FileNotFoundError, ConnectionRefusedError):
+        indexPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.py")
+        os.execv(sys.executable, [sys.executable, indexPath, *args])
+
+    sys.stdout.write(reply["output"])
+    # e.g. an add that went through but couldn't be synced into the daemon's copy yet
+    if reply.get("warning"):
+        print(f"Warning: {reply['warning']}", file=sys.stderr)
+    if reply["error"]:
+        print(f"An error occurred: {reply['error']}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,25 @@
 from datetime import datetime, timezone, time, timedelta
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 import os
+import csv
+import json
+import hashlib
+import random
+import sqlite3
+import signal
+import socketserver
+import threading
+from io import StringIO
+from contextlib import redirect_stdout
+from time import monotonic, sleep
+import sys
 from sys import argv
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+# the shared google_services module (cached credentials and services) lives in the repository root. Like it, this
+# script imports the google client libraries (httplib2, googleapiclient) only inside the functions using them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from google_services import getExecutor, getService
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,26 +27,297 @@ load_dotenv()
 # create a .env file and then store the calendar id which you want to play with, or you can use 'primary', if you want the default one 
 codingCalendarId = os.getenv('CODING_TASKS_CALENDAR_ID') 
 
+# more calendars for the hours report, comma separated, the coding calendar is always included
+extraCalendarIds = [c.strip() for c in os.getenv('EXTRA_CALENDAR_IDS', '').split(',') if c.strip()]
+
+# the timezone days and weeks are counted in, any IANA name e.g. 'Europe/Berlin', defaults to IST
+TIMEZONE_NAME = os.getenv('CALENDAR_TIMEZONE', 'Asia/Kolkata')
+LOCAL_TIMEZONE = ZoneInfo(TIMEZONE_NAME)
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
+# local copy of the calendar kept up to date with incremental (syncToken) syncs, the read commands answer from it
+EVENT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "events.sqlite3")
+# only the fields the store needs are requested
+SYNC_FIELDS = "items(id,status,summary,start,end),nextPageToken,nextSyncToken"
+
+# bulk add: events per batch request (the API allows up to 50 calendar calls in one batch),
+# how often a failing event is tried, and the full-jitter backoff between retry rounds
+INSERT_BATCH_SIZE = 50
+MAX_INSERT_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_CAP_SECONDS = 32
+# statuses worth retrying, 403 only counts when it is a rate limit
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+# reads sync the store first unless it was synced within this many seconds. One-shot runs always sync,
+# the daemon syncs in the background every DAEMON_SYNC_SECONDS and answers from the store in between
+syncMaxAgeSeconds = 0
+DAEMON_SYNC_SECONDS = 60
+
+def openEventStore(path=None):
+    store = sqlite3.connect(path or EVENT_STORE_PATH)
+    store.execute(
+        "CREATE TABLE IF NOT EXISTS events (calendar_id TEXT, id TEXT, summary TEXT, start TEXT, end TEXT, "
+        "start_ts REAL, end_ts REAL, PRIMARY KEY (calendar_id, id))"
+    )
+    store.execute("CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start_ts)")
+    store.execute("CREATE TABLE IF NOT EXISTS sync_state (calendar_id TEXT PRIMARY KEY, sync_token TEXT, synced_at REAL)")
+    return store
+
+
+# timestamp of an event's start/end, all-day events only have a date which is taken at midnight in the local timezone
+def eventTimestamp(eventTime, localTimezone):
+    if "dateTime" in eventTime:
+        return datetime.fromisoformat(eventTime["dateTime"].replace("Z", "+00:00")).timestamp()
+    return datetime.combine(datetime.fromisoformat(eventTime["date"]).date(), time.min, tzinfo=localTimezone).timestamp()
+
+
+# every page of a calendar's changes since syncToken (all its events without one), as (items, nextSyncToken, whether
+# it is a full listing). An expired token (410) gets a full listing instead. Only the calls happen here, awaited on
+# the shared executor, so several calendars are fetched at once
+async def fetchCalendarChanges(executor, eventsResource, calendarId, syncToken):
+    from googleapiclient.errors import HttpError
+
+    items = []
+    pageToken = None
+    while True:
+        params = {"calendarId": calendarId, "singleEvents": True, "maxResults": 2500, "fields": SYNC_FIELDS}
+        if pageToken:
+            params["pageToken"] = pageToken
+        if syncToken:
+            params["syncToken"] = syncToken
+        try:
+            result = await executor.execute(eventsResource.list(**params))
+        except HttpError as error:
+            if error.resp.status == 410 and syncToken:
+                print("Sync token expired, doing a full sync")
+                return await fetchCalendarChanges(executor, eventsResource, calendarId, None)
+            raise
+        items += result.get("items", [])
+
+        pageToken = result.get("nextPageToken")
+        if not pageToken:
+            return items, result.get("nextSyncToken"), syncToken is None
+
+
+# writes a calendar's changes and its new sync token in one transaction, returns how many events changed
+def storeCalendarChanges(store, calendarId, items, nextSyncToken, fullListing):
+    localTimezone = LOCAL_TIMEZONE
+    with store:
+        if fullListing:
+            store.execute("DELETE FROM events WHERE calendar_id = ?", (calendarId,))
+        for event in items:
+            if event.get("status") == "cancelled":
+                store.execute("DELETE FROM events WHERE calendar_id = ? AND id = ?", (calendarId, event["id"]))
+                continue
+            store.execute(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    calendarId,
+                    event["id"],
+                    event.get("summary", "(No title)"),
+                    json.dumps(event["start"]),
+                    json.dumps(event["end"]),
+                    eventTimestamp(event["start"], localTimezone),
+                    eventTimestamp(event["end"], localTimezone),
+                ),
+            )
+        store.execute(
+            "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+            (calendarId, nextSyncToken, datetime.now(timezone.utc).timestamp()),
+        )
+    return len(items)
+
+
+# syncs the calendars at the same time: their pages are fetched concurrently, then each calendar is written in its
+# own transaction. A calendar whose fetch failed keeps its store and token as they were, the others are still
+# written before the first error is raised
+def syncCalendarEvents(service, store, calendarIds, forceFull=False):
+    executor = getExecutor()
+    eventsResource = service.events()
+    syncTokens = {}
+    for calendarId in calendarIds:
+        row = store.execute("SELECT sync_token FROM sync_state WHERE calendar_id = ?", (calendarId,)).fetchone()
+        syncTokens[calendarId] = None if forceFull or row is None else row[0]
+
+    results = executor.runAll(
+        [fetchCalendarChanges(executor, eventsResource, calendarId, syncTokens[calendarId]) for calendarId in calendarIds],
+        returnExceptions=True,
+    )
+    changes = 0
+    errors = []
+    for calendarId, result in zip(calendarIds, results):
+        if isinstance(result, BaseException):
+            errors.append(result)
+        else:
+            changes += storeCalendarChanges(store, calendarId, *result)
+    if errors:
+        raise errors[0]
+    return changes
+
+
+# this method brings the store up to date for one calendar. With a stored syncToken only the changes since the last
+# sync are fetched, without one (first run, forceFull, or an expired token answered with 410 Gone) everything is
+# fetched again. The new syncToken is saved in the same transaction as the events
+def syncEvents(service, store, calendarId, forceFull=False):
+    return syncCalendarEvents(service, store, [calendarId], forceFull)
+
+
+# syncs the calendars not synced within syncMaxAgeSeconds
+def syncIfStale(service, store, calendarIds):
+    staleIds = []
+    for calendarId in calendarIds:
+        row = store.execute("SELECT synced_at FROM sync_state WHERE calendar_id = ?", (calendarId,)).fetchone()
+        if not (syncMaxAgeSeconds and row and datetime.now(timezone.utc).timestamp() - row[0] < syncMaxAgeSeconds):
+            staleIds.append(calendarId)
+    return syncCalendarEvents(service, store, staleIds) if staleIds else 0
+
+
+# sync the calendar and return the stored events overlapping [timeMin, timeMax) in the shape of the API items
+def loadEvents(service, timeMin, timeMax=None, limit=None, calendarId=None):
+    calendarId = calendarId or codingCalendarId
+    store = openEventStore()
+    try:
+        syncIfStale(service, store, [calendarId])
+        query = "SELECT summary, start, end FROM events WHERE calendar_id = ? AND end_ts > ?"
+        params = [calendarId, timeMin.timestamp()]
+        if timeMax is not None:
+            query += " AND start_ts < ?"
+            params.append(timeMax.timestamp())
+        query += " ORDER BY start_ts"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [
+            {"summary": summary, "start": json.loads(start), "end": json.loads(end)}
+            for summary, start, end in store.execute(query, params)
+        ]
+    finally:
+        store.close()
+
+# sync every calendar and return (start_ts, end_ts, summary) of the timed events overlapping [timeMin, timeMax).
+# All-day events are left out, they mark the day rather than take up time in it
+def loadIntervals(service, calendarIds, timeMin, timeMax):
+    store = openEventStore()
+    try:
+        syncIfStale(service, store, calendarIds)
+        placeholders = ",".join("?" * len(calendarIds))
+        return store.execute(
+            f"SELECT start_ts, end_ts, summary FROM events WHERE calendar_id IN ({placeholders}) "
+            "AND start_ts < ? AND end_ts > ? AND json_extract(start, '$.dateTime') IS NOT NULL",
+            [*calendarIds, timeMax.timestamp(), timeMin.timestamp()],
+        ).fetchall()
+    finally:
+        store.close()
+
+
+# sort-and-sweep: sort by start and extend the last merged interval while the next one starts before it ends.
+# Intervals are clipped to [windowStart, windowEnd] so events running over the edges only count their inside part
+def mergeIntervals(intervals, windowStart, windowEnd):
+    merged = []
+    for start, end, *_ in sorted(intervals):
+        start, end = max(start, windowStart), min(end, windowEnd)
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+# label of the day or ISO week a timestamp falls in, in the local timezone
+def periodKey(timestamp, period):
+    day = datetime.fromtimestamp(timestamp, LOCAL_TIMEZONE).date()
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return day.isoformat()
+
+
+# timestamp where the day or week containing the timestamp ends, local midnight so DST days get their 23/25 hours
+def periodEnd(timestamp, period):
+    day = datetime.fromtimestamp(timestamp, LOCAL_TIMEZONE).date()
+    days = 7 - day.weekday() if period == "week" else 1
+    return datetime.combine(day + timedelta(days=days), time.min, tzinfo=LOCAL_TIMEZONE).timestamp()
+
+
+# busy seconds per day or week, merged intervals crossing midnight are split between the periods they cover
+def rollupByPeriod(merged, period):
+    totals = {}
+    for start, end in merged:
+        while start < end:
+            cut = min(end, periodEnd(start, period))
+            key = periodKey(start, period)
+            totals[key] = totals.get(key, 0) + cut - start
+            start = cut
+    return totals
+
+
+# busy seconds per keyword found in the event summaries (case-insensitive), each keyword merged on its own.
+# An event matching no keyword is counted under 'other'
+def rollupByKeyword(intervals, keywords, windowStart, windowEnd):
+    groups = {keyword: [] for keyword in keywords}
+    groups["other"] = []
+    for interval in intervals:
+        summary = (interval[2] or "").lower()
+        matched = [keyword for keyword in keywords if keyword.lower() in summary]
+        for keyword in matched or ["other"]:
+            groups[keyword].append(interval)
+    return {
+        keyword: sum(end - start for start, end in mergeIntervals(group, windowStart, windowEnd))
+        for keyword, group in groups.items()
+        if group
+    }
+
+
+# the ways the hours command can roll up busy time
+HOURS_ROLLUPS = ("day", "week", "keyword")
+
+
+def formatHours(seconds):
+    hours, remainder = divmod(int(round(seconds)), 3600)
+    return f"{hours}h {remainder // 60:02d}m"
+
+
+# this prints the busy hours between two dates (inclusive) over all the configured calendars, rolled up by day, week
+# or summary keyword, e.g. python index.py hours 2024-01-01 2024-03-31 week
+# or python index.py hours 2024-01-01 2024-03-31 keyword standup,review
+def getHoursForRange(service, startDate, endDate, rollup="day", keywords=None):
+    if rollup not in HOURS_ROLLUPS:
+        raise ValueError(f"Unknown rollup: {rollup}, use one of {', '.join(HOURS_ROLLUPS)}")
+    timeStart = datetime.combine(datetime.fromisoformat(startDate).date(), time.min, tzinfo=LOCAL_TIMEZONE)
+    timeEnd = datetime.combine(datetime.fromisoformat(endDate).date() + timedelta(days=1), time.min, tzinfo=LOCAL_TIMEZONE)
+    calendarIds = list(dict.fromkeys([codingCalendarId, *extraCalendarIds]))
+
+    intervals = loadIntervals(service, calendarIds, timeStart, timeEnd)
+    if not intervals:
+      print("No events found in this range.")
+      return
+
+    windowStart, windowEnd = timeStart.timestamp(), timeEnd.timestamp()
+    merged = mergeIntervals(intervals, windowStart, windowEnd)
+    if rollup == "keyword":
+        totals = rollupByKeyword(intervals, keywords or [], windowStart, windowEnd)
+    else:
+        totals = rollupByPeriod(merged, rollup)
+
+    for key, seconds in sorted(totals.items()):
+        print(key, formatHours(seconds))
+    print(f"total: {formatHours(sum(end - start for start, end in merged))} over {len(intervals)} events "
+          f"in {len(calendarIds)} calendars ({TIMEZONE_NAME})")
+
+
 def get10EventsFromNow(service):
     # Call the Calendar API
     # below code is for finding upcoming 10 events
-    now = datetime.now(timezone.utc).isoformat()
-    events_result = (
-        service.events()
-        .list(
-            calendarId=codingCalendarId,
-            timeMin=now,
-            maxResults=10,
-            singleEvents=True,
-            orderBy="startTime",
-        )
-        .execute()
-    )
-    
-    events = events_result.get("items", [])
+    # answered from the local store after fetching only the changes since the last sync
+    now = datetime.now(timezone.utc)
+    events = loadEvents(service, now, limit=10)
 
     if not events:
       print("No upcoming events found.")
@@ -47,31 +330,19 @@ def get10EventsFromNow(service):
 
 
 def getTodaysEvents(service):
-    # Define your timezone (e.g., UTC+5:30)
-    my_timezone = timezone(timedelta(hours=5, minutes=30))
+    # the timezone comes from CALENDAR_TIMEZONE (IST by default)
+    my_timezone = LOCAL_TIMEZONE
 
     # Today's date
     today = datetime.now(my_timezone).date()
 
     # Setting timeStart to today's starting time (00:00:00) with timezone
-    timeStart = datetime.combine(today, time.min, tzinfo=my_timezone).isoformat()
+    timeStart = datetime.combine(today, time.min, tzinfo=my_timezone)
 
     # Setting timeEnd to today's ending time (23:59:59.999999) with timezone
-    timeEnd = datetime.combine(today, time.max, tzinfo=my_timezone).isoformat()
+    timeEnd = datetime.combine(today, time.max, tzinfo=my_timezone)
     
-    events_result = (
-        service.events()
-        .list(
-            calendarId=codingCalendarId,
-            timeMin=timeStart,
-            timeMax=timeEnd,
-            singleEvents=True,
-            orderBy="startTime",
-        )
-        .execute()
-    )
-     
-    events = events_result.get("items", [])
+    events = loadEvents(service, timeStart, timeEnd)
 
     if not events:
       print("No upcoming events found.")
@@ -84,47 +355,27 @@ def getTodaysEvents(service):
 
 
 def getTotalHoursForToday(service):
-    # Define your timezone (e.g., UTC+5:30)
-    my_timezone = timezone(timedelta(hours=5, minutes=30))
+    # the timezone comes from CALENDAR_TIMEZONE (IST by default)
+    my_timezone = LOCAL_TIMEZONE
 
     # Today's date
     today = datetime.now(my_timezone).date()
 
     # Setting timeStart to today's starting time (00:00:00) with timezone
-    timeStart = datetime.combine(today, time.min, tzinfo=my_timezone).isoformat()
+    timeStart = datetime.combine(today, time.min, tzinfo=my_timezone)
 
     # Setting timeEnd to today's ending time (23:59:59.999999) with timezone
-    timeEnd = datetime.combine(today, time.max, tzinfo=my_timezone).isoformat()
-
-    events_result = (
-        service.events()
-        .list(
-            calendarId=codingCalendarId,
-            timeMin=timeStart,
-            timeMax=timeEnd,
-            singleEvents=True,
-            orderBy="startTime",
-        )
-        .execute()
-    )
-    
-    events = events_result.get("items", [])
+    timeEnd = datetime.combine(today, time.max, tzinfo=my_timezone)
 
-    if not events:
+    intervals = loadIntervals(service, [codingCalendarId], timeStart, timeEnd)
+
+    if not intervals:
       print("No upcoming events found.")
       return
 
-    totalTime = timedelta()
-    for event in events:
-      start = event["start"].get("dateTime", event["start"].get("date"))
-      end =   event["end"].get("dateTime", event["end"].get("date"))
-      # Parsing the datetime strings into datetime objects
-      start_time = datetime.fromisoformat(start)
-      end_time = datetime.fromisoformat(end)
-
-      # Calculating the difference
-      time_difference = end_time - start_time
-      totalTime+= time_difference
+    # overlapping meetings are merged first so that time is only counted once
+    merged = mergeIntervals(intervals, timeStart.timestamp(), timeEnd.timestamp())
+    totalTime = timedelta(seconds=sum(end - start for start, end in merged))
 
     # Extract total hours, minutes, and seconds from total_time
     total_seconds = int(totalTime.total_seconds())
@@ -135,15 +386,13 @@ def getTotalHoursForToday(service):
     print('total_seconds: ', total_seconds)     
 
 
-def addEvent(service):
-    # the below two variabes are passed from command line arguments
-    description = argv[2] 
-    durationHours = float(argv[3])
+# the description and duration (in hours) come from the command line, or from the daemon client
+def addEvent(service, description, durationHours):
 
-    # Define the timezone (IST, UTC+5:30)
-    my_timezone = timezone(timedelta(hours=5, minutes=30))
+    # the timezone comes from CALENDAR_TIMEZONE (IST by default)
+    my_timezone = LOCAL_TIMEZONE
 
-    # Get the current time in IST
+    # Get the current time in that timezone
     start_time = datetime.now(my_timezone)
 
     # Calculate the end time by adding the duration
@@ -158,42 +407,148 @@ def addEvent(service):
         "summary": description,
         "start": {
             "dateTime": start_time_iso,
-            "timeZone": "Asia/Kolkata",  # Set the timezone to IST
+            "timeZone": TIMEZONE_NAME,
         },
         "end": {
             "dateTime": end_time_iso,
-            "timeZone": "Asia/Kolkata",  # Set the timezone to IST
+            "timeZone": TIMEZONE_NAME,
         },
     }
 
     # Insert the event into the calendar
     events_result = service.events().insert(calendarId=codingCalendarId, body=event).execute()
-    
-  
-def main():
-  creds = None
-  # The file token.json stores the user's access and refresh tokens, and is
-  # created automatically when the authorization flow completes for the first
-  # time.
-  if os.path.exists("token.json"):
-    creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-  # If there are no (valid) credentials available, let the user log in.
-  if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-      creds.refresh(Request())
-    else:
-      flow = InstalledAppFlow.from_client_secrets_file(
-          "credentials.json", SCOPES
-      )
-      creds = flow.run_local_server(port=0)
-    # Save the credentials for the next run
-    with open("token.json", "w") as token:
-      token.write(creds.to_json())
 
-  try:
-    service = build("calendar", "v3", credentials=creds)
-    
-    methodToCall = argv[1]
+
+# a naive time from the import file is taken in the local timezone
+def parseEventTime(value):
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=LOCAL_TIMEZONE)
+    return parsed
+
+
+# reads the events to import, a .jsonl file holds one API event body per line, a csv file has the columns
+# summary,start and either end or durationHours (e.g. "Code review,2024-03-01T10:00,1.5")
+def loadEventsFile(path):
+    events = []
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    events.append(json.loads(line))
+            return events
+
+        for row in csv.DictReader(file):
+            start = parseEventTime(row["start"])
+            if row.get("end"):
+                end = parseEventTime(row["end"])
+            else:
+                end = start + timedelta(hours=float(row["durationHours"]))
+            events.append({
+                "summary": row["summary"],
+                "start": {"dateTime": start.isoformat(), "timeZone": TIMEZONE_NAME},
+                "end": {"dateTime": end.isoformat(), "timeZone": TIMEZONE_NAME},
+            })
+    return events
+
+
+# the event id is derived from the calendar and the event itself, so an insert retried after a lost response
+# (or a whole import run again) answers 409 instead of creating a duplicate
+def importEventId(calendarId, event):
+    key = json.dumps([calendarId, event.get("summary"), event["start"], event["end"]], sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def isRetryable(error):
+    import httplib2
+    from googleapiclient.errors import BatchError, HttpError
+
+    if isinstance(error, HttpError):
+        if error.resp.status == 403:
+            return any(detail.get("reason") in RATE_LIMIT_REASONS for detail in (error.error_details or []) if isinstance(detail, dict))
+        return error.resp.status in RETRYABLE_STATUSES
+    # transport errors and malformed batch responses, nothing is known about the events so they are sent again
+    return isinstance(error, (BatchError, httplib2.HttpLib2Error, OSError))
+
+
+def backoffDelay(attempts, baseSeconds=BACKOFF_BASE_SECONDS):
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, baseSeconds * 2 ** attempts))
+
+
+# this inserts many events with batch requests of INSERT_BATCH_SIZE calls, the batches of a round sent at once on the
+# shared executor. Every event gets its own result in the batch callback, events failing with a rate limit or server
+# error go into the next round (after a backoff) until MAX_INSERT_ATTEMPTS, other errors are reported right away.
+# Returns (created, alreadyThere, failures) where failures is a list of (position in the input, error)
+def bulkAddEvents(service, events, calendarId=None, batchSize=INSERT_BATCH_SIZE, backoffSeconds=BACKOFF_BASE_SECONDS):
+    from googleapiclient.errors import HttpError
+
+    calendarId = calendarId or codingCalendarId
+    bodies = [dict(event, id=event.get("id") or importEventId(calendarId, event)) for event in events]
+    pending = list(range(len(bodies)))
+    attempts = [0] * len(bodies)
+    created = alreadyThere = 0
+    failures = []
+    # service.events() builds the resource (every method from the discovery document) on each call, so once is enough
+    eventsResource = service.events()
+    executor = getExecutor()
+    # the callbacks of batches running at once come from different executor threads
+    resultLock = threading.Lock()
+
+    while pending:
+        retry = []
+
+        def handleResult(requestId, response, exception):
+            nonlocal created, alreadyThere
+            index = int(requestId)
+            with resultLock:
+                attempts[index] += 1
+                if exception is None:
+                    created += 1
+                elif isinstance(exception, HttpError) and exception.resp.status == 409:
+                    alreadyThere += 1
+                elif isRetryable(exception) and attempts[index] < MAX_INSERT_ATTEMPTS:
+                    retry.append(index)
+                else:
+                    failures.append((index, exception))
+
+        async def sendBatch(chunk):
+            batch = service.new_batch_http_request(callback=handleResult)
+            for index in chunk:
+                batch.add(eventsResource.insert(calendarId=calendarId, body=bodies[index]), request_id=str(index))
+            try:
+                await executor.execute(batch, api="calendar")
+            except Exception as error:
+                # the batch as a whole failed, every event in it counts one attempt
+                for index in chunk:
+                    handleResult(str(index), None, error)
+
+        executor.runAll([sendBatch(pending[offset:offset + batchSize]) for offset in range(0, len(pending), batchSize)])
+
+        if retry:
+            delay = backoffDelay(max(attempts[index] for index in retry), backoffSeconds)
+            print(f"Retrying {len(retry)} events in {delay:.1f}s")
+            sleep(delay)
+        pending = sorted(retry)
+
+    return created, alreadyThere, failures
+
+
+def addEventsFromFile(service, path):
+    events = loadEventsFile(path)
+    created, alreadyThere, failures = bulkAddEvents(service, events)
+    for index, error in sorted(failures, key=lambda failure: failure[0]):
+        print(f"Event {index + 1} ({events[index].get('summary')}) failed: {error}")
+    print(f"Created {created}, already in the calendar {alreadyThere}, failed {len(failures)} of {len(events)} events")
+
+
+# the calendar service the commands use, built once. getService refreshes the token when it is close to expiry
+def calendarService():
+    return getService("calendar", "v3", SCOPES)
+
+
+# runs one command, args as on the command line without the script name e.g. ['add', 'Code review', '1.5']
+def runCommand(service, args):
+    methodToCall = args[0]
     if methodToCall == 'get10':
       # this gives us the upcoming 10 events from now
       get10EventsFromNow(service)
@@ -203,14 +558,134 @@ def main():
     elif methodToCall == 'geth':
       # this gives the total hours of today's meetings
       getTotalHoursForToday(service)
+    elif methodToCall == 'hours':
+      # this gives the busy hours between two dates: hours START END [day|week|keyword] [keyword1,keyword2]
+      rollup = args[3] if len(args) > 3 else 'day'
+      keywords = args[4].split(',') if len(args) > 4 else []
+      getHoursForRange(service, args[1], args[2], rollup, keywords)
+    elif methodToCall == 'add' and len(args) == 2:
+      # this adds every event of a csv/jsonl file with batch requests: add events.csv
+      addEventsFromFile(service, args[1])
     elif methodToCall == 'add':
-      # this lets us to add a new event to the calendar
-      addEvent(service)     
+      # this lets us to add a new event to the calendar: add DESCRIPTION HOURS
+      addEvent(service, args[1], float(args[2]))
+    elif methodToCall == 'ping':
+      # the liveness check of client.py and serve, it needs no calendar call
+      print("pong")
+    elif methodToCall == 'resync':
+      # this drops the local copy of the calendar and fetches everything again
+      store = openEventStore()
+      changes = syncEvents(service, store, codingCalendarId, forceFull=True)
+      store.close()
+      print(f"Synced {changes} events")
+    else:
+      print(f"Unknown command: {methodToCall}")
+
+
+# one connection carries one command as a json line, {"args": [...]}, and gets back what the command printed
+class CommandHandler(socketserver.StreamRequestHandler):
+    # a client that connects and sends nothing can't hold up the daemon
+    timeout = 10
+
+    def handle(self):
+        output = StringIO()
+        error = None
+        warning = None
+        try:
+            args = json.loads(self.rfile.readline())["args"]
+            # a ping is answered without the service, so a token refresh can't hold up the liveness check
+            service = None if args[:1] == ['ping'] else self.server.connect()
+            with redirect_stdout(output):
+                runCommand(service, args)
+            if args and args[0] == 'add':
+                # the new events show up in the next read without waiting for the background sync. The add itself
+                # is done, so a failing sync is only a warning and the background sync tries again
+                try:
+                    self.server.syncCalendars(service)
+                except Exception as exception:
+                    warning = f"the events were added but the sync failed: {str(exception) or type(exception).__name__}"
+        except Exception as exception:
+            error = str(exception) or type(exception).__name__
+        reply = {"output": output.getvalue(), "error": error, "warning": warning}
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+# commands are handled one at a time and the event store is only used on this thread, the API calls of a sync
+# run on the shared executor.
+# Between commands serve_forever calls service_actions, which keeps the store synced in the background.
+# connect returns the calendar service the commands run against
+class CommandServer(socketserver.UnixStreamServer):
+    def __init__(self, socketPath, connect=calendarService):
+        self.lastSync = 0
+        self.connect = connect
+        super().__init__(socketPath, CommandHandler)
+
+    def syncCalendars(self, service):
+        self.lastSync = monotonic()
+        store = openEventStore()
+        try:
+            syncCalendarEvents(service, store, list(dict.fromkeys([codingCalendarId, *extraCalendarIds])))
+        finally:
+            store.close()
+
+    def service_actions(self):
+        if monotonic() - self.lastSync < DAEMON_SYNC_SECONDS:
+            return
+        try:
+            self.syncCalendars(self.connect())
+        except Exception as error:
+            # the next round tries again, reads sync on their own once the store is older than syncMaxAgeSeconds
+            print(f"Background sync failed: {error}")
+
+
+# this keeps the calendar service warm and answers the thin client (client.py) over a unix socket:
+# python index.py serve. Stop it with Ctrl+C or SIGTERM
+def serveCommands(connect=calendarService):
+    global syncMaxAgeSeconds
+    from client import DAEMON_SOCKET_PATH, sendCommand
+
+    # a socket file left behind by a daemon that died is removed, a live daemon is left alone
+    if os.path.exists(DAEMON_SOCKET_PATH):
+        try:
+            sendCommand(["ping"])
+            print(f"A daemon is already listening on {DAEMON_SOCKET_PATH}")
+            return
+        except ConnectionRefusedError:
+            os.unlink(DAEMON_SOCKET_PATH)
+
+    # log in, build the service and fill the store before taking commands
+    service = connect()
+    syncMaxAgeSeconds = DAEMON_SYNC_SECONDS * 2
+    # only this user may talk to the daemon, it acts with their calendar credentials
+    previousUmask = os.umask(0o177)
+    try:
+        server = CommandServer(DAEMON_SOCKET_PATH, connect)
+    finally:
+        os.umask(previousUmask)
+    server.syncCalendars(service)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Listening on {DAEMON_SOCKET_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(DAEMON_SOCKET_PATH)
+
 
+def main():
+  from googleapiclient.errors import HttpError
 
-  except HttpError as error:
+  try:
+    if argv[1] == 'serve':
+      serveCommands()
+    else:
+      runCommand(calendarService(), argv[1:])
+  except (HttpError, ValueError) as error:
+    # ValueError for bad arguments, e.g. an unknown rollup
     print(f"An error occurred: {error}")
 
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
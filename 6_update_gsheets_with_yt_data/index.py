@@ -1,11 +1,19 @@
 import os
+import sys
+import asyncio
+import json
+import re
+import sqlite3
+from datetime import datetime, timezone
+from functools import partial
+from difflib import SequenceMatcher
+from time import perf_counter, sleep
 from dotenv import load_dotenv
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+# the shared google_services module (cached credentials and services) lives in the repository root. Like it, this
+# script imports the google client libraries only inside the functions using them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from google_services import getExecutor, getService
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,100 +22,210 @@ YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
 YOUTUBE_API_SERVICE_NAME = "youtube"
 YOUTUBE_API_VERSION = "v3"
 
+# only what the sheet needs, plus the etag the next run sends back in If-None-Match
+PLAYLIST_FIELDS = "etag,nextPageToken,items(snippet(title,resourceId/videoId))"
+# pages seen before (with their etags) and the metrics of every run are kept here
+YOUTUBE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "youtube_cache.sqlite3")
+# playlistItems.list costs 1 quota unit per call, a 304 is counted too
+QUOTA_UNITS_PER_CALL = 1
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
 
 # The ID and range of the spreadsheet to edit.
 SPREADSHEET_ID = "1hOAqrnjkwksty6eqzakyjrkpZEEQWAkMkRreBdiE5f0"
+SHEET_ID = 0
+# the links go down the column from this cell, everything below it in the column belongs to the sync
+START_CELL = os.getenv('SHEET_START_CELL', 'E6')
+
+# limits for one batchUpdate: rows per updateCells request, requests per call and the size of the json body.
+# Calls are spaced so a long sync stays under the per-user write quota (60 write requests a minute)
+ROWS_PER_UPDATE = 500
+MAX_REQUESTS_PER_BATCH = 100
+MAX_BATCH_BYTES = 1_000_000
+MIN_SECONDS_BETWEEN_WRITES = 1.0
+
+# 'E6' -> (4, 5), the 0-based column and row indexes of a cell
+def cellIndexes(cell):
+    letters, row = re.fullmatch(r"([A-Za-z]+)(\d+)", cell).groups()
+    column = 0
+    for letter in letters.upper():
+        column = column * 26 + ord(letter) - ord("A") + 1
+    return column - 1, int(row) - 1
 
-# This method will update the google sheet with youtube links from dataList
-def updateSheetsWithYtLinks(service, startCell, dataList):
-# Prepare the requests for the batch update
-    requests = []
-    current_row = int(startCell[1:])  # Extract the starting row (e.g., from 'E6')
 
-    for title, link in dataList:
-        # Create a request to update the cell with a hyperlinked value
+# the formula written for a video, quotes in the title are doubled so they can't end the string early
+def hyperlinkFormula(title, link):
+    return f'=HYPERLINK("{link}", "{title.replace(chr(34), chr(34) * 2)}")'
+
+
+def columnRange(column, startRow, endRow):
+    return {
+        "sheetId": SHEET_ID,
+        "startRowIndex": startRow,
+        "endRowIndex": endRow,
+        "startColumnIndex": column,
+        "endColumnIndex": column + 1,
+    }
+
+
+# one updateCells request per ROWS_PER_UPDATE consecutive rows, instead of one request per cell
+def updateRequests(column, startRow, formulas):
+    requests = []
+    for offset in range(0, len(formulas), ROWS_PER_UPDATE):
+        rows = formulas[offset:offset + ROWS_PER_UPDATE]
         requests.append({
-        "updateCells": {
-            "range": {
-                "sheetId": 0,
-                "startRowIndex": current_row - 1,
-                "endRowIndex": current_row,
-                "startColumnIndex": 4,  # Column 'E' corresponds to index 4 (0-based)
-                "endColumnIndex": 5,
-            },
-            "rows": [{
-                "values": [{
-                    "userEnteredValue": {"formulaValue": f'=HYPERLINK("{link}", "{title}")'},
-                    "userEnteredFormat": {
-                        "textFormat": {
-                            "fontSize": 14
+            "updateCells": {
+                "range": columnRange(column, startRow + offset, startRow + offset + len(rows)),
+                "rows": [{
+                    "values": [{
+                        "userEnteredValue": {"formulaValue": formula},
+                        "userEnteredFormat": {
+                            "textFormat": {
+                                "fontSize": 14
+                            }
                         }
-                    }
-                }]
-            }],
-            "fields": "userEnteredValue,userEnteredFormat.textFormat"
-        }
-    })
-        current_row += 1  # Move to the next row
+                    }]
+                } for formula in rows],
+                "fields": "userEnteredValue,userEnteredFormat.textFormat"
+            }
+        })
+    return requests
+
+
+# the requests turning the column's current formulas into the wanted ones. The two lists are matched with
+# SequenceMatcher, so a video added or removed in the middle becomes an insertRange/deleteRange (cells of this
+# column only shift) instead of rewriting every row after it. The changes are emitted from the bottom up, so the
+# row numbers of a change are never moved by the changes sent before it
+def diffRequests(current, wanted, column, startRow):
+    requests = []
+    opcodes = SequenceMatcher(None, current, wanted, autojunk=False).get_opcodes()
+    for tag, i1, i2, j1, j2 in reversed(opcodes):
+        if tag == "equal":
+            continue
+        kept = min(i2 - i1, j2 - j1)
+        if i2 - i1 > kept:
+            requests.append({"deleteRange": {"range": columnRange(column, startRow + i1 + kept, startRow + i2), "shiftDimension": "ROWS"}})
+        if j2 - j1 > kept:
+            requests.append({"insertRange": {"range": columnRange(column, startRow + i1 + kept, startRow + i1 + j2 - j1), "shiftDimension": "ROWS"}})
+        requests += updateRequests(column, startRow + i1, wanted[j1:j2])
+    return requests
+
+
+# splits the requests into batchUpdate bodies under MAX_REQUESTS_PER_BATCH and MAX_BATCH_BYTES, keeping their order
+def chunkRequests(requests):
+    batches = []
+    batch, batchBytes = [], 0
+    for request in requests:
+        size = len(json.dumps(request))
+        if batch and (len(batch) == MAX_REQUESTS_PER_BATCH or batchBytes + size > MAX_BATCH_BYTES):
+            batches.append(batch)
+            batch, batchBytes = [], 0
+        batch.append(request)
+        batchBytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# This method will update the google sheet with youtube links from dataList. The column is read once (as formulas)
+# and only the rows that differ are written, so a run where nothing changed sends no update at all.
+# Every batchUpdate applies atomically, if a later one fails the next run's diff picks up from what was written
+def updateSheetsWithYtLinks(service, startCell, dataList):
+    from googleapiclient.errors import HttpError
+
+    column, startRow = cellIndexes(startCell)
+    columnLetters = re.match(r"[A-Za-z]+", startCell).group()
+    result = service.spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID,
+        range=f"{startCell}:{columnLetters}",
+        valueRenderOption="FORMULA",
+    ).execute()
+    current = [row[0] if row else "" for row in result.get("values", [])]
+    wanted = [hyperlinkFormula(title, link) for title, link in dataList]
 
-    # Batch update the requests
-    body = {"requests": requests}
+    requests = diffRequests(current, wanted, column, startRow)
+    if not requests:
+        print("Sheet already up to date")
+        return
+
+    batches = chunkRequests(requests)
     try:
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=SPREADSHEET_ID, body=body).execute()
-        print("Cells updated successfully!")
+        for number, batch in enumerate(batches):
+            if number:
+                sleep(MIN_SECONDS_BETWEEN_WRITES)
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=SPREADSHEET_ID, body={"requests": batch}).execute()
+        print(f"Cells updated successfully! {len(requests)} requests in {len(batches)} calls for {len(wanted)} rows")
     except HttpError as err:
         print(f"An error occurred: {err}")
 
 
-# the below method will get the dataList from youtube api as a method parameter, and will update the tokens, and then gives access to google sheets.
+# the below method will get the dataList from youtube api as a method parameter, and gets the sheets service (logging in if needed) to update the sheet.
 def manageGoogleSheets(dataList):
-  creds = None
-  # The file token.json stores the user's access and refresh tokens, and is
-  # created automatically when the authorization flow completes for the first
-  # time.
-  if os.path.exists("token.json"):
-    creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-  # If there are no (valid) credentials available, let the user log in.
-  if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-      creds.refresh(Request())
-    else:
-      flow = InstalledAppFlow.from_client_secrets_file(
-          "credentials.json", SCOPES
-      )
-      creds = flow.run_local_server(port=0)
-    # Save the credentials for the next run
-    with open("token.json", "w") as token:
-      token.write(creds.to_json()) 
+  from googleapiclient.errors import HttpError
 
   try:
-    service = build("sheets", "v4", credentials=creds)
-    updateSheetsWithYtLinks(service, 'E6', dataList)
+    service = getService("sheets", "v4", SCOPES)
+    updateSheetsWithYtLinks(service, START_CELL, dataList)
   except HttpError as err:
     print(err)       
 
-# This method will call the youtube API and list the title and link to all the youtube videos for a give playlist (given playListId as method params)          
-def getYoutubePlaylistData(playListId):
-   # Build the YouTube API client
-    youtube = build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, developerKey=YOUTUBE_API_KEY)
-    
+def openYoutubeCache(path=YOUTUBE_CACHE_PATH):
+    cache = sqlite3.connect(path)
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS pages (playlist_id TEXT, page_token TEXT, etag TEXT, body TEXT, "
+        "PRIMARY KEY (playlist_id, page_token))"
+    )
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS runs (started_at TEXT, playlists INTEGER, pages INTEGER, not_modified INTEGER, "
+        "quota_units INTEGER, median_ms REAL, p95_ms REAL, wall_seconds REAL)"
+    )
+    return cache
+
+
+# This method will call the youtube API and list the title and link to all the youtube videos for a give playlist (given playListId as method params).
+# Pages fetched before are sent with their etag in If-None-Match, an unchanged page comes back as 304 without a body and
+# the cached copy is used. Returns the videos, the pages to keep for the next run and the latency of every call.
+# The pages are awaited on the shared executor, so the calls of several playlists overlap
+async def getYoutubePlaylistData(playListId, cachedPages, executor):
+    from googleapiclient.errors import HttpError
+
+    # the first getService builds the service (discovery, imports), that runs on a pool thread and not on the loop
+    youtube = await asyncio.get_running_loop().run_in_executor(
+        executor.pool, partial(getService, YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, developerKey=YOUTUBE_API_KEY))
+    playlistItems = youtube.playlistItems()
+
     # List to store video details
     videos = []
+    pages = {}
+    latencies = []
+    notModified = 0
+    pageToken = ""
 
-    # Fetch playlist items
-    request = youtube.playlistItems().list(
-        part="snippet",
-        playlistId=playListId,
-        maxResults=50  # Maximum results per request
-    )
+    while True:
+        request = playlistItems.list(
+            part="snippet",
+            playlistId=playListId,
+            maxResults=50,  # Maximum results per request
+            pageToken=pageToken or None,
+            fields=PLAYLIST_FIELDS,
+        )
+        cached = cachedPages.get((playListId, pageToken))
+        if cached:
+            request.headers["If-None-Match"] = cached["etag"]
 
-    while request:
-        response = request.execute()
-        for item in response["items"]:
+        try:
+            response = await executor.execute(request, numRetries=3, timings=latencies)
+        except HttpError as err:
+            if err.resp.status != 304 or not cached:
+                raise
+            response = cached
+            notModified += 1
+        pages[(playListId, pageToken)] = response
+
+        for item in response.get("items", []):
             title = item["snippet"]["title"]
             # this is done as my format of title is a bit different having a | in between
             shrinkedTitle = title.split('|')[0].strip()
@@ -115,18 +233,80 @@ def getYoutubePlaylistData(playListId):
             if shrinkedTitle == 'Private video':
                continue
             videos.append((shrinkedTitle, f"https://www.youtube.com/watch?v={video_id}"))
-        
+
         # Check if there is a next page
-        request = youtube.playlistItems().list_next(request, response)
-    
-    return videos
+        pageToken = response.get("nextPageToken")
+        if not pageToken:
+            return videos, pages, latencies, notModified
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# this fetches many playlists at once (as many calls at a time as the executor allows youtube) and returns
+# {playListId: videos}. The cache is read before and written after the fetch, so the executor's threads never touch
+# sqlite. The run's calls, 304s, quota units and call latencies are printed and saved in the runs table
+def fetchPlaylists(playListIds, cachePath=YOUTUBE_CACHE_PATH, executor=None):
+    # nothing to fetch, and no latencies to take percentiles of
+    if not playListIds:
+        return {}
+    executor = executor or getExecutor()
+    startedAt = datetime.now(timezone.utc)
+    began = perf_counter()
+    cache = openYoutubeCache(cachePath)
+    try:
+        placeholders = ",".join("?" * len(playListIds))
+        cachedPages = {
+            (playlistId, pageToken): json.loads(body)
+            for playlistId, pageToken, body in cache.execute(
+                f"SELECT playlist_id, page_token, body FROM pages WHERE playlist_id IN ({placeholders})", playListIds
+            )
+        }
+
+        uniqueIds = list(dict.fromkeys(playListIds))
+        results = dict(zip(uniqueIds, executor.runAll(
+            [getYoutubePlaylistData(playListId, cachedPages, executor) for playListId in uniqueIds]
+        )))
+
+        latencies = []
+        notModified = 0
+        with cache:
+            for playListId, (videos, pages, playlistLatencies, playlistNotModified) in results.items():
+                latencies += playlistLatencies
+                notModified += playlistNotModified
+                # pages the playlist no longer has are dropped with the rest
+                cache.execute("DELETE FROM pages WHERE playlist_id = ?", (playListId,))
+                cache.executemany(
+                    "INSERT INTO pages VALUES (?, ?, ?, ?)",
+                    [(playlistId, pageToken, page["etag"], json.dumps(page)) for (playlistId, pageToken), page in pages.items()],
+                )
+            wallSeconds = perf_counter() - began
+            medianMs, p95Ms = percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000
+            cache.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (startedAt.isoformat(), len(results), len(latencies), notModified,
+                 len(latencies) * QUOTA_UNITS_PER_CALL, medianMs, p95Ms, wallSeconds),
+            )
+    finally:
+        cache.close()
+
+    print(f"{len(results)} playlists, {len(latencies)} pages ({notModified} unchanged), "
+          f"{len(latencies) * QUOTA_UNITS_PER_CALL} quota units, call latency median {medianMs:.0f} ms p95 {p95Ms:.0f} ms, "
+          f"{wallSeconds:.2f}s total")
+    return {playListId: result[0] for playListId, result in results.items()}
 
      
 # This is the main method which is called when the file runs.
 def main():
+  from googleapiclient.errors import HttpError
+
   try:
-    playListId = 'PLTAENWuWDOFZIksY0EyCIexy3pn9Tegd9' # Add any playlist id from youtube
-    dataList = getYoutubePlaylistData(playListId)
+    # playlist ids from the command line or YOUTUBE_PLAYLIST_IDS (comma separated), their videos go to the sheet in that order
+    playListIds = sys.argv[1:] or os.getenv('YOUTUBE_PLAYLIST_IDS', 'PLTAENWuWDOFZIksY0EyCIexy3pn9Tegd9').split(',') # Add any playlist id from youtube
+    playlists = fetchPlaylists([playListId.strip() for playListId in playListIds if playListId.strip()])
+    dataList = [video for videos in playlists.values() for video in videos]
     manageGoogleSheets(dataList)
   except HttpError as err:
     print(err)
@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import socket
+import tempfile
+
+# thin client for the email to calendar daemon (python index.py serve). It only uses the standard library, so a cron
+# job or a hotkey asking for the new meeting requests to be handled now pays for the interpreter start and one socket
+# round trip, not for the google client imports, login and discovery, e.g. python client.py, python client.py ping
+# When no daemon is running the command runs through index.py as before
+
+# override with EMAIL_CALENDAR_SOCKET, the daemon reads the same variable
+DAEMON_SOCKET_PATH = os.getenv(
+    "EMAIL_CALENDAR_SOCKET", os.path.join(tempfile.gettempdir(), f"email_to_calendar_{os.getuid()}.sock")
+)
+# handling a large backlog of requests can take a while, a command slower than this is reported as failed
+RESPONSE_TIMEOUT_SECONDS = 300
+
+
+def send_command(args, socket_path=DAEMON_SOCKET_PATH):
+    """Send one command to the daemon and return its reply, {"output": printed text, "error": message or None}."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(RESPONSE_TIMEOUT_SECONDS)
+        connection.connect(socket_path)
+        connection.sendall(json.dumps({"args": args}).encode("utf-8") + b"\n")
+        connection.shutdown(socket.SHUT_WR)
+        reply = b""
+        while chunk := connection.recv(65536):
+            reply += chunk
+    return json.loads(reply)
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        reply = send_command(args)
+    except (FileNotFoundError, ConnectionRefusedError):
+        index_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.py")
+        os.execv(sys.executable, [sys.executable, index_path, *args])
+
+    sys.stdout.write(reply["output"])
+    if reply["error"]:
+        print(f"An error occurred: {reply['error']}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,35 @@
 import re
+import asyncio
 import base64
+import codecs
+import csv
+import glob
+import hashlib
+import json
+import mailbox
+import email
+import queue
+import random
+import signal
+import socketserver
+import sqlite3
+import sys
+from bisect import bisect_left, bisect_right
+from contextlib import redirect_stdout
+from io import StringIO
 from uuid import uuid4
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from email.message import EmailMessage
-from googleapiclient.errors import HttpError
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from time import sleep, perf_counter, monotonic
 from dotenv import load_dotenv
 
+# the shared google_services module (cached credentials and services) lives in the repository root. Like it, this
+# script imports the google client libraries only inside the functions using them, the parser tools never need them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from google_services import getCredentials, getExecutor, getService
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -22,63 +41,299 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.readonly',
 timeZone = 'Asia/Kolkata'
 default_meeting_duration=1
 
+# meeting requests are found by this search on the first run, afterwards new mail comes from the history
+# and is kept when its subject contains the phrase. The search only goes SEARCH_DAYS back, so a first run
+# doesn't book (and answer) every old request in the mailbox
+SEARCH_QUERY = 'subject:please plan a meeting'
+SEARCH_DAYS = 2
+SUBJECT_PHRASE = 'please plan a meeting'
+# the same words in a body mark where the request starts, they may be wrapped over lines
+REQUEST_PHRASE = re.compile(r"please\s+plan\s+a\s+meeting", re.IGNORECASE)
+
+# the last handled historyId and the ids of handled messages are kept here
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gmail_state.sqlite3')
+
+# messages are fetched in batch requests of this many calls (gmail suggests at most 50),
+# calls failing with a rate limit or server error are tried again up to MAX_FETCH_ATTEMPTS times
+FETCH_BATCH_SIZE = 50
+MAX_FETCH_ATTEMPTS = 3
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# only the headers are fetched to pick out the meeting requests, the body only for those
+METADATA_FIELDS = 'id,labelIds,payload/headers'
+BODY_FIELDS = 'id,payload(headers,body/data,parts(mimeType,body/data))'
+WATCH_INTERVAL_SECONDS = 30
+# a message failing in this many runs is recorded as given up, so it no longer holds back the historyId
+MAX_MESSAGE_ATTEMPTS = 5
+
+# tasks per pipeline stage, fetch and parse are cheap next to the calendar and gmail writes. Their calls run on the
+# shared executor, which also caps how many go to each API at once
+FETCH_WORKERS = 2
+PARSE_WORKERS = 1
+SCHEDULE_WORKERS = 4
+NOTIFY_WORKERS = 4
+# items waiting between two stages, a slow stage holds back the ones before it instead of piling up work
+STAGE_QUEUE_SIZE = 100
+# tries for a calendar insert or a notification failing with a rate limit or server error
+WRITE_ATTEMPTS = 3
+WRITE_BACKOFF_SECONDS = 1.0
+
+# the primary calendar's id is its owner's email, it doesn't change while the script runs
+organizer_emails = {}
+
+# busy times are loaded with one freebusy query covering FREEBUSY_WINDOW_DAYS from the first request, and
+# extended by as much again when a request (plus FREEBUSY_MARGIN_DAYS either side, where the nearest free
+# slot is looked for) falls outside
+FREEBUSY_WINDOW_DAYS = 30
+FREEBUSY_MARGIN_DAYS = 7
+
+# only the start of a body is decoded and searched: a request gives its date and time near the top, while
+# archived mail can carry megabytes of quoted replies or pasted logs below it
+BODY_SCAN_BYTES = 16 * 1024
+# a meeting length ("for 30 minutes", "a 2 hour call") is looked for in this many characters after the date and time,
+# a shorter one is booked as MIN_MEETING_HOURS
+DURATION_WINDOW_CHARS = 200
+MIN_MEETING_HOURS = 0.25
+MAX_MEETING_HOURS = 12
+
+# the patterns are built and compiled once when the script loads, every message is matched against the same objects
+MONTH_PATTERN = r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b"
+MONTH_NUMBERS = {name: number for number, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+
+# 2024-05-01, 2024/5/1, 01/05/2024, 1st May 2024, 1 May, May 1, 2024, Sept. 1
+DATE_PATTERN = rf"""(?<![\w.:/-])(?:
+    (?P<iso_year>\d{{4}})[-/.](?P<iso_month>\d{{1,2}})[-/.](?P<iso_day>\d{{1,2}})
+  | (?P<numeric_first>\d{{1,2}})[-/.](?P<numeric_second>\d{{1,2}})[-/.](?P<numeric_year>\d{{4}})
+  | (?P<dmy_day>\d{{1,2}})(?:st|nd|rd|th)?(?:\s+of)?\s+(?P<dmy_month>{MONTH_PATTERN})\.?(?:,?\s+(?P<dmy_year>\d{{4}}))?
+  | (?P<mdy_month>{MONTH_PATTERN})\.?\s+(?P<mdy_day>\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(?P<mdy_year>\d{{4}}))?
+)(?!\d)"""
+
+# 3:00 PM, 3pm, 3 p.m., 10.30am, 15:00, 15h00, 15:00 hrs, noon
+def time_pattern(name):
+    return rf"""(?<![\d:.])(?:
+    (?P<{name}_hour12>1[0-2]|0?[1-9])(?:[:.](?P<{name}_minute12>[0-5]\d))?\s*(?P<{name}_meridiem>[ap])\.?m\b\.?
+  | (?P<{name}_hour24>[01]?\d|2[0-3])[:h](?P<{name}_minute24>[0-5]\d)(?:\s*(?:hrs|hours|h)\b)?
+  | (?P<{name}_noon>noon|midday)
+)"""
+
+# IST, UTC, UTC+5:30, GMT-8, +0530, America/New_York. Abbreviations only in capitals, so "at" or "on" never count
+def zone_pattern(name):
+    return rf"""(?:\s*\(?(?P<{name}>
+    (?:UTC|GMT)\s*[+-]\s*\d{{1,2}}(?::?\d{{2}})?
+  | [+-]\d{{2}}:?\d{{2}}
+  | (?-i:[A-Z][a-z]+(?:/[A-Za-z_]+)+)
+  | (?-i:[A-Z]{{1,5}})\b
+))?"""
+
+# "3pm to 4:30pm", "15:00-16:00", the end gives the meeting length
+RANGE_END_PATTERN = rf"(?:\s*(?:-|–|to|until|till)\s*{time_pattern('end')})?"
+
+# "on 2024-05-01 at 3:00 PM", "May 1, 2024, 3pm IST" and "at 3 PM on Friday, 1 May 2024 (GMT)"
+DATE_THEN_TIME = re.compile(
+    rf"{DATE_PATTERN}[\s,]*(?:(?:at|from|by)\s+|@\s*)?{time_pattern('start')}{RANGE_END_PATTERN}{zone_pattern('zone')}",
+    re.IGNORECASE | re.VERBOSE)
+TIME_THEN_DATE = re.compile(
+    rf"{time_pattern('start')}{RANGE_END_PATTERN}{zone_pattern('zone')}[\s,]*(?:on\s+)?"
+    rf"(?:(?:mon|tues|wednes|thurs|fri|satur|sun)day,?\s+)?(?:the\s+)?{DATE_PATTERN}{zone_pattern('date_zone')}",
+    re.IGNORECASE | re.VERBOSE)
+
+# every request has a time in it, so the full patterns above only run around the spots this cheap one finds.
+# A date is looked for at most DATE_REACH_CHARS before the time, the time, range and zone take at most MATCH_REACH_CHARS
+TIME_ANCHOR = re.compile(r"\d(?:\s*[ap]\.?m\b|[:h.][0-5]\d)|noon|midday", re.IGNORECASE)
+DATE_REACH_CHARS = 64
+MATCH_REACH_CHARS = 96
+
+# "for 30 minutes", "for an hour", "for 1h30m", "for half an hour", "a 45-minute call", "2 hour meeting"
+DURATION_PATTERN = re.compile(r"""
+    (?P<lead>\bfor\s+(?:about\s+|around\s+|approx(?:imately|\.)?\s+)?)?
+    (?<![\w.])(?P<amount>\d+(?:\.\d+)?|an?|one|two|three|half\s+an?)[\s-]*
+    (?P<unit>hours?|hrs?|h|minutes?|mins?|m)(?![a-z])
+    (?:\s*(?:and\s+)?(?P<extra_minutes>\d{1,2})\s*(?:minutes?|mins?|m)(?![a-z]))?
+    (?P<noun>[\s-]+(?:meeting|call|slot|session|chat|discussion)\b)?
+""", re.IGNORECASE | re.VERBOSE)
+DURATION_WORDS = {'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3}
+
+UTC_OFFSET = re.compile(r"(?:UTC|GMT)?\s*([+-])\s*(\d{1,2}):?(\d{2})?", re.IGNORECASE)
+# abbreviations that name a region keep its daylight saving rules, the ones naming standard or summer time are fixed
+TIME_ZONE_ABBREVIATIONS = {
+    'IST': ZoneInfo('Asia/Kolkata'),
+    'UTC': timezone.utc, 'GMT': timezone.utc, 'Z': timezone.utc,
+    'ET': ZoneInfo('America/New_York'), 'EST': timezone(timedelta(hours=-5)), 'EDT': timezone(timedelta(hours=-4)),
+    'CT': ZoneInfo('America/Chicago'), 'CST': timezone(timedelta(hours=-6)), 'CDT': timezone(timedelta(hours=-5)),
+    'MT': ZoneInfo('America/Denver'), 'MST': timezone(timedelta(hours=-7)), 'MDT': timezone(timedelta(hours=-6)),
+    'PT': ZoneInfo('America/Los_Angeles'), 'PST': timezone(timedelta(hours=-8)), 'PDT': timezone(timedelta(hours=-7)),
+    'BST': timezone(timedelta(hours=1)), 'CET': timezone(timedelta(hours=1)), 'CEST': timezone(timedelta(hours=2)),
+    'SGT': timezone(timedelta(hours=8)), 'JST': timezone(timedelta(hours=9)),
+    'AEST': timezone(timedelta(hours=10)), 'AEDT': timezone(timedelta(hours=11)),
+}
+local_zone = ZoneInfo(timeZone)
+
 def authenticate_google_api():
-    """Authenticate and return a service object for Google APIs."""
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "credentials.json", SCOPES
-            )
-            creds = flow.run_local_server(port=0)
-            # Save the credentials for the next run
-            with open("token.json", "w") as token:
-                token.write(creds.to_json())
-    return creds
-
-def get_latest_email(service):
-    """Fetch the latest email containing meeting details."""
-    # search email subject with given query to find the most appropriate emails
-    results = service.users().messages().list(userId='me', q='subject:please plan a meeting').execute()
-    messages = results.get('messages', [])
-    if not messages:
-        print("No new meeting emails.")
-        return None, None
-    
-    msg_id = messages[0]['id']
-    msg = service.users().messages().get(userId='me', id=msg_id).execute()
+    """Authenticate and return the credentials for Google APIs, logging in if token.json can't be used."""
+    return getCredentials(SCOPES)
+
+def open_state_store(path=STATE_PATH):
+    """Open the sqlite file holding the last historyId and the processed message ids."""
+    store = sqlite3.connect(path)
+    store.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+    store.execute("CREATE TABLE IF NOT EXISTS processed (message_id TEXT PRIMARY KEY, outcome TEXT, processed_at TEXT)")
+    store.execute("CREATE TABLE IF NOT EXISTS failures (message_id TEXT PRIMARY KEY, attempts INTEGER)")
+    return store
+
+def get_history_id(store):
+    row = store.execute("SELECT value FROM state WHERE key = 'history_id'").fetchone()
+    return row[0] if row else None
+
+def save_history_id(store, history_id):
+    with store:
+        store.execute("INSERT OR REPLACE INTO state VALUES ('history_id', ?)", (str(history_id),))
+
+def processed_ids(store, message_ids):
+    """Return the ones among message_ids that were handled before."""
+    found = set()
+    message_ids = list(message_ids)
+    # sqlite limits the number of parameters in one statement
+    for offset in range(0, len(message_ids), 500):
+        chunk = message_ids[offset:offset + 500]
+        placeholders = ",".join("?" * len(chunk))
+        found.update(row[0] for row in store.execute(f"SELECT message_id FROM processed WHERE message_id IN ({placeholders})", chunk))
+    return found
+
+def mark_processed(store, message_id, outcome):
+    with store:
+        store.execute("INSERT OR REPLACE INTO processed VALUES (?, ?, ?)", (message_id, outcome, datetime.now(timezone.utc).isoformat()))
+        store.execute("DELETE FROM failures WHERE message_id = ?", (message_id,))
+
+def record_failure(store, message_id):
+    """Count a failed run for a message and return how many runs it has failed in."""
+    with store:
+        store.execute("INSERT INTO failures VALUES (?, 1) ON CONFLICT(message_id) DO UPDATE SET attempts = attempts + 1", (message_id,))
+        return store.execute("SELECT attempts FROM failures WHERE message_id = ?", (message_id,)).fetchone()[0]
+
+def list_new_message_ids(service, store):
+    """Return the ids of messages added since the stored historyId, and the historyId to store once they are handled.
+
+    Without a stored historyId (first run) or when gmail no longer has that far back (404), the last
+    SEARCH_DAYS of the mailbox are searched with SEARCH_QUERY instead. The profile's historyId is read before that search, so mail arriving
+    during it shows up in the next history call rather than being missed.
+    """
+    from googleapiclient.errors import HttpError
+
+    history_id = get_history_id(store)
+    if history_id:
+        try:
+            message_ids = []
+            page_token = None
+            while True:
+                result = service.users().history().list(
+                    userId='me', startHistoryId=history_id, historyTypes='messageAdded', pageToken=page_token,
+                    fields='history(messagesAdded/message/id),nextPageToken,historyId').execute()
+                for record in result.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message_ids.append(added['message']['id'])
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    return list(dict.fromkeys(message_ids)), result['historyId']
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            print("The stored historyId has expired, searching the mailbox again.")
+
+    latest_history_id = service.users().getProfile(userId='me', fields='historyId').execute()['historyId']
+    message_ids = []
+    page_token = None
+    while True:
+        result = service.users().messages().list(
+            userId='me', q=f'{SEARCH_QUERY} newer_than:{SEARCH_DAYS}d', pageToken=page_token, fields='messages/id,nextPageToken').execute()
+        message_ids += [message['id'] for message in result.get('messages', [])]
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            # the search lists the newest first, requests are handled in the order they came in
+            return message_ids[::-1], latest_history_id
+
+async def fetch_messages(service, message_ids, **params):
+    """Fetch messages with batch requests sent at once, returns ({id: message}, ids that could not be fetched).
+
+    Messages deleted in the meantime (404) are in neither. params go to messages().get, e.g. format and fields.
+    """
+    from googleapiclient.errors import HttpError
+
+    executor = getExecutor()
+    messages = {}
+    failed = []
+    messages_resource = service.users().messages()
+    pending = list(message_ids)
+    for attempt in range(MAX_FETCH_ATTEMPTS):
+        retry = []
+
+        # called on the executor's threads, each message id is in one batch only
+        def handle_response(request_id, response, exception):
+            if exception is None:
+                messages[request_id] = response
+            elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                pass
+            elif isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES:
+                retry.append(request_id)
+            else:
+                print(f"Could not fetch message {request_id}: {exception}")
+                failed.append(request_id)
+
+        async def send_batch(chunk):
+            batch = service.new_batch_http_request(callback=handle_response)
+            for message_id in chunk:
+                batch.add(messages_resource.get(userId='me', id=message_id, **params), request_id=message_id)
+            try:
+                await executor.execute(batch, api='gmail')
+            except Exception as error:
+                # nothing came back for this batch, all of it is tried again
+                print(f"Batch request failed: {error}")
+                retry.extend(chunk)
+
+        await executor.gather([send_batch(pending[offset:offset + FETCH_BATCH_SIZE])
+                               for offset in range(0, len(pending), FETCH_BATCH_SIZE)])
+        pending = retry
+        if not pending:
+            break
+        if attempt + 1 < MAX_FETCH_ATTEMPTS:
+            await asyncio.sleep(2 ** attempt)
+    return messages, failed + pending
+
+def header_value(message, name):
+    for header in message['payload'].get('headers', []):
+        if header['name'].lower() == name.lower():
+            return header['value']
+    return None
+
+def decode_body_head(data, limit=BODY_SCAN_BYTES):
+    """Decode the first `limit` bytes of a base64url body, the rest is never decoded.
+
+    A character cut in half at the limit is left out rather than raising an error.
+    """
+    head = data[:(limit + 2) // 3 * 4]
+    raw = base64.urlsafe_b64decode(head + '=' * (-len(head) % 4))[:limit]
+    return codecs.getincrementaldecoder('utf-8')('replace').decode(raw, final=len(head) == len(data))
+
+def extract_sender_and_body(msg):
+    """Return the sender and the plain text body of a message (its first BODY_SCAN_BYTES),
+    (None, None) if either is missing."""
     payload = msg['payload']
-    headers = payload['headers']
-    
-    sender = None
     # find the sender from headers having 'From' tag
-    for header in headers:
-        if header['name'] == 'From':
-            sender = header['value']
-            break
+    sender = header_value(msg, 'From')
     
     if not sender:
         print("Could not find sender email.")
         return None, None
     
     # Check for the email body in different locations
-    if 'data' in payload['body']:
+    if 'data' in payload.get('body', {}):
         # If the data is directly in the body
-        email_body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+        email_body = decode_body_head(payload['body']['data'])
     else:
         # If the data is in the parts of the payload
         parts = payload.get('parts', [])
         for part in parts:
             if part['mimeType'] == 'text/plain':  # Look for plain text content
-                email_body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+                email_body = decode_body_head(part['body']['data'])
                 break
         else:
             print("No plain text content found.")
@@ -86,30 +341,242 @@ def get_latest_email(service):
     
     return sender, email_body
 
-def parse_email_for_meeting_details(email_body):
-    """Extract meeting date, time, and other details from email body."""
-    # regular expression for finding the date and time of meeting from email body
-    pattern = r"please plan a meeting on (\d{4}-\d{2}-\d{2}) at (\d{1,2}:\d{2} (?:AM|PM))"
-    # case insensitive search
-    match = re.search(pattern, email_body, re.IGNORECASE)
-    if match:
-        return match.group(1), match.group(2)
-    return None, None
-
-def schedule_meeting(service, sender, date, time):
-    """Schedule a meeting in Google Calendar with India time zone and 1-hour duration."""
-    # Fetch the calendar details to get the user's email address
-    calendar = service.calendarList().get(calendarId='primary').execute()
-    organizer_email = calendar['id']
+def parse_time_zone(zone):
+    """The tzinfo for a zone written in a message, None when there is none or it isn't known."""
+    if not zone:
+        return None
+    offset = UTC_OFFSET.fullmatch(zone)
+    if offset:
+        sign, hours, minutes = offset.groups()
+        delta = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        if delta > timedelta(hours=14):
+            return None
+        return timezone(-delta if sign == '-' else delta)
+    if '/' in zone:
+        try:
+            return ZoneInfo(zone)
+        except (ZoneInfoNotFoundError, ValueError):
+            return None
+    return TIME_ZONE_ABBREVIATIONS.get(zone.upper())
+
+def matched_day(match, today):
+    """The date in a match as (year, month, day), a date without a year is its next occurrence from today.
+    None for a numeric date that reads as two different days (05/06/2024 is 5 June or May 6)."""
+    if match['iso_year']:
+        return int(match['iso_year']), int(match['iso_month']), int(match['iso_day'])
+    if match['numeric_year']:
+        first, second = int(match['numeric_first']), int(match['numeric_second'])
+        if first != second and first <= 12 and second <= 12:
+            return None
+        # 13/05/2024 can only be day first, 05/13/2024 only month first
+        day, month = (first, second) if first > 12 else (second, first)
+        return int(match['numeric_year']), month, day
+    day = int(match['dmy_day'] or match['mdy_day'])
+    month = MONTH_NUMBERS[(match['dmy_month'] or match['mdy_month'])[:3].lower()]
+    year = match['dmy_year'] or match['mdy_year']
+    if year:
+        return int(year), month, day
+    return (today.year if (month, day) >= (today.month, today.day) else today.year + 1), month, day
+
+def matched_time(match, name):
+    """(hour, minute) of the 'start' or 'end' time in a match, None if that time isn't there."""
+    if match[f'{name}_hour12']:
+        hour = int(match[f'{name}_hour12']) % 12 + (12 if match[f'{name}_meridiem'].lower() == 'p' else 0)
+        return hour, int(match[f'{name}_minute12'] or 0)
+    if match[f'{name}_hour24']:
+        return int(match[f'{name}_hour24']), int(match[f'{name}_minute24'])
+    if match[f'{name}_noon']:
+        return 12, 0
+    return None
+
+def stated_duration(text):
+    """Hours of the first meeting length in text, None if it gives none."""
+    for match in DURATION_PATTERN.finditer(text):
+        # a bare "2 hours" is too often about something else, only "for 2 hours" or "2 hour meeting" count
+        if not match['lead'] and not match['noun']:
+            continue
+        amount = match['amount'].lower()
+        if amount.startswith('half'):
+            value = 0.5
+        else:
+            value = DURATION_WORDS.get(amount) or float(amount)
+        hours = value if match['unit'][0].lower() == 'h' else value / 60
+        hours += int(match['extra_minutes'] or 0) / 60
+        if 0 < hours <= MAX_MEETING_HOURS:
+            return hours
+    return None
+
+def meeting_from_match(match, text, today):
+    """(start, duration in hours) for a date and time match, None if it isn't a real or unambiguous date or time."""
+    start_time = matched_time(match, 'start')
+    zone = parse_time_zone(match['zone'] or match.groupdict().get('date_zone')) or local_zone
+    day = matched_day(match, today)
+    if not day:
+        return None
+    try:
+        start = datetime(*day, *start_time, tzinfo=zone)
+    except ValueError:
+        # e.g. 31 April
+        return None
+    end_time = matched_time(match, 'end')
+    if end_time and end_time > start_time:
+        duration_hours = (end_time[0] - start_time[0]) + (end_time[1] - start_time[1]) / 60
+    else:
+        # text before the request ("I waited for 2 hours") never sets the length
+        duration_hours = stated_duration(text[match.end():match.end() + DURATION_WINDOW_CHARS]) or default_meeting_duration
+    return start, max(duration_hours, MIN_MEETING_HOURS)
+
+def first_meeting(email_body, today, begin=0):
+    """(start, duration in hours) of the first date and time written next to each other, either way round,
+    from position begin on. None if there is none."""
+    for anchor in TIME_ANCHOR.finditer(email_body, begin):
+        position = anchor.start()
+        end = position + MATCH_REACH_CHARS
+        # a date just before the time, or the time (starting at the anchor, or a digit earlier for 10:30) then a date
+        matches = [match for match in DATE_THEN_TIME.finditer(email_body, max(begin, position - DATE_REACH_CHARS), end)
+                   if match.start() <= position]
+        matches += filter(None, (TIME_THEN_DATE.match(email_body, start, end) for start in (max(begin, position - 1), position)))
+        for match in sorted(matches, key=lambda match: match.start()):
+            meeting = meeting_from_match(match, email_body, today)
+            if meeting:
+                return meeting
+    return None
+
+def parse_email_for_meeting_details(email_body, today=None):
+    """Find the requested meeting in an email body.
+
+    Returns (start, duration in hours), start being a timezone aware datetime (the organizer's time zone
+    unless the body names one), or (None, None). When the body has the request phrase only the text after
+    it is searched, so a quoted header or signature above it ("Sent: 2024-04-19 10:15 AM") isn't taken for
+    the meeting, a body without the phrase gets its first date and time. Either way the search stops at the
+    request and never reads the rest of the body.
+    """
+    today = today or datetime.now(local_zone).date()
+    request = REQUEST_PHRASE.search(email_body)
+    return first_meeting(email_body, today, request.end() if request else 0) or (None, None)
+
+async def get_organizer_email(service):
+    """Return the email address of the primary calendar's owner, fetched on first use and cached."""
+    if 'primary' not in organizer_emails:
+        calendar = await getExecutor().execute(service.calendarList().get(calendarId='primary'))
+        organizer_emails['primary'] = calendar['id']
+    return organizer_emails['primary']
+
+class BusySchedule:
+    """The organizer's busy times as sorted, non-overlapping intervals (timestamps) in two parallel lists.
+
+    A slot is checked with two bisects, O(log n), and the nearest free slot is found from the same position.
+    Meetings booked during the run are added, so requests handled together can't take the same slot.
+    The schedule tasks share one instance and go through `lock`, so it is made on the loop they run on.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.loaded = None
+        self.reserved = {}
+        self.lock = asyncio.Lock()
+
+    def add(self, start, end):
+        """Mark [start, end) busy, merging it with the intervals it overlaps or touches."""
+        first = bisect_left(self.ends, start)
+        last = bisect_right(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+
+    def is_free(self, start, end):
+        index = bisect_right(self.starts, start) - 1
+        if index >= 0 and self.ends[index] > start:
+            return False
+        return index + 1 >= len(self.starts) or self.starts[index + 1] >= end
+
+    def next_free(self, start, duration):
+        """The earliest start at or after `start` with `duration` seconds free."""
+        index = bisect_right(self.starts, start) - 1
+        if index >= 0 and self.ends[index] > start:
+            start = self.ends[index]
+        index += 1
+        while index < len(self.starts) and self.starts[index] < start + duration:
+            start = self.ends[index]
+            index += 1
+        return start
+
+    def previous_free(self, end, duration):
+        """The latest start of a free stretch of `duration` seconds ending at or before `end`."""
+        index = bisect_left(self.ends, end)
+        if index < len(self.starts) and self.starts[index] < end:
+            end = self.starts[index]
+        index -= 1
+        while index >= 0 and self.ends[index] > end - duration:
+            end = self.starts[index]
+            index -= 1
+        return end - duration
+
+    def nearest_free(self, start, duration, not_before):
+        """The free slot closest to `start`, earlier ones only if they don't start before `not_before`."""
+        later = self.next_free(start, duration)
+        earlier = self.previous_free(start + duration, duration)
+        if earlier >= not_before and start - earlier < later - start:
+            return earlier
+        return later
+
+    async def ensure_loaded(self, service, start, end):
+        """Query freebusy for the part of [start, end) not loaded yet, at least FREEBUSY_WINDOW_DAYS at a time
+        so requests spread over weeks need a query or two rather than one each. The loaded range only grows."""
+        if self.loaded and self.loaded[0] <= start and end <= self.loaded[1]:
+            return
+        window_seconds = FREEBUSY_WINDOW_DAYS * 86400
+        if not self.loaded:
+            missing = [(start, max(end, start + window_seconds))]
+        else:
+            missing = [
+                (min(start, self.loaded[0] - window_seconds), self.loaded[0]) if start < self.loaded[0] else None,
+                (self.loaded[1], max(end, self.loaded[1] + window_seconds)) if end > self.loaded[1] else None,
+            ]
+        missing = [window for window in missing if window]
+        for window in missing:
+            result = await getExecutor().execute(service.freebusy().query(body={
+                'timeMin': datetime.fromtimestamp(window[0], timezone.utc).isoformat(),
+                'timeMax': datetime.fromtimestamp(window[1], timezone.utc).isoformat(),
+                'items': [{'id': 'primary'}],
+            }))
+            calendar = result['calendars']['primary']
+            if calendar.get('errors'):
+                raise RuntimeError(f"freebusy failed: {calendar['errors']}")
+            for busy in calendar.get('busy', []):
+                self.add(event_timestamp(busy['start']), event_timestamp(busy['end']))
+        self.loaded = (min([window[0] for window in missing] + list(self.loaded or [])),
+                       max([window[1] for window in missing] + list(self.loaded or [])))
+
+def event_timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def meeting_event_id(message_id):
+    """Calendar event id for the meeting asked for in a message, the same message always gives the same event."""
+    return hashlib.sha1(f"meeting-request:{message_id}".encode('utf-8')).hexdigest()
+
+async def schedule_meeting(service, sender, start, event_id=None, duration_hours=default_meeting_duration):
+    """Schedule a meeting in Google Calendar at start (a timezone aware datetime) in the organizer's time zone.
+
+    With an event_id a second call for the same request finds the event already there (409) and
+    returns its meeting link instead of creating another one.
+    """
+    from googleapiclient.errors import HttpError
+
+    # the user's email address, from the calendar details fetched once per run
+    organizer_email = await get_organizer_email(service)
     
-    # Parse the date and time in 12-hour format (e.g., '03:00 PM') and convert to 24-hour format
-    start_time_obj = datetime.strptime(f"{date} {time}", "%Y-%m-%d %I:%M %p")
+    # the requested time as the organizer's local time
+    start_time_obj = start.astimezone(local_zone).replace(tzinfo=None)
     
     # Convert start time to ISO 8601 format (Google Calendar expects this format)
     start_time = start_time_obj.strftime("%Y-%m-%dT%H:%M:%S")
     
-    # Calculate the end time (1 hour after start time)
-    end_time_obj = start_time_obj + timedelta(hours=default_meeting_duration)
+    # Calculate the end time (1 hour after start time unless the request said how long)
+    end_time_obj = start_time_obj + timedelta(hours=duration_hours)
     end_time = end_time_obj.strftime("%Y-%m-%dT%H:%M:%S")
     # this contain all details about the calendar invite along with gmeet specs 
     event = {
@@ -119,18 +586,43 @@ def schedule_meeting(service, sender, date, time):
         'attendees': [{'email': sender}, {'email': organizer_email, 'responseStatus': 'accepted'}],
         'conferenceData': {
             'createRequest': {
-                'requestId': f"{uuid4()}",  # Can be a unique value for each request
+                'requestId': event_id or f"{uuid4()}",  # Can be a unique value for each request
                 'conferenceSolutionKey': {'type': 'hangoutsMeet'},
                 'status': {'statusCode': 'success'}
             }
         }
     }
-    event = service.events().insert(calendarId='primary', body=event,conferenceDataVersion=1).execute()
+    if event_id:
+        event['id'] = event_id
+    executor = getExecutor()
+    try:
+        event = await executor.execute(service.events().insert(calendarId='primary', body=event,conferenceDataVersion=1))
+    except HttpError as error:
+        if not event_id or error.resp.status != 409:
+            raise
+        event = await executor.execute(service.events().get(calendarId='primary', eventId=event_id))
     # Get the Google Meet link from the event response
     google_meet_link = event.get('conferenceData', {}).get('entryPoints', [{}])[0].get('uri', '')
     return google_meet_link
 
-def send_notification(service, recipient, meeting_link):
+async def send_slot_proposal(service, recipient, requested, proposed):
+    """Tell the sender the requested time is taken and which free slot is nearest to it, in their time zone."""
+    # the zone as the parser reads it back, an IANA name or e.g. UTC+05:30
+    zone = getattr(proposed.tzinfo, 'key', None) or proposed.tzname()
+    message = EmailMessage()
+    message.set_content(
+        f"The time you asked for ({requested:%Y-%m-%d %I:%M %p}) is already booked. "
+        f"The nearest free slot is {proposed:%Y-%m-%d at %I:%M %p} ({zone}), "
+        f"reply with \"please plan a meeting on {proposed:%Y-%m-%d} at {proposed:%I:%M %p} {zone}\" to book it."
+    )
+    message['To'] = recipient
+    # the subject carries the request phrase so the sender's "Re: ..." reply is picked up as a new request
+    message['Subject'] = f"{SUBJECT_PHRASE.capitalize()}: requested time unavailable"
+
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    await getExecutor().execute(service.users().messages().send(userId='me', body={'raw': raw}))
+
+async def send_notification(service, recipient, meeting_link):
     """Send a notification email to the sender."""
     message = EmailMessage()
     message.set_content(f"Your meeting has been scheduled. Join here: {meeting_link}")
@@ -138,36 +630,473 @@ def send_notification(service, recipient, meeting_link):
     message['Subject'] = "Automatic Meeting Scheduled Notification"
     
     raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    service.users().messages().send(userId='me', body={'raw': raw}).execute()
+    await getExecutor().execute(service.users().messages().send(userId='me', body={'raw': raw}))
 
-def main():
-    creds = authenticate_google_api()
-    
-    
+# marks the end of the items in a stage's inbox
+DONE = object()
+
+def item_ids(item):
+    """The message ids an item is about, a fetch item is a list of ids, later items start with the id."""
+    return list(item) if isinstance(item, list) else [item[0]]
+
+class Stage:
+    """One step of the meeting pipeline, run by `workers` tasks on the shared executor's loop.
+
+    handle(item, service, emit, finish) is a coroutine: emit passes an item to the next stage (waiting while
+    that stage's queue is full), finish records the outcome for a message that goes no further. The service
+    is shared by the workers, its calls go out over the executor's own connections. A handle failing with a
+    rate limit or server error is tried again up to `attempts` times, any other failure leaves the item's
+    messages for the next run.
+    """
+
+    def __init__(self, name, handle, workers=1, service=None, attempts=1, backoff_seconds=WRITE_BACKOFF_SECONDS):
+        self.name = name
+        self.handle = handle
+        self.workers = workers
+        self.service = service
+        self.attempts = attempts
+        self.backoff_seconds = backoff_seconds
+
+    async def call(self, item, emit, finish):
+        from googleapiclient.errors import HttpError
+
+        for attempt in range(self.attempts):
+            try:
+                return await self.handle(item, self.service, emit, finish)
+            except HttpError as error:
+                if attempt + 1 == self.attempts or error.resp.status not in RETRYABLE_STATUSES:
+                    raise
+                await asyncio.sleep(self.backoff_seconds * 2 ** attempt)
+
+    async def run(self, inbox, outbox, finish):
+        """Handle the items of the inbox until DONE, which is then passed on to the outbox."""
+        async def work():
+            while (item := await inbox.get()) is not DONE:
+                try:
+                    await self.call(item, outbox.put, finish)
+                except Exception as error:
+                    print(f"{self.name} failed for {', '.join(item_ids(item))}: {error}")
+                    for message_id in item_ids(item):
+                        finish(message_id, None)
+            # left for the other workers of this stage
+            await inbox.put(DONE)
+
+        await asyncio.gather(*(work() for _ in range(self.workers)))
+        await outbox.put(DONE)
+
+def is_meeting_request(message):
+    """A received message with the request phrase in its subject. The slot proposals this script sends carry the
+    phrase too, so sent mail that isn't also in the inbox never counts."""
+    labels = message.get('labelIds', [])
+    if 'SENT' in labels and 'INBOX' not in labels:
+        return False
+    return SUBJECT_PHRASE in (header_value(message, 'Subject') or '').lower()
+
+async def fetch_meeting_requests(message_ids, gmail_service, emit, finish):
+    """Fetch the headers of a batch of new messages, then the body of the ones asking for a meeting."""
+    metadata, failed = await fetch_messages(gmail_service, message_ids, format='metadata', metadataHeaders=['From', 'Subject'], fields=METADATA_FIELDS)
+    request_ids = []
+    for message_id in message_ids:
+        if message_id in metadata and is_meeting_request(metadata[message_id]):
+            request_ids.append(message_id)
+        elif message_id not in failed:
+            # other mail (or mail deleted meanwhile) is not a meeting request and isn't recorded
+            finish(message_id, 'ignored')
+    bodies, failed_bodies = await fetch_messages(gmail_service, request_ids, format='full', fields=BODY_FIELDS)
+    for message_id in request_ids:
+        if message_id in bodies:
+            await emit(bodies[message_id])
+        elif message_id not in failed_bodies:
+            finish(message_id, 'ignored')
+    for message_id in failed + failed_bodies:
+        finish(message_id, None)
+
+async def parse_meeting_request(msg, _, emit, finish):
+    """Find the sender and the asked for time and length in a message."""
+    sender, email_body = extract_sender_and_body(msg)
+    if not email_body:
+        finish(msg['id'], 'no body')
+        return
+    start, duration_hours = parse_email_for_meeting_details(email_body)
+    if not start:
+        print("Meeting details not found in email.")
+        finish(msg['id'], 'no meeting details')
+        return
+    await emit((msg['id'], sender, start, duration_hours))
+
+async def schedule_meeting_request(item, calendar_service, emit, finish, busy):
+    """Book the requested slot if the organizer is free then, otherwise pass on the nearest free slot."""
+    from googleapiclient.errors import HttpError
+
+    message_id, sender, start, duration_hours = item
+    duration = duration_hours * 3600
+    event_id = meeting_event_id(message_id)
+
+    async with busy.lock:
+        # a retried request keeps the slot it reserved the first time
+        if message_id not in busy.reserved:
+            margin = FREEBUSY_MARGIN_DAYS * 86400
+            await busy.ensure_loaded(calendar_service, start.timestamp() - margin, start.timestamp() + duration + margin)
+            if busy.is_free(start.timestamp(), start.timestamp() + duration):
+                busy.add(start.timestamp(), start.timestamp() + duration)
+                busy.reserved[message_id] = start.timestamp()
+            else:
+                proposed = busy.nearest_free(start.timestamp(), duration, datetime.now(timezone.utc).timestamp())
+
+    if message_id not in busy.reserved:
+        # the slot may be taken by this very request's meeting, booked by a run that stopped before recording it
+        try:
+            existing = await getExecutor().execute(calendar_service.events().get(calendarId='primary', eventId=event_id))
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            existing = None
+        if not existing or existing.get('status') == 'cancelled':
+            await emit((message_id, sender, 'proposed', (start, datetime.fromtimestamp(proposed, start.tzinfo))))
+            return
+
+    meeting_link = await schedule_meeting(calendar_service, sender, start, event_id, duration_hours)
+    await emit((message_id, sender, 'scheduled', meeting_link))
+
+async def notify_requester(item, gmail_service, emit, finish):
+    message_id, sender, outcome, details = item
+    if outcome == 'proposed':
+        await send_slot_proposal(gmail_service, sender, *details)
+        print("Requested time is taken, nearest free slot proposed.")
+    else:
+        await send_notification(gmail_service, sender, details)
+        print("Meeting scheduled and notification sent.")
+    finish(message_id, outcome)
+
+def connect_gmail():
+    return getService('gmail', 'v1', SCOPES)
+
+def connect_calendar():
+    return getService('calendar', 'v3', SCOPES)
+
+def run_meeting_pipeline(message_ids, on_result, gmail_connect=connect_gmail, calendar_connect=connect_calendar):
+    """Run message ids through fetch -> parse -> schedule -> notify, calling on_result(message_id, outcome)
+    in this thread for every message as it finishes.
+
+    The stages run at the same time on the shared executor's loop with bounded queues between them, so a
+    backlog takes about as long as its slowest stage rather than the sum of every call. outcome is None for
+    a message that failed. Ctrl+C cancels the calls that haven't gone out yet.
+    """
+    gmail_service = gmail_connect()
+    calendar_service = calendar_connect()
+    # outcomes are handed over from the loop to this thread, DONE marks the end of the run
+    results = queue.Queue()
+
+    def finish(message_id, outcome):
+        results.put((message_id, outcome))
+
+    async def pipeline():
+        try:
+            # busy times for the whole run, loaded by the first request that needs them
+            busy = BusySchedule()
+
+            async def schedule(item, calendar_service, emit, finish):
+                await schedule_meeting_request(item, calendar_service, emit, finish, busy)
+
+            stages = [
+                Stage('fetch', fetch_meeting_requests, FETCH_WORKERS, gmail_service),
+                Stage('parse', parse_meeting_request, PARSE_WORKERS),
+                Stage('schedule', schedule, SCHEDULE_WORKERS, calendar_service, attempts=WRITE_ATTEMPTS),
+                Stage('notify', notify_requester, NOTIFY_WORKERS, gmail_service, attempts=WRITE_ATTEMPTS),
+            ]
+            # the last stage emits nothing, its outbox only ever gets DONE
+            inboxes = [asyncio.Queue(STAGE_QUEUE_SIZE) for _ in stages] + [asyncio.Queue()]
+
+            async def feed():
+                for offset in range(0, len(message_ids), FETCH_BATCH_SIZE):
+                    await inboxes[0].put(message_ids[offset:offset + FETCH_BATCH_SIZE])
+                await inboxes[0].put(DONE)
+
+            await asyncio.gather(feed(), *(stage.run(inbox, outbox, finish)
+                                           for stage, inbox, outbox in zip(stages, inboxes, inboxes[1:])))
+        finally:
+            results.put(DONE)
+
+    running = getExecutor().submit(pipeline())
     try:
-        # Gmail Service
-        gmail_service = build('gmail', 'v1', credentials=creds)
-        sender, email_body = get_latest_email(gmail_service)
-        
-        if not email_body:
-            print("No email body to process.")
+        while (result := results.get()) is not DONE:
+            on_result(*result)
+        running.result()
+    except BaseException:
+        running.cancel()
+        raise
+
+def process_new_emails(store, gmail_connect=connect_gmail, calendar_connect=connect_calendar):
+    """Handle every meeting request that arrived since the last run, each message once.
+
+    A message is recorded as processed when it leaves the pipeline. The historyId only moves forward when
+    every new message was handled, otherwise the next run lists them again and skips the ones recorded.
+    A message failing in MAX_MESSAGE_ATTEMPTS runs is recorded as given up.
+    gmail_connect and calendar_connect return the service objects to use, the pipeline shares one of each.
+    """
+    message_ids, latest_history_id = list_new_message_ids(gmail_connect(), store)
+    done = processed_ids(store, message_ids)
+    new_ids = [message_id for message_id in message_ids if message_id not in done]
+    if not new_ids:
+        print("No new meeting emails.")
+        save_history_id(store, latest_history_id)
+        return
+
+    counts = {'scheduled': 0, 'proposed': 0, 'failed': 0, 'gave up': 0}
+
+    def record(message_id, outcome):
+        if outcome is None:
+            if record_failure(store, message_id) < MAX_MESSAGE_ATTEMPTS:
+                counts['failed'] += 1
+                return
+            print(f"Giving up on message {message_id} after {MAX_MESSAGE_ATTEMPTS} failed runs.")
+            outcome = 'gave up'
+        if outcome in counts:
+            counts[outcome] += 1
+        if outcome != 'ignored':
+            mark_processed(store, message_id, outcome)
+
+    run_meeting_pipeline(new_ids, record, gmail_connect, calendar_connect)
+    print(f"{len(new_ids)} new messages, {counts['scheduled']} meetings scheduled, {counts['proposed']} other slots proposed, "
+          f"{counts['failed']} left for the next run, {counts['gave up']} given up.")
+    if not counts['failed']:
+        save_history_id(store, latest_history_id)
+
+def watch_inbox(store, interval=WATCH_INTERVAL_SECONDS):
+    """Check for new meeting requests every interval seconds until Ctrl+C."""
+    from googleapiclient.errors import HttpError
+
+    try:
+        while True:
+            try:
+                process_new_emails(store)
+            except HttpError as error:
+                print(f"An error occurred: {error}")
+            sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+def run_command(store, args, gmail_connect=connect_gmail, calendar_connect=connect_calendar):
+    """Run one command, args as on the command line without the script name: none or 'check' handles the new
+    meeting requests, 'ping' answers 'pong'."""
+    if not args or args[0] == 'check':
+        process_new_emails(store, gmail_connect, calendar_connect)
+    elif args[0] == 'ping':
+        print("pong")
+    else:
+        print(f"Unknown command: {args[0]}")
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """One connection carries one command as a json line, {"args": [...]}, and gets back what the command printed."""
+    # a client that connects and sends nothing can't hold up the daemon
+    timeout = 10
+
+    def handle(self):
+        output = StringIO()
+        error = None
+        try:
+            args = json.loads(self.rfile.readline())['args']
+            with redirect_stdout(output):
+                self.server.run(args)
+        except Exception as exception:
+            error = str(exception) or type(exception).__name__
+        self.wfile.write(json.dumps({'output': output.getvalue(), 'error': error}).encode('utf-8') + b"\n")
+
+class CommandServer(socketserver.UnixStreamServer):
+    """Commands are handled one at a time on the serving thread, the only one using the state store. Between
+    commands serve_forever calls service_actions, which checks for new mail every interval seconds as watch does."""
+
+    def __init__(self, socket_path, store, interval=WATCH_INTERVAL_SECONDS, gmail_connect=connect_gmail, calendar_connect=connect_calendar):
+        self.store = store
+        self.interval = interval
+        self.gmail_connect = gmail_connect
+        self.calendar_connect = calendar_connect
+        self.last_check = monotonic()
+        super().__init__(socket_path, CommandHandler)
+
+    def run(self, args):
+        if not args or args[0] == 'check':
+            self.last_check = monotonic()
+        run_command(self.store, args, self.gmail_connect, self.calendar_connect)
+
+    def service_actions(self):
+        if monotonic() - self.last_check < self.interval:
             return
-        
-        date, time = parse_email_for_meeting_details(email_body)
-        if not date or not time:
-            print("Meeting details not found in email.")
+        self.last_check = monotonic()
+        try:
+            process_new_emails(self.store, self.gmail_connect, self.calendar_connect)
+        except Exception as error:
+            # the next round tries again
+            print(f"An error occurred: {error}")
+
+def serve_commands(store, interval=WATCH_INTERVAL_SECONDS):
+    """Keep the services and the executor warm, handle new mail every interval seconds and answer the thin client
+    (client.py) over a unix socket in between, until Ctrl+C or SIGTERM."""
+    from client import DAEMON_SOCKET_PATH, send_command
+
+    # a socket file left behind by a daemon that died is removed, a live daemon is left alone
+    if os.path.exists(DAEMON_SOCKET_PATH):
+        try:
+            send_command(['ping'])
+            print(f"A daemon is already listening on {DAEMON_SOCKET_PATH}")
             return
-    
-        # Calendar Service
-        calendar_service = build('calendar', 'v3', credentials=creds)
-        meeting_link = schedule_meeting(calendar_service, sender, date, time)
-        
-        # Send Notification
-        send_notification(gmail_service, sender, meeting_link)
-        print("Meeting scheduled and notification sent.")    
+        except ConnectionRefusedError:
+            os.unlink(DAEMON_SOCKET_PATH)
+
+    # build the services and handle what came in meanwhile before taking commands
+    process_new_emails(store)
+    # only this user may talk to the daemon, it acts with their gmail and calendar credentials
+    previous_umask = os.umask(0o177)
+    try:
+        server = CommandServer(DAEMON_SOCKET_PATH, store, interval)
+    finally:
+        os.umask(previous_umask)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Listening on {DAEMON_SOCKET_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(DAEMON_SOCKET_PATH)
+
+# request bodies in the formats the parser reads, mixed into the synthetic mail of parsebench
+SAMPLE_REQUESTS = [
+    "please plan a meeting on 2024-05-01 at 3:00 PM",
+    "please plan a meeting on 2024-05-01 at 11:30 AM for 30 minutes",
+    "Can we meet on May 1, 2024, 3pm IST?",
+    "How about 1st May 2024 at 9 a.m. for an hour",
+    "Let's talk on 13/05/2024 15:00-16:30",
+    "at 10.30am on Friday, 3rd May 2024 (UTC+2)",
+    "meeting 5 May at noon America/New_York, a 45-minute call",
+    "Sept. 9 @ 9 a.m. PST for 1h30m",
+    "from 2pm to 3:15pm on 12 June",
+    "Sent: 2024-04-19 10:15 AM\nHi,\nplease plan a meeting on 2024-05-01 at 3:00 PM",
+]
+
+def encode_body(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode()
+
+def gmail_message(message_id, sender, subject, text):
+    """A message in the shape fetch_messages returns it with BODY_FIELDS."""
+    return {'id': message_id, 'payload': {
+        'headers': [{'name': 'From', 'value': sender}, {'name': 'Subject', 'value': subject}],
+        'body': {'data': encode_body(text)},
+    }}
+
+def load_mail_corpus(paths):
+    """Messages from mbox files (e.g. a Google Takeout export) and folders of .eml files, in the Gmail API shape
+    so they go through the same decoding and parsing as live mail."""
+    messages = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources = []
+            for file_path in sorted(glob.glob(os.path.join(path, '*.eml'))):
+                with open(file_path, 'rb') as file:
+                    sources.append((file_path, email.message_from_binary_file(file)))
+        else:
+            sources = [(f"{path}:{number}", message) for number, message in enumerate(mailbox.mbox(path))]
+        for source_id, message in sources:
+            text = ''
+            for part in message.walk():
+                if part.get_content_type() == 'text/plain':
+                    payload = part.get_payload(decode=True) or b''
+                    text = payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+                    break
+            messages.append(gmail_message(str(message['Message-ID'] or source_id).strip(),
+                                          str(message['From'] or ''), str(message['Subject'] or ''), text))
+    return messages
+
+def generate_mail_corpus(count, seed=1):
+    """count synthetic messages: the SAMPLE_REQUESTS bodies and plain mail inside a few paragraphs of text,
+    one in 50 carrying a 1 MB quoted thread below."""
+    generator = random.Random(seed)
+    paragraph = "Thanks for the update on the quarterly numbers, I'll go through them before Friday. " * 6
+    thread = ("> " + paragraph + "\n") * (1024 * 1024 // (len(paragraph) + 3))
+    messages = []
+    for number in range(count):
+        request = generator.choice(SAMPLE_REQUESTS) if number % 2 == 0 else "No meeting needed for this one."
+        text = f"Hi,\n\n{paragraph}\n\n{request}\n\n{paragraph * generator.randint(1, 4)}\n\nRegards"
+        if number % 50 == 0:
+            text += "\n\n" + thread
+        messages.append(gmail_message(f"m{number}", "sender@example.com", SUBJECT_PHRASE, text))
+    return messages
+
+def benchmark_parser(messages):
+    """Messages/sec of decoding and parsing bodies: the whole body with the single phrase pattern the script
+    started with, the whole body with the full parser, and only the first BODY_SCAN_BYTES with the full parser."""
+    body_bytes = sum(len(message['payload']['body']['data']) * 3 // 4 for message in messages)
+    print(f"{len(messages)} messages, {body_bytes / 1024 / 1024:.1f} MB of bodies")
+
+    def whole_body_single_format(message):
+        email_body = base64.urlsafe_b64decode(message['payload']['body']['data']).decode('utf-8')
+        return re.search(r"please plan a meeting on (\d{4}-\d{2}-\d{2}) at (\d{1,2}:\d{2} (?:AM|PM))", email_body, re.IGNORECASE)
+
+    def whole_body_all_formats(message):
+        data = message['payload']['body']['data']
+        return parse_email_for_meeting_details(decode_body_head(data, len(data)))[0]
+
+    def body_head_all_formats(message):
+        return parse_email_for_meeting_details(extract_sender_and_body(message)[1])[0]
+
+    for name, parse in [('whole body, single format', whole_body_single_format),
+                        ('whole body, all formats', whole_body_all_formats),
+                        (f'first {BODY_SCAN_BYTES // 1024} KB, all formats', body_head_all_formats)]:
+        began = perf_counter()
+        found = sum(1 for message in messages if parse(message))
+        seconds = perf_counter() - began
+        print(f"{name:28} {len(messages) / seconds:10,.0f} messages/s ({seconds:.2f}s), {found} meetings found")
+
+def scan_mailboxes(paths, output=sys.stdout):
+    """Write the meeting requests in archived mail as csv (message id, sender, start, hours), picking out
+    requests by subject the same way the live run does."""
+    writer = csv.writer(output)
+    writer.writerow(['message_id', 'sender', 'start', 'hours'])
+    for message in load_mail_corpus(paths):
+        if not is_meeting_request(message):
+            continue
+        sender, email_body = extract_sender_and_body(message)
+        start, duration_hours = parse_email_for_meeting_details(email_body or '')
+        if start:
+            writer.writerow([message['id'], sender, start.isoformat(), duration_hours])
+
+def main():
+    # the parser tools work offline, without logging in
+    if len(sys.argv) > 1 and sys.argv[1] == 'parsebench':
+        # python index.py parsebench [message count | mbox files or .eml folders]
+        paths = sys.argv[2:]
+        if paths and not paths[0].isdigit():
+            benchmark_parser(load_mail_corpus(paths))
+        else:
+            benchmark_parser(generate_mail_corpus(int(paths[0]) if paths else 2000))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'scan':
+        # python index.py scan Takeout/Mail/All.mbox > requests.csv
+        scan_mailboxes(sys.argv[2:])
+        return
+
+    from googleapiclient.errors import HttpError
+
+    # log in up front, the services of every pipeline thread share these credentials
+    authenticate_google_api()
+    store = open_state_store()
+
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+            # python index.py watch [seconds], keeps handling new meeting requests as they arrive
+            watch_inbox(store, float(sys.argv[2]) if len(sys.argv) > 2 else WATCH_INTERVAL_SECONDS)
+        elif len(sys.argv) > 1 and sys.argv[1] == 'serve':
+            # python index.py serve [seconds], watches like watch and answers client.py in between
+            serve_commands(store, float(sys.argv[2]) if len(sys.argv) > 2 else WATCH_INTERVAL_SECONDS)
+        else:
+            # python index.py [check | ping]
+            run_command(store, sys.argv[1:])
         
     except HttpError as error:
         print(f"An error occurred: {error}")
+    finally:
+        store.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,279 @@
+import os
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+# shared Google API access for the calendar, sheets and gmail scripts. They add the repository root to sys.path and
+# call getService(api, version, scopes) instead of repeating the token.json / InstalledAppFlow / build() steps.
+# The google client libraries take a few hundred ms to import, so they are imported inside the functions that need
+# them: the login flow (google_auth_oauthlib) only when there is no usable token.json, the discovery client only
+# when the first service is built
+
+# credentials are refreshed this long before they expire, so a call never goes out with a token about to lapse
+REFRESH_MARGIN = timedelta(minutes=5)
+
+# discovery documents the installed client library doesn't bundle are downloaded once and kept here
+DISCOVERY_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "google_discovery")
+
+# API calls made through the shared executor (getExecutor) run on this many threads, with at most
+# API_LIMITS[api] calls to one API at a time (DEFAULT_API_LIMIT for the others)
+API_WORKERS = 16
+API_LIMITS = {"calendar": 4, "gmail": 8, "sheets": 2, "youtube": 4}
+DEFAULT_API_LIMIT = 4
+
+# credentials per (token file, scopes) and services per (api, version, scopes, api key, token file),
+# so a script building several services (or a long running one) logs in and builds each only once
+credentialsCache = {}
+servicesCache = {}
+cacheLock = threading.RLock()
+sharedExecutor = None
+
+
+# the cache interface build() accepts (get/set by discovery url), kept as one json file per document
+class DiscoveryFileCache:
+    def __init__(self, directory=DISCOVERY_CACHE_DIR):
+        self.directory = directory
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            with open(self.path(url), encoding="utf-8") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        os.makedirs(self.directory, exist_ok=True)
+        # written next to the target and renamed, so a concurrent reader never sees half a document
+        temporaryPath = f"{self.path(url)}.{os.getpid()}.tmp"
+        with open(temporaryPath, "w", encoding="utf-8") as file:
+            file.write(content)
+        os.replace(temporaryPath, self.path(url))
+
+
+def saveCredentials(creds, tokenPath):
+    with open(tokenPath, "w") as token:
+        token.write(creds.to_json())
+
+
+# refreshes over httplib2, which the API clients load anyway, instead of pulling in requests just for this
+def refreshCredentials(creds, tokenPath):
+    import httplib2
+    import google_auth_httplib2
+
+    creds.refresh(google_auth_httplib2.Request(httplib2.Http()))
+    saveCredentials(creds, tokenPath)
+
+
+def expiresSoon(creds):
+    if creds.expiry is None:
+        return False
+    # google-auth keeps the expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < REFRESH_MARGIN
+
+
+# The file token.json stores the user's access and refresh tokens, and is created automatically when the
+# authorization flow completes for the first time. If there are no (valid) credentials available, the user logs in
+def loadCredentials(scopes, tokenPath, clientSecretsPath):
+    from google.oauth2.credentials import Credentials
+
+    creds = None
+    if os.path.exists(tokenPath):
+        creds = Credentials.from_authorized_user_file(tokenPath, scopes)
+    if creds and creds.refresh_token and (not creds.valid or expiresSoon(creds)):
+        refreshCredentials(creds, tokenPath)
+    if not creds or not creds.valid:
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_secrets_file(clientSecretsPath, scopes)
+        creds = flow.run_local_server(port=0)
+        # Save the credentials for the next run
+        saveCredentials(creds, tokenPath)
+    return creds
+
+
+# cached user credentials for the scopes, refreshed ahead of expiry on every call so long running callers stay valid
+def getCredentials(scopes, tokenPath="token.json", clientSecretsPath="credentials.json"):
+    key = (os.path.abspath(tokenPath), tuple(sorted(scopes)))
+    with cacheLock:
+        creds = credentialsCache.get(key)
+        if creds is None:
+            creds = loadCredentials(list(scopes), tokenPath, clientSecretsPath)
+            credentialsCache[key] = creds
+        elif creds.refresh_token and (not creds.valid or expiresSoon(creds)):
+            refreshCredentials(creds, tokenPath)
+        return creds
+
+
+# build() from the discovery document bundled with the client library, never over the network. An API or version
+# the installed library doesn't know is fetched once and read from DISCOVERY_CACHE_DIR afterwards
+def buildService(api, version, **kwargs):
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import UnknownApiNameOrVersion
+
+    try:
+        return build(api, version, static_discovery=True, **kwargs)
+    except UnknownApiNameOrVersion:
+        return build(api, version, static_discovery=False, cache=DiscoveryFileCache(), **kwargs)
+
+
+# the service object for an API, built once per process. Services using user credentials pass their scopes,
+# API key services (e.g. youtube data) pass developerKey instead. Its requests can be built on any thread, calls
+# from several threads at once go through getExecutor(), which gives each thread its own connection
+def getService(api, version, scopes=None, developerKey=None, tokenPath="token.json", clientSecretsPath="credentials.json"):
+    key = (api, version, tuple(sorted(scopes or ())), developerKey, os.path.abspath(tokenPath))
+    with cacheLock:
+        credentials = getCredentials(scopes, tokenPath, clientSecretsPath) if scopes else None
+        service = servicesCache.get(key)
+        if service is None:
+            service = buildService(api, version, credentials=credentials, developerKey=developerKey)
+            servicesCache[key] = service
+        return service
+
+
+# the credentials a pool thread's AuthorizedHttp uses: the shared credentials object, with its refreshes (ahead of a
+# call or after a 401) made under cacheLock so two threads never refresh the same token at once
+class LockedCredentials:
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def __getattr__(self, name):
+        return getattr(self.credentials, name)
+
+    def before_request(self, request, method, url, headers):
+        with cacheLock:
+            if not self.credentials.valid:
+                self.credentials.refresh(request)
+        self.credentials.apply(headers)
+
+    def refresh(self, request):
+        with cacheLock:
+            self.credentials.refresh(request)
+
+
+# Runs googleapiclient requests concurrently for synchronous scripts. The executor owns one asyncio loop (on a
+# background thread) and a thread pool: coroutines submitted with run()/runAll() await execute(request), which
+# waits for a free slot of the request's API and makes the blocking call on a pool thread. Every pool thread keeps
+# its own httplib2 connection per credentials and reuses it for all its calls, instead of one per call or the
+# single, thread-unsafe one of the service.
+# Cancelling (Ctrl+C while run() waits, or a failing call in runAll) drops the calls that haven't started.
+# Calls already on the wire can't be interrupted, they finish on their thread and their results are discarded
+class ApiExecutor:
+    def __init__(self, workers=API_WORKERS, limits=None):
+        self.limits = {**API_LIMITS, **(limits or {})}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="google-api")
+        self.local = threading.local()
+        self.semaphores = {}
+        self.loop = None
+        self.loopThread = None
+        self.startLock = threading.Lock()
+
+    def startLoop(self):
+        with self.startLock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.loopThread = threading.Thread(target=self.loop.run_forever, name="google-api-loop", daemon=True)
+                self.loopThread.start()
+        return self.loop
+
+    # the semaphores belong to the executor's loop, so only coroutines running there use them
+    def semaphore(self, api):
+        if api not in self.semaphores:
+            self.semaphores[api] = asyncio.Semaphore(self.limits.get(api, DEFAULT_API_LIMIT))
+        return self.semaphores[api]
+
+    # this thread's transport for requests built with origin (the service's http): a pooled httplib2.Http,
+    # authorized with the same credentials. Other transports (e.g. a mock) are used as they are
+    def threadHttp(self, origin):
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.http import build_http
+
+        if isinstance(origin, AuthorizedHttp):
+            credentials = origin.credentials
+        elif type(origin) is httplib2.Http:
+            credentials = None
+        else:
+            return origin
+        pools = self.local.__dict__.setdefault("pools", {})
+        cached = pools.get(id(credentials))
+        if cached is None or cached[0] is not credentials:
+            http = build_http()
+            cached = (credentials, AuthorizedHttp(LockedCredentials(credentials), http=http) if credentials else http)
+            pools[id(credentials)] = cached
+        return cached[1]
+
+    def executeInThread(self, request, numRetries, timings):
+        from googleapiclient.http import BatchHttpRequest
+
+        origin = getattr(request, "http", None)
+        isBatch = isinstance(request, BatchHttpRequest)
+        if isBatch and origin is None:
+            # a batch goes out over the transport of its requests, the way BatchHttpRequest.execute() picks it
+            origin = next((part.http for part in request._requests.values() if part is not None), None)
+        http = self.threadHttp(origin)
+        kwargs = {"http": http} if http is not None else {}
+        if numRetries and not isBatch:
+            kwargs["num_retries"] = numRetries
+        began = perf_counter()
+        try:
+            return request.execute(**kwargs)
+        finally:
+            if timings is not None:
+                timings.append(perf_counter() - began)
+
+    # await the response of a request (or batch). api picks the limit, by default the one the request belongs to
+    # e.g. "calendar" for calendar.events.list. timings, if given a list, gets the seconds the call itself took
+    async def execute(self, request, api=None, numRetries=0, timings=None):
+        api = api or getattr(request, "methodId", "").split(".")[0] or "default"
+        async with self.semaphore(api):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.pool, self.executeInThread, request, numRetries, timings)
+
+    # run coroutines at once and return their results in order. The first failure cancels the rest and is raised,
+    # with returnExceptions every coroutine runs to its end and failures come back in place of their results
+    async def gather(self, coroutines, returnExceptions=False):
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return list(await asyncio.gather(*tasks, return_exceptions=returnExceptions))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # schedule a coroutine on the executor's loop and return its concurrent.futures.Future right away
+    def submit(self, coroutine):
+        if threading.current_thread() is self.loopThread:
+            raise RuntimeError("already on the executor's loop, await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.startLoop())
+
+    # run a coroutine from synchronous code and return its result, an interrupt while waiting cancels it
+    def run(self, coroutine):
+        future = self.submit(coroutine)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def runAll(self, coroutines, returnExceptions=False):
+        return self.run(self.gather(coroutines, returnExceptions))
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# the executor every script in the process shares, so API limits and connections are shared too
+def getExecutor():
+    global sharedExecutor
+    with cacheLock:
+        if sharedExecutor is None:
+            sharedExecutor = ApiExecutor()
+        return sharedExecutor
@@ -0,0 +1,29 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# the projects live in folders starting with a digit and each has its own index.py, so a project's script is
+# loaded under its own module name instead of being imported
+def load_project(folder, name, script='index.py'):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, folder, script))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def email_to_calendar():
+    return load_project('8_email_to_calendar_automation', 'email_to_calendar_automation')
+
+
+@pytest.fixture(scope='session')
+def email_to_calendar_client():
+    return load_project('8_email_to_calendar_automation', 'email_to_calendar_client', 'client.py')
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+# dates without a year are read as seen on this day
+TODAY = datetime(2024, 4, 20).date()
+
+# what the parser has to find in each body: (start, hours), or None when there is no meeting to book
+PARSER_CASES = [
+    ("please plan a meeting on 2024-05-01 at 3:00 PM", ('2024-05-01T15:00:00+05:30', 1)),
+    ("Please plan a meeting on 2024-05-01 at 03:00 pm", ('2024-05-01T15:00:00+05:30', 1)),
+    ("please plan a meeting on 2024-05-01 at 11:30 AM for 30 minutes", ('2024-05-01T11:30:00+05:30', 0.5)),
+    ("Can we meet on May 1, 2024, 3pm IST?", ('2024-05-01T15:00:00+05:30', 1)),
+    ("How about 1st May 2024 at 9 a.m. for an hour", ('2024-05-01T09:00:00+05:30', 1)),
+    ("Let's talk on 13/05/2024 15:00-16:30", ('2024-05-13T15:00:00+05:30', 1.5)),
+    ("Let's talk on 05/13/2024 at 3 PM", ('2024-05-13T15:00:00+05:30', 1)),
+    ("Let's talk on 05/05/2024 at 3 PM", ('2024-05-05T15:00:00+05:30', 1)),
+    ("Let's talk on 05/01/2024 at 3 PM", None),
+    ("at 10.30am on Friday, 3rd May 2024 (UTC+2)", ('2024-05-03T10:30:00+02:00', 1)),
+    ("meeting 5 May at noon America/New_York, a 45-minute call", ('2024-05-05T12:00:00-04:00', 0.75)),
+    ("Sept. 9 @ 9 a.m. PST for 1h30m", ('2024-09-09T09:00:00-08:00', 1.5)),
+    ("on 2024-11-04 at 9:00 AM ET", ('2024-11-04T09:00:00-05:00', 1)),
+    ("from 2pm to 3:15pm on 12 June", ('2024-06-12T14:00:00+05:30', 1.25)),
+    ("on 3 April at 4 PM", ('2025-04-03T16:00:00+05:30', 1)),
+    ("2024/6/7 at 18:00 hrs GMT+5:30 for 2 hours", ('2024-06-07T18:00:00+05:30', 2)),
+    ("on 2024-06-07 at 9am +0100", ('2024-06-07T09:00:00+01:00', 1)),
+    ("December 31, 2024 at 11:59 PM for half an hour", ('2024-12-31T23:59:00+05:30', 0.5)),
+    ("Meeting on 2024-02-30 at 3 PM, or else 2024-03-01 at 4 PM", ('2024-03-01T16:00:00+05:30', 1)),
+    ("Reply by 5 PM. We meet on 2024-06-01 at 11:00 AM ON the dot", ('2024-06-01T11:00:00+05:30', 1)),
+    ("please plan a meeting on 2024-05-01 at 3:00 PM, I'm away for 3 weeks after", ('2024-05-01T15:00:00+05:30', 1)),
+    ("meet on 2024-05-01 at 3 PM, it took 2 hours last time", ('2024-05-01T15:00:00+05:30', 1)),
+    ("On 2024-05-02 at 10am, a 2 hour meeting", ('2024-05-02T10:00:00+05:30', 2)),
+    ("A 2 hour meeting on 2024-05-02 at 10am", ('2024-05-02T10:00:00+05:30', 1)),
+    ("I waited for 2 hours yesterday. please plan a meeting on 2024-05-01 at 3:00 PM", ('2024-05-01T15:00:00+05:30', 1)),
+    ("please plan a meeting on 2024-05-01 at 3:00 PM for a minute", ('2024-05-01T15:00:00+05:30', 0.25)),
+    ("on 2024-05-01 from 3:00 PM to 3:05 PM", ('2024-05-01T15:00:00+05:30', 0.25)),
+    ("on 2024-05-01 at 3 PM for 90 minutes", ('2024-05-01T15:00:00+05:30', 1.5)),
+    ("on 2024-05-01 at 3 PM for 20 hours", ('2024-05-01T15:00:00+05:30', 1)),
+    ("2024-05-01 at 3:00 PM XYZ", ('2024-05-01T15:00:00+05:30', 1)),
+    ("Sent: 2024-04-19 10:15 AM\nHi,\nplease plan a meeting on 2024-05-01 at 3:00 PM", ('2024-05-01T15:00:00+05:30', 1)),
+    ("From 2pm on 2 May 2024 I'm free.\nPlease plan a\nmeeting on 2024-05-03 at 11am", ('2024-05-03T11:00:00+05:30', 1)),
+    ("Sent: 2024-04-19 10:15 AM\nplease plan a meeting soon", None),
+    ("please plan a meeting on 2024-05-01", None),
+    ("Call me at 3 PM", None),
+    ("Invoice 2024-05-01 total 13:00 due", None),
+    ("on 2024-13-01 at 3 PM", None),
+    ("on 2024-05-01 at 25:00", None),
+    ("version 1.2 may 5 pm", None),
+    ("", None),
+]
+
+
+
+@pytest.mark.parametrize('body, expected', PARSER_CASES)
+def test_parse_email_for_meeting_details(email_to_calendar, body, expected):
+    start, duration_hours = email_to_calendar.parse_email_for_meeting_details(body, TODAY)
+    assert ((start.isoformat(), duration_hours) if start else None) == expected
+
+
+def test_short_body_is_decoded_whole(email_to_calendar):
+    encoded = email_to_calendar.encode_body('Namaste 🙏 on 2024-05-01')
+    assert email_to_calendar.decode_body_head(encoded) == 'Namaste 🙏 on 2024-05-01'
+
+
+def test_unpadded_body_is_decoded(email_to_calendar):
+    assert email_to_calendar.decode_body_head(email_to_calendar.encode_body('ab').rstrip('=')) == 'ab'
+
+
+def test_character_cut_at_the_scan_limit_is_dropped(email_to_calendar):
+    limit = email_to_calendar.BODY_SCAN_BYTES
+    encoded = email_to_calendar.encode_body('x' * (limit - 1) + 'é' + 'tail')
+    assert email_to_calendar.decode_body_head(encoded) == 'x' * (limit - 1)
+
+
+def test_request_past_the_scan_limit_is_not_read(email_to_calendar):
+    body = 'x' * email_to_calendar.BODY_SCAN_BYTES + ' please plan a meeting on 2024-05-01 at 3:00 PM'
+    head = email_to_calendar.decode_body_head(email_to_calendar.encode_body(body))
+    assert email_to_calendar.parse_email_for_meeting_details(head)[0] is None
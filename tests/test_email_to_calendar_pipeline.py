@@ -0,0 +1,281 @@
+import base64
+import email
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+REQUEST_SUBJECT = 'Please plan a meeting'
+
+
+def utc_time(event_time):
+    """An event's local dateTime and timeZone as the UTC time freebusy answers with."""
+    local = datetime.fromisoformat(event_time['dateTime']).replace(tzinfo=ZoneInfo(event_time['timeZone']))
+    return local.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+class FakeRequest:
+    """A request object of the client library, execute() runs the call against the fake service."""
+
+    def __init__(self, call):
+        self.call = call
+
+    def execute(self, **kwargs):
+        return self.call()
+
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, **kwargs):
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except HttpError as error:
+                self.callback(request_id, None, error)
+
+
+class FakeGmail:
+    """The parts of the gmail service the script uses: history, search, get (also in batches) and send."""
+
+    def __init__(self):
+        self.messages_by_id = {}
+        self.history_records = []
+        self.history_id = 100
+        self.history_expired = False
+        self.failing_ids = set()
+        self.queries = []
+        self.sent = []
+
+    def add_mail(self, message_id, subject, body, sender='alice@example.com', labels=('INBOX',)):
+        self.history_id += 1
+        self.messages_by_id[message_id] = {'id': message_id, 'labelIds': list(labels), 'payload': {
+            'headers': [{'name': 'From', 'value': sender}, {'name': 'Subject', 'value': subject}],
+            'body': {'data': base64.urlsafe_b64encode(body.encode()).decode()},
+        }}
+        self.history_records.append((self.history_id, message_id))
+
+    def sent_emails(self):
+        return [email.message_from_bytes(base64.urlsafe_b64decode(body['raw'])) for body in self.sent]
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return FakeHistory(self)
+
+    def getProfile(self, userId, fields):
+        return FakeRequest(lambda: {'historyId': self.history_id})
+
+    def list(self, userId, q, pageToken, fields):
+        self.queries.append(q)
+        ids = [message_id for _, message_id in reversed(self.history_records)
+               if REQUEST_SUBJECT.lower() in self.messages_by_id[message_id]['payload']['headers'][1]['value'].lower()]
+        return FakeRequest(lambda: {'messages': [{'id': message_id} for message_id in ids]})
+
+    def get(self, userId, id, format=None, **params):
+        def call():
+            if id in self.failing_ids:
+                raise http_error(500)
+            if id not in self.messages_by_id:
+                raise http_error(404)
+            message = self.messages_by_id[id]
+            if format == 'metadata':
+                return {'id': id, 'labelIds': message['labelIds'], 'payload': {'headers': message['payload']['headers']}}
+            return message
+        return FakeRequest(call)
+
+    def send(self, userId, body):
+        return FakeRequest(lambda: self.sent.append(body))
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+
+class FakeHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes, pageToken, fields):
+        def call():
+            if self.gmail.history_expired:
+                raise http_error(404)
+            added = [record for record in self.gmail.history_records if record[0] > int(startHistoryId)]
+            return {'history': [{'id': history_id, 'messagesAdded': [{'message': {'id': message_id}}]}
+                                for history_id, message_id in added],
+                    'historyId': self.gmail.history_id}
+        return FakeRequest(call)
+
+
+class FakeCalendar:
+    """The parts of the calendar service the script uses: the primary calendar, freebusy and events."""
+
+    def __init__(self):
+        self.events_by_id = {}
+
+    def starts(self):
+        return sorted(event['start']['dateTime'] for event in self.events_by_id.values())
+
+    def calendarList(self):
+        return self
+
+    def freebusy(self):
+        return self
+
+    def events(self):
+        return self
+
+    def query(self, body):
+        busy = [{'start': utc_time(event['start']), 'end': utc_time(event['end'])} for event in self.events_by_id.values()]
+        return FakeRequest(lambda: {'calendars': {'primary': {'busy': busy}}})
+
+    def get(self, calendarId, eventId=None):
+        if eventId is None:
+            return FakeRequest(lambda: {'id': 'me@example.com'})
+
+        def call():
+            if eventId not in self.events_by_id:
+                raise http_error(404)
+            return self.events_by_id[eventId]
+        return FakeRequest(call)
+
+    def insert(self, calendarId, body, conferenceDataVersion):
+        def call():
+            if body['id'] in self.events_by_id:
+                raise http_error(409)
+            event = dict(body, conferenceData={'entryPoints': [{'uri': 'https://meet.example.com/' + body['id'][:6]}]})
+            self.events_by_id[body['id']] = event
+            return event
+        return FakeRequest(call)
+
+
+@pytest.fixture
+def gmail():
+    return FakeGmail()
+
+
+@pytest.fixture
+def calendar():
+    return FakeCalendar()
+
+
+@pytest.fixture
+def store(email_to_calendar, tmp_path):
+    store = email_to_calendar.open_state_store(str(tmp_path / 'state.sqlite3'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def run(email_to_calendar, store, gmail, calendar):
+    """One run of the script against the fake services, the way main() runs it."""
+    return lambda: email_to_calendar.process_new_emails(store, lambda: gmail, lambda: calendar)
+
+
+def test_first_run_only_searches_recent_requests(email_to_calendar, store, gmail, calendar, run):
+    gmail.add_mail('a', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-06 at 10:00 AM')
+    run()
+    assert gmail.queries == [f'{email_to_calendar.SEARCH_QUERY} newer_than:{email_to_calendar.SEARCH_DAYS}d']
+    assert calendar.starts() == ['2030-05-06T10:00:00']
+    assert email_to_calendar.get_history_id(store) == str(gmail.history_id)
+
+
+def test_request_is_booked_and_confirmed_once(email_to_calendar, store, gmail, calendar, run):
+    email_to_calendar.save_history_id(store, gmail.history_id)
+    gmail.add_mail('hello', 'hello', 'nothing to book here')
+    gmail.add_mail('a', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-06 at 10:00 AM for 30 minutes', sender='bob@example.com')
+    run()
+    run()
+    event, = calendar.events_by_id.values()
+    assert (event['start']['dateTime'], event['end']['dateTime']) == ('2030-05-06T10:00:00', '2030-05-06T10:30:00')
+    confirmation, = gmail.sent_emails()
+    assert confirmation['To'] == 'bob@example.com'
+
+
+def test_busy_slot_gets_a_proposal_whose_reply_is_booked(email_to_calendar, store, gmail, calendar, run):
+    email_to_calendar.save_history_id(store, gmail.history_id)
+    gmail.add_mail('a', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-06 at 10:00 AM')
+    gmail.add_mail('b', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-06 at 10:00 AM')
+    run()
+    assert calendar.starts() == ['2030-05-06T10:00:00']
+    proposal, = [sent for sent in gmail.sent_emails() if 'unavailable' in sent['Subject']]
+
+    # the reply quotes the proposal under the subject it came with
+    quoted = '\n'.join('> ' + line for line in proposal.get_payload(decode=True).decode().splitlines())
+    gmail.add_mail('reply', 'Re: ' + proposal['Subject'], 'Sounds good.\n\n' + quoted)
+    run()
+    assert calendar.starts() == ['2030-05-06T10:00:00', '2030-05-06T11:00:00']
+
+
+def test_sent_proposals_are_not_read_as_requests(email_to_calendar, store, gmail, calendar, run):
+    email_to_calendar.save_history_id(store, gmail.history_id)
+    gmail.add_mail('sent', 'Please plan a meeting: requested time unavailable',
+                   'please plan a meeting on 2030-05-06 at 11:00 AM', labels=('SENT',))
+    run()
+    assert calendar.starts() == []
+    assert gmail.sent == []
+
+
+def test_expired_history_falls_back_to_search(email_to_calendar, store, gmail, calendar, run):
+    email_to_calendar.save_history_id(store, gmail.history_id)
+    gmail.history_expired = True
+    gmail.add_mail('a', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-06 at 10:00 AM')
+    run()
+    assert len(gmail.queries) == 1
+    assert calendar.starts() == ['2030-05-06T10:00:00']
+
+
+def test_message_failing_every_run_is_given_up(email_to_calendar, store, gmail, calendar, run, monkeypatch):
+    monkeypatch.setattr(email_to_calendar, 'MAX_FETCH_ATTEMPTS', 1)
+    email_to_calendar.save_history_id(store, gmail.history_id)
+    start_history_id = gmail.history_id
+    gmail.add_mail('bad', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-07 at 10:00 AM')
+    gmail.add_mail('good', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-08 at 10:00 AM')
+    gmail.failing_ids.add('bad')
+
+    for _ in range(email_to_calendar.MAX_MESSAGE_ATTEMPTS - 1):
+        run()
+        # held back so the failed message is listed again
+        assert email_to_calendar.get_history_id(store) == str(start_history_id)
+    run()
+    assert email_to_calendar.get_history_id(store) == str(gmail.history_id)
+    assert calendar.starts() == ['2030-05-08T10:00:00']
+    assert dict(store.execute('SELECT message_id, outcome FROM processed')) == {'good': 'scheduled', 'bad': 'gave up'}
+
+
+def test_daemon_answers_ping_and_handles_new_mail_on_request(email_to_calendar, email_to_calendar_client, store, gmail, calendar, tmp_path):
+    socket_path = str(tmp_path / 'daemon.sock')
+    server = email_to_calendar.CommandServer(socket_path, store, 3600, lambda: gmail, lambda: calendar)
+
+    def ask(args):
+        # the daemon handles the command on this thread, where the store was opened
+        with ThreadPoolExecutor(1) as pool:
+            reply = pool.submit(email_to_calendar_client.send_command, args, socket_path)
+            server.handle_request()
+            return reply.result()
+
+    try:
+        assert ask(['ping']) == {'output': 'pong\n', 'error': None}
+        email_to_calendar.save_history_id(store, gmail.history_id)
+        gmail.add_mail('a', REQUEST_SUBJECT, 'please plan a meeting on 2030-05-06 at 10:00 AM')
+        reply = ask(['check'])
+        assert reply['error'] is None and '1 meetings scheduled' in reply['output']
+        assert calendar.starts() == ['2030-05-06T10:00:00']
+        assert ask(['nope'])['output'] == 'Unknown command: nope\n'
+    finally:
+        server.server_close()